@@ -0,0 +1,49 @@
+# api_json.py
+"""Сериализация и сжатие ответов JSON API каталога.
+
+JSON каждого товара считается один раз на версию каталога (хранится в
+CatalogSnapshot), а ответ /api/products склеивается из готовых байтов.
+orjson, если установлен, быстрее json.dumps; без него - json.dumps без
+экранирования кириллицы (\\uXXXX втрое длиннее UTF-8). Сжатие - br или
+gzip по Accept-Encoding клиента.
+"""
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Поддерживаемые Content-Encoding в порядке предпочтения
+CONTENT_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+# Уровни сжатия: на лету и для ответов, которые сжимаются один раз и кэшируются
+GZIP_LEVEL, GZIP_BEST_LEVEL = 6, 9
+BROTLI_QUALITY, BROTLI_BEST_QUALITY = 5, 11
+
+
+def dumps(obj):
+    """Компактный JSON в UTF-8 байтах"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def products_json(items, next_cursor):
+    """Тело ответа {"products": [...], "next_cursor": ...} из готового JSON товаров"""
+    return b'{"products":[' + b','.join(items) + b'],"next_cursor":' + dumps(next_cursor) + b'}'
+
+
+def compress(data, encoding, best=False):
+    """data, сжатые в encoding из CONTENT_ENCODINGS"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_BEST_QUALITY if best else BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # mtime=0: одинаковые данные - одинаковые байты
+        return gzip.compress(data, GZIP_BEST_LEVEL if best else GZIP_LEVEL, mtime=0)
+    raise ValueError(f"Unsupported encoding: {encoding}")
@@ -1,11 +1,29 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-import sqlite3
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, g, make_response, get_template_attribute
 import json
+import base64
+import hashlib
 from datetime import datetime
+from functools import wraps
 import os
-from coinbase_commerce.client import Client
+import secrets
+import threading
+import time
+from coinbase_commerce.error import SignatureVerificationError, WebhookInvalidPayload
 from coinbase_commerce.webhook import Webhook
+from markupsafe import Markup
+from werkzeug.security import safe_join
+from db import DB_PATH, connection, get_catalog_version
+from snapshot import CatalogSnapshot
+from search import fts_query, RANK_WEIGHTS
+from facets import FACETS
+from price_history import DAY, price_drops, price_points, price_summary
+from subscriptions import SUBSCRIPTION_KINDS, subscribe, telegram_user, unsubscribe
+from page_cache import PageCache, SLOT_MARKER, fill_slots
+from api_json import CONTENT_ENCODINGS, compress, dumps, products_json
+from payments import CHARGE_STALE_AFTER, ChargeQueue, CoinbaseClient, create_order, fail_order
+from webhooks import WebhookApplier, append_event
+from cart_store import Cart, make_cart_store
 
 app = Flask(__name__)
 # It's better to load the secret key from an environment variable for security
@@ -16,31 +34,156 @@ app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'your_secret_key')
 COINBASE_API_KEY = os.environ.get('COINBASE_COMMERCE_API_KEY')
 # Load webhook secret from environment variable
 COINBASE_WEBHOOK_SECRET = os.environ.get('COINBASE_WEBHOOK_SECRET')
+# API base URL override (e.g. fake_coinbase.py for local testing)
+COINBASE_API_URL = os.environ.get('COINBASE_API_URL')
 
-# Initialize the client if the API key is available
+# Initialize the client if the API key is available; charges are created by a background queue
 if COINBASE_API_KEY:
-    client = Client(api_key=COINBASE_API_KEY)
+    client = CoinbaseClient(COINBASE_API_KEY, COINBASE_API_URL)
+    charges = ChargeQueue(client)
 else:
     client = None
+    charges = None
     print("Warning: COINBASE_COMMERCE_API_KEY environment variable not set. Crypto payments will be disabled.")
 # --- End of Coinbase Setup ---
 
+# Токен бота: им проверяется подпись initData Telegram Web App при подписке на товар
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
+
+# Каталог отдается из снимка в памяти (0 - всегда читать из БД)
+CATALOG_SNAPSHOT = os.environ.get('CATALOG_SNAPSHOT', '1') != '0'
+# Как часто (в секундах) сверять версию снимка с БД (0 - при каждом обращении)
+CATALOG_VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', 0))
+# Максимум параметров в одном IN (...) запросе
+MAX_QUERY_PARAMS = 500
+# Размер страницы каталога по умолчанию и верхняя граница для ?limit=
+PAGE_SIZE = int(os.environ.get('CATALOG_PAGE_SIZE', 24))
+MAX_PAGE_SIZE = 100
+# За сколько дней показывать историю цены товара и искать подешевевшие товары
+PRICE_HISTORY_DAYS = int(os.environ.get('PRICE_HISTORY_DAYS', 90))
+PRICE_DROP_DAYS = int(os.environ.get('PRICE_DROP_DAYS', 7))
+
+# Статика по URL с ?v=<хэш содержимого> кэшируется на год: новый файл - новый URL
+STATIC_MAX_AGE = 365 * 24 * 3600
+# Кэш отрендеренных страниц каталога (0 - рендерить каждый раз), лимиты - страниц и символов HTML
+PAGE_CACHE = os.environ.get('PAGE_CACHE', '1') != '0'
+PAGE_CACHE_ENTRIES = int(os.environ.get('PAGE_CACHE_ENTRIES', 512))
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 32 * 1024 * 1024))
+# Макросы _session.html, которые подставляются в страницу из кэша при каждом запросе
+SESSION_SLOTS = ('cart_badge', 'flashes')
+# Готовых (сжатых) ответов /api/products без фильтров в памяти
+API_CACHE_ENTRIES = int(os.environ.get('API_CACHE_ENTRIES', 256))
+
+# Поля товара, которые можно запросить в /api/products?fields=...
+API_PRODUCT_FIELDS = frozenset((
+    'id', 'product_id', 'model', 'price', 'currency', 'old_price', 'current_color', 'current_memory',
+    'current_sim', 'image_url', 'product_url', 'parsed_at', 'created_at', 'display_order', 'is_featured',
+    'category', 'all_colors', 'all_memory', 'formatted_price', 'short_model', 'colors_list', 'memory_list',
+))
+
+# Колонка и направление сортировки для каждого sort_by (product_id - вторичный ключ)
+SORT_ORDERS = {
+    'price_asc': ('price', 'ASC'),
+    'price_desc': ('price', 'DESC'),
+    'name': ('model', 'ASC'),
+    'display_order': ('display_order', 'ASC'),
+}
+
+
+def encode_cursor(product, sort_by):
+    """Курсор следующей страницы: позиция последнего товара в выбранной сортировке"""
+    column, _ = SORT_ORDERS[sort_by]
+    raw = json.dumps([sort_by, product[column], product['product_id']], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by):
+    """Разбор курсора; ValueError, если он поврежден или от другой сортировки"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, product_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    
+    value_type = str if SORT_ORDERS[sort_by][0] == 'model' else int
+    if cursor_sort != sort_by or type(value) is not value_type or not isinstance(product_id, str):
+        raise ValueError('Invalid cursor')
+    return value, product_id
+
+
+def _format_listing_product(product):
+    """Поля для отображения товара в списках каталога"""
+    product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
+    product['short_model'] = product['model'][:30] + '...' if len(product['model']) > 30 else product['model']
+    
+    # Обрабатываем цвета и память
+    if product['all_colors']:
+        product['colors_list'] = product['all_colors'].split(',')
+    else:
+        product['colors_list'] = [product['current_color']] if product['current_color'] else []
+    
+    if product['all_memory']:
+        product['memory_list'] = product['all_memory'].split(',')
+    else:
+        product['memory_list'] = [product['current_memory']] if product['current_memory'] else []
+    
+    return product
 
-# Absolute path to the database
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'iphones_catalog.db')
+
+def _filter_conditions(category, search):
+    """Условия WHERE для фильтра по категории и поиска"""
+    conditions = []
+    params = []
+    
+    # Фильтр по категории
+    if category and category != 'all':
+        conditions.append("ic.category = ?")
+        params.append(category)
+    
+    # Полнотекстовый поиск (FTS5)
+    match = fts_query(search)
+    if match:
+        conditions.append("ic.id IN (SELECT rowid FROM catalog_search WHERE catalog_search MATCH ?)")
+        params.append(match)
+    
+    return conditions, params
 
 
 class iPhoneCatalog:
-    def __init__(self, db_path=DB_PATH):
+    def __init__(self, db_path=DB_PATH, use_snapshot=CATALOG_SNAPSHOT):
         self.db_path = db_path
+        self.use_snapshot = use_snapshot
+        self._snapshot = None
+        self._snapshot_checked_at = 0
+        self._snapshot_lock = threading.Lock()
+    
+    def snapshot(self, recheck=False):
+        """Актуальный снимок каталога (перестраивается при смене версии в БД; recheck - сверить без учета TTL)"""
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and not recheck and now - self._snapshot_checked_at < CATALOG_VERSION_TTL:
+            return snapshot
+        
+        with connection(self.db_path) as conn:
+            version = get_catalog_version(conn)
+            if snapshot is None or snapshot.version != version:
+                with self._snapshot_lock:
+                    snapshot = self._snapshot
+                    if snapshot is None or snapshot.version != version:
+                        snapshot = CatalogSnapshot(self._select_products(sort_by='display_order'), version)
+                        self._snapshot = snapshot
+        
+        self._snapshot_checked_at = now
+        return snapshot
     
     def get_all_products(self, category=None, sort_by='price_desc', search=None):
         """Получение всех товаров с фильтрацией"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
+        if self.use_snapshot:
+            return self.snapshot().get_all_products(category, sort_by, search)
+        return self._select_products(category, sort_by, search)
+    
+    def _select_products(self, category=None, sort_by='price_desc', search=None):
+        """Выборка товаров с фильтрацией из БД"""
         # Базовый запрос
         query = '''
             SELECT ic.*, 
@@ -51,19 +194,7 @@ class iPhoneCatalog:
             LEFT JOIN iphone_catalog_memory icm ON ic.product_id = icm.product_id
         '''
         
-        conditions = []
-        params = []
-        
-        # Фильтр по категории
-        if category and category != 'all':
-            conditions.append("ic.category = ?")
-            params.append(category)
-        
-        # Поиск
-        if search:
-            conditions.append("(ic.model LIKE ? OR ic.current_color LIKE ?)")
-            params.extend([f'%{search}%', f'%{search}%'])
-        
+        conditions, params = _filter_conditions(category, search)
         if conditions:
             query += " WHERE " + " AND ".join(conditions)
         
@@ -80,146 +211,464 @@ class iPhoneCatalog:
         else:
             query += " ORDER BY ic.display_order ASC"
         
-        cursor.execute(query, params)
-        products = [dict(row) for row in cursor.fetchall()]
+        with connection(self.db_path) as conn:
+            return [_format_listing_product(dict(row)) for row in conn.execute(query, params)]
+    
+    def get_products_page(self, category=None, sort_by='price_desc', search=None, cursor=None, limit=PAGE_SIZE):
+        """Страница товаров (keyset-пагинация): (товары, курсор следующей страницы или None)"""
+        if sort_by not in SORT_ORDERS:
+            sort_by = 'display_order'
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        after = decode_cursor(cursor, sort_by) if cursor else None
+        column, direction = SORT_ORDERS[sort_by]
         
-        # Форматируем данные для отображения
-        for product in products:
-            product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
-            product['short_model'] = product['model'][:30] + '...' if len(product['model']) > 30 else product['model']
-            
-            # Обрабатываем цвета и память
-            if product['all_colors']:
-                product['colors_list'] = product['all_colors'].split(',')
-            else:
-                product['colors_list'] = [product['current_color']] if product['current_color'] else []
-            
-            if product['all_memory']:
-                product['memory_list'] = product['all_memory'].split(',')
-            else:
-                product['memory_list'] = [product['current_memory']] if product['current_memory'] else []
+        # Берем на один товар больше, чтобы узнать, есть ли следующая страница
+        if self.use_snapshot:
+            products = self.snapshot().get_products_page(
+                category, search, column, direction == 'DESC', after, limit + 1)
+        else:
+            products = self._select_products_page(category, search, column, direction, after, limit + 1)
         
-        conn.close()
-        return products
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            next_cursor = encode_cursor(products[-1], sort_by)
+        return products, next_cursor
+    
+    def _select_products_page(self, category, search, column, direction, after, limit):
+        """Выборка одной страницы из БД: сначала строки страницы, потом их цвета и память"""
+        query = '''
+            SELECT ic.*, 
+                   (SELECT GROUP_CONCAT(DISTINCT color_name) FROM iphone_catalog_colors
+                    WHERE product_id = ic.product_id) as all_colors,
+                   (SELECT GROUP_CONCAT(DISTINCT memory_size) FROM iphone_catalog_memory
+                    WHERE product_id = ic.product_id) as all_memory
+            FROM iphones_catalog ic
+        '''
+        
+        conditions, params = _filter_conditions(category, search)
+        if after is not None:
+            operator = '<' if direction == 'DESC' else '>'
+            conditions.append(f"(ic.{column}, ic.product_id) {operator} (?, ?)")
+            params.extend(after)
+        
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY ic.{column} {direction}, ic.product_id {direction} LIMIT ?"
+        params.append(limit)
+        
+        with connection(self.db_path) as conn:
+            return [_format_listing_product(dict(row)) for row in conn.execute(query, params)]
+    
+    def products_json(self, products, fields=None):
+        """JSON товаров (байты) для API: только поля fields или целиком - готовый из снимка"""
+        if fields:
+            return [dumps({field: p[field] for field in fields}) for p in products]
+        if self.use_snapshot:
+            return self.snapshot().to_json(products)
+        return [dumps(p) for p in products]
+    
+    def get_faceted_products(self, filters, search=None, sort_by='price_desc', limit=PAGE_SIZE):
+        """Фильтр по цвету, памяти, SIM, категории и диапазону цены со счетчиками фасетов.
+        
+        Всегда отвечает из снимка: битовые индексы фасетов строятся вместе с ним.
+        """
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        return self.snapshot().get_faceted_products(filters, search, sort_by, limit)
+    
+    def search_products(self, search, limit=10):
+        """Поиск товаров, отсортированных по релевантности"""
+        match = fts_query(search)
+        if not match:
+            return []
+        
+        weights = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+        with connection(self.db_path) as conn:
+            rows = conn.execute(f'''
+                SELECT ic.product_id FROM catalog_search 
+                JOIN iphones_catalog ic ON ic.id = catalog_search.rowid 
+                WHERE catalog_search MATCH ? 
+                ORDER BY bm25(catalog_search, {weights}) 
+                LIMIT ?
+            ''', (match, min(max(limit, 1), MAX_PAGE_SIZE))).fetchall()
+        
+        return list(self.get_products_by_ids([row[0] for row in rows]).values())
+    
+    def version(self):
+        """Версия каталога, от которой зависят ответы (снимок сверяет ее с БД не чаще CATALOG_VERSION_TTL)"""
+        if self.use_snapshot:
+            return self.snapshot().version
+        with connection(self.db_path) as conn:
+            return get_catalog_version(conn)
     
     def get_categories(self):
         """Получение списка категорий"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        if self.use_snapshot:
+            return self.snapshot().get_categories()
         
-        cursor.execute('''
-            SELECT category, COUNT(*) as count 
-            FROM iphones_catalog 
-            GROUP BY category 
-            ORDER BY count DESC
-        ''')
+        with connection(self.db_path) as conn:
+            rows = conn.execute('''
+                SELECT category, COUNT(*) as count 
+                FROM iphones_catalog 
+                GROUP BY category 
+                ORDER BY count DESC
+            ''').fetchall()
         
-        categories = [{'name': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        conn.close()
+        categories = [{'name': row[0], 'count': row[1]} for row in rows]
         return categories
     
+    def count_products(self, category=None, search=None):
+        """Количество товаров (без выборки самих товаров)"""
+        if self.use_snapshot:
+            return self.snapshot().count_products(category, search)
+        
+        match = fts_query(search)
+        if match and not (category and category != 'all'):
+            # Только поиск: считаем прямо по поисковому индексу
+            with connection(self.db_path) as conn:
+                return conn.execute('SELECT COUNT(*) FROM catalog_search WHERE catalog_search MATCH ?', (match,)).fetchone()[0]
+        
+        query = 'SELECT COUNT(*) FROM iphones_catalog ic'
+        conditions, params = _filter_conditions(category, search)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        
+        with connection(self.db_path) as conn:
+            return conn.execute(query, params).fetchone()[0]
+    
+    def get_similar_products(self, product, limit=4):
+        """Похожие товары: та же категория, без самого товара, сначала дорогие"""
+        if self.use_snapshot:
+            return self.snapshot().get_similar_products(product, limit)
+        
+        with connection(self.db_path) as conn:
+            rows = conn.execute('''
+                SELECT * FROM iphones_catalog 
+                WHERE category = ? AND product_id != ? 
+                ORDER BY price DESC 
+                LIMIT ?
+            ''', (product['category'], product['product_id'], limit)).fetchall()
+        
+        products = [dict(row) for row in rows]
+        for similar in products:
+            similar['formatted_price'] = f"{similar['price']:,} руб.".replace(',', ' ')
+        
+        return products
+    
     def get_featured_products(self, limit=6):
         """Получение рекомендуемых товаров"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        if self.use_snapshot:
+            return self.snapshot().get_featured_products(limit)
         
-        cursor.execute('''
-            SELECT * FROM iphones_catalog 
-            WHERE is_featured = 1 
-            ORDER BY price DESC 
-            LIMIT ?
-        ''', (limit,))
+        with connection(self.db_path) as conn:
+            rows = conn.execute('''
+                SELECT * FROM iphones_catalog 
+                WHERE is_featured = 1 
+                ORDER BY price DESC 
+                LIMIT ?
+            ''', (limit,)).fetchall()
         
-        products = [dict(row) for row in cursor.fetchall()]
+        products = [dict(row) for row in rows]
         for product in products:
             product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
         
-        conn.close()
         return products
     
     def get_product_by_id(self, product_id):
         """Получение товара по ID"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        if self.use_snapshot:
+            return self.snapshot().get_product_by_id(product_id)
         
-        cursor.execute('''
-            SELECT ic.*, 
-                   GROUP_CONCAT(DISTINCT icc.color_name) as all_colors,
-                   GROUP_CONCAT(DISTINCT icm.memory_size) as all_memory
-            FROM iphones_catalog ic
-            LEFT JOIN iphone_catalog_colors icc ON ic.product_id = icc.product_id
-            LEFT JOIN iphone_catalog_memory icm ON ic.product_id = icm.product_id
-            WHERE ic.product_id = ?
-            GROUP BY ic.product_id
-        ''', (product_id,))
+        return self.get_products_by_ids([product_id]).get(product_id)
+    
+    def get_products_by_ids(self, product_ids):
+        """Получение нескольких товаров одним запросом: {product_id: товар}"""
+        if self.use_snapshot:
+            return self.snapshot().get_products_by_ids(product_ids)
         
-        product = cursor.fetchone()
-        if product:
-            product = dict(product)
-            product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
-            
-            if product['all_colors']:
-                product['colors_list'] = product['all_colors'].split(',')
-            else:
-                product['colors_list'] = []
-            
-            if product['all_memory']:
-                product['memory_list'] = product['all_memory'].split(',')
-            else:
-                product['memory_list'] = []
+        product_ids = list(dict.fromkeys(product_ids))
+        products = {}
         
-        conn.close()
-        return product
+        with connection(self.db_path) as conn:
+            # Делим на части, чтобы не упереться в лимит параметров SQLite
+            for start in range(0, len(product_ids), MAX_QUERY_PARAMS):
+                chunk = product_ids[start:start + MAX_QUERY_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(f'''
+                    SELECT ic.*, 
+                           GROUP_CONCAT(DISTINCT icc.color_name) as all_colors,
+                           GROUP_CONCAT(DISTINCT icm.memory_size) as all_memory
+                    FROM iphones_catalog ic
+                    LEFT JOIN iphone_catalog_colors icc ON ic.product_id = icc.product_id
+                    LEFT JOIN iphone_catalog_memory icm ON ic.product_id = icm.product_id
+                    WHERE ic.product_id IN ({placeholders})
+                    GROUP BY ic.product_id
+                ''', chunk).fetchall()
+                
+                for row in rows:
+                    product = dict(row)
+                    product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
+                    
+                    if product['all_colors']:
+                        product['colors_list'] = product['all_colors'].split(',')
+                    else:
+                        product['colors_list'] = []
+                    
+                    if product['all_memory']:
+                        product['memory_list'] = product['all_memory'].split(',')
+                    else:
+                        product['memory_list'] = []
+                    
+                    products[product['product_id']] = product
+        
+        # Сохраняем порядок, в котором запрошены ID
+        return {pid: products[pid] for pid in product_ids if pid in products}
+    
+    def get_price_history(self, product_id, days=PRICE_HISTORY_DAYS):
+        """Минимум, максимум и точки цены товара за последние days дней (None, если истории нет)"""
+        with connection(self.db_path) as conn:
+            history = price_summary(price_points(conn, product_id, days))
+        if history:
+            history['days'] = days
+            for key in ('min', 'max'):
+                history[f'formatted_{key}'] = f"{history[key]:,} руб.".replace(',', ' ')
+        return history
+    
+    def get_price_drops(self, days=PRICE_DROP_DAYS, limit=20):
+        """Подешевевшие за последние days дней товары, сначала с наибольшей скидкой"""
+        with connection(self.db_path) as conn:
+            drops = price_drops(conn, days, min(max(limit, 1), MAX_PAGE_SIZE))
+        for product in drops:
+            product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
+            product['formatted_was_price'] = f"{product['was_price']:,} руб.".replace(',', ' ')
+        return drops
 
 # Инициализация каталога
 catalog = iPhoneCatalog()
+page_cache = PageCache(PAGE_CACHE_ENTRIES, PAGE_CACHE_SIZE)
+webhook_applier = WebhookApplier()
+api_cache = PageCache(API_CACHE_ENTRIES, PAGE_CACHE_SIZE)
+carts = make_cart_store()
 
+# filename -> (mtime, хэш содержимого)
+_static_hashes = {}
+
+def static_hash(filename):
+    """Короткий хэш содержимого файла из static/ (None, если файла нет)"""
+    path = safe_join(app.static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path) if path else None
+    except OSError:
+        return None
+    cached = _static_hashes.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    if mtime is None:
+        return None
+    with open(path, 'rb') as f:
+        digest = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    _static_hashes[filename] = (mtime, digest)
+    return digest
+
+@app.url_defaults
+def static_version(endpoint, values):
+    """url_for('static', ...) добавляет ?v=<хэш содержимого>"""
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        version = static_hash(values['filename'])
+        if version:
+            values['v'] = version
+
+def current_cart():
+    """Корзина текущей сессии: одно чтение из хранилища за запрос"""
+    if 'cart' not in g:
+        cart_id = session.get('cart_id')
+        g.cart = (carts.get(cart_id) if cart_id else None) or Cart()
+        # Корзина из cookie прежних версий переезжает в хранилище
+        if 'cart' in session:
+            items = dict(g.cart.items)
+            for product_id, quantity in session.pop('cart').items():
+                items[product_id] = items.get(product_id, 0) + quantity
+            save_cart(items)
+    return g.cart
+
+def save_cart(items):
+    """Сохранение товаров корзины {product_id: количество} с пересчетом их числа"""
+    cart_id = session.get('cart_id')
+    if not items:
+        if cart_id:
+            carts.delete(cart_id)
+            session.pop('cart_id')
+        g.cart = Cart()
+        return
+    if not cart_id:
+        cart_id = session['cart_id'] = secrets.token_urlsafe(16)
+    g.cart = Cart(items)
+    carts.save(cart_id, g.cart)
+
+def _cart_count():
+    return current_cart().count
+
+def _session_slot_html(name):
+    """HTML макроса name из _session.html для текущей сессии"""
+    macro = get_template_attribute('_session.html', name)
+    return str(macro(_cart_count()) if name == 'cart_badge' else macro())
+
+def session_slot(name):
+    """Часть страницы из сессии: при рендере в кэш - метка, иначе сразу HTML"""
+    if g.get('page_cache_render'):
+        return Markup(SLOT_MARKER.format(name))
+    return Markup(_session_slot_html(name))
+
+def render_cached(template, args, context):
+    """render_template через page_cache по (шаблон, args, версия каталога).
+    
+    context() (выборка данных для шаблона) вызывается только при промахе;
+    счетчик корзины и flash-сообщения подставляются при каждом запросе.
+    """
+    if not PAGE_CACHE:
+        return render_template(template, **context())
+    
+    version = catalog.version()
+    key = (template, args)
+    html = page_cache.get(key, version)
+    if html is None:
+        start = time.perf_counter()
+        g.page_cache_render = True
+        try:
+            html = render_template(template, **context())
+        finally:
+            g.page_cache_render = False
+        page_cache.put(key, version, html, (time.perf_counter() - start) * 1000)
+    return fill_slots(html, {name: _session_slot_html(name) for name in SESSION_SLOTS})
+
+def history_day():
+    """Номер текущих суток: окно истории цен сдвигается раз в сутки и без новой версии каталога"""
+    return int(time.time() // DAY)
+
+
+def catalog_etag(private=False, encoded=False, key=None):
+    """ETag ответа из версии каталога и URL; при совпадении If-None-Match - 304 без выборки и рендера.
+    
+    private=True для HTML-страниц: в них есть счетчик корзины из сессии,
+    он тоже входит в ETag, а страница с flash-сообщением не кэшируется.
+    key() - то, от чего ответ зависит помимо версии каталога (то же, что
+    view добавляет в ключ render_cached), тоже входит в ETag.
+    encoded=True - view сжимает ответ по Accept-Encoding: ETag получает
+    суффикс выбранного сжатия, и у 200 и 304 есть Vary: Accept-Encoding.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            state = f"{catalog.version()}|{request.full_path}"
+            if key:
+                state += f"|{key()}"
+            if private:
+                if session.get('_flashes'):
+                    return view(*args, **kwargs)
+                state += f"|{_cart_count()}"
+            etag = hashlib.blake2b(state.encode('utf-8'), digest_size=12).hexdigest()
+            # У сжатого ответа свой ETag: <etag>-<Content-Encoding>, совпасть может только
+            # вариант со сжатием, которое view выберет для этого запроса
+            if encoded:
+                encoding = request.accept_encodings.best_match(CONTENT_ENCODINGS)
+                if encoding:
+                    etag = f"{etag}-{encoding}"
+            
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Одинаковый Vary у 200 и 304: разделяемый кэш не подменит вариант после ревалидации
+            if private:
+                response.vary.add('Cookie')
+            if encoded:
+                response.vary.add('Accept-Encoding')
+            # Хранить можно, но перед использованием - сверить ETag
+            response.headers['Cache-Control'] = f"{'private' if private else 'public'}, no-cache"
+            return response
+        return wrapper
+    return decorator
+
+
+@app.before_request
+def open_db_connection():
+    """Закрепляем соединение из пула за запросом"""
+    g.db_context = connection()
+    g.db = g.db_context.__enter__()
+
+@app.teardown_request
+def close_db_connection(exc):
+    """Возвращаем соединение запроса в пул"""
+    db_context = g.pop('db_context', None)
+    if db_context is not None:
+        g.pop('db', None)
+        db_context.__exit__(None, None, None)
 
 
 @app.route('/')
+@catalog_etag(private=True)
 def index():
     """Главная страница"""
-    featured_products = catalog.get_featured_products(6)
-    categories = catalog.get_categories()
-    
-    return render_template('index.html', 
-                         featured_products=featured_products,
-                         categories=categories,
-                         total_products=len(catalog.get_all_products()))
+    return render_cached('index.html', (), lambda: dict(
+        featured_products=catalog.get_featured_products(6),
+        categories=catalog.get_categories(),
+        total_products=catalog.count_products()))
 
 @app.route('/catalog')
+@catalog_etag(private=True)
 def catalog_page():
     """Страница каталога"""
     category = request.args.get('category', 'all')
     sort_by = request.args.get('sort', 'price_desc')
     search = request.args.get('search', '')
+    cursor = request.args.get('cursor')
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    if cursor:
+        try:
+            decode_cursor(cursor, sort_by if sort_by in SORT_ORDERS else 'display_order')
+        except ValueError:
+            return "Некорректный курсор страницы", 400
     
-    products = catalog.get_all_products(category, sort_by, search)
-    categories = catalog.get_categories()
+    def context():
+        products, next_cursor = catalog.get_products_page(category, sort_by, search, cursor, limit)
+        return dict(products=products,
+                    categories=catalog.get_categories(),
+                    current_category=category,
+                    current_sort=sort_by,
+                    search_query=search,
+                    next_cursor=next_cursor,
+                    total_products=catalog.count_products(category, search))
     
-    return render_template('catalog.html',
-                         products=products,
-                         categories=categories,
-                         current_category=category,
-                         current_sort=sort_by,
-                         search_query=search,
-                         total_products=len(products))
+    return render_cached('catalog.html', (category, sort_by, search, cursor, limit), context)
 
 @app.route('/product/<product_id>')
+@catalog_etag(private=True, key=history_day)
 def product_detail(product_id):
     """Страница товара"""
     product = catalog.get_product_by_id(product_id)
     if not product:
         return "Товар не найден", 404
     
-    # Похожие товары
-    similar_products = catalog.get_all_products(category=product['category'])[:4]
-    
-    return render_template('product.html',
-                         product=product,
-                         similar_products=similar_products)
+    # Похожие товары и история цены; история за последние N дней меняется и без новой версии каталога
+    return render_cached('product.html', (product_id, history_day()), lambda: dict(
+        product=product,
+        similar_products=catalog.get_similar_products(product, 4),
+        price_history=catalog.get_price_history(product_id)))
+
+def start_checkout(items, charge_info, fallback_url):
+    """Creates an order from (product_id, qty, unit_price) items, queues its charge
+    and sends the buyer to the order page to wait for it."""
+    with connection() as conn:
+        order_id = create_order(conn, items, charge_info)
+        if not charges.submit(order_id):
+            fail_order(conn, order_id, 'Payment service is busy')
+            flash('Payment service is busy, please try again in a minute.', 'danger')
+            return redirect(fallback_url)
+    return redirect(url_for('order_status', order_id=order_id))
+
 
 @app.route('/crypto_pay_cart')
 def crypto_pay_cart():
@@ -228,73 +677,47 @@ def crypto_pay_cart():
         flash('Crypto payments are currently disabled.', 'danger')
         return redirect(url_for('cart'))
 
-    cart_session = session.get('cart', {})
+    cart_session = current_cart().items
     if not cart_session:
         flash('Your cart is empty.', 'info')
         return redirect(url_for('cart'))
 
     # 1. Calculate total price and gather item details
     total_price = 0
-    item_ids = []
+    items = []
     item_descriptions = []
+    products = catalog.get_products_by_ids(cart_session.keys())
     for product_id, quantity in cart_session.items():
-        product = catalog.get_product_by_id(product_id)
+        product = products.get(product_id)
         if product:
             total_price += product['price'] * quantity
-            item_ids.append(product_id)
+            items.append((product_id, quantity, product['price']))
             item_descriptions.append(f"{product['model']} (x{quantity})")
 
     if total_price == 0:
         flash('Cannot process a zero-value cart.', 'danger')
         return redirect(url_for('cart'))
 
-    # 2. Create a single order for the whole cart
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    # Store a comma-separated list of product IDs for simplicity
-    product_ids_str = ",".join(item_ids)
-    cursor.execute(
-        'INSERT INTO orders (product_id, price, status) VALUES (?, ?, ?)',
-        (product_ids_str, total_price, 'new')
-    )
-    conn.commit()
-    order_id = cursor.lastrowid
-    conn.close()
-
-    # 3. Create a Coinbase Commerce charge for the cart
-    charge_info = {
-        'name': f'Your Order #{order_id} from TonStore',
-        'description': ", ".join(item_descriptions),
-        'local_price': {
-            'amount': str(total_price),
-            'currency': 'RUB'
-        },
-        'pricing_type': 'fixed_price',
-        'metadata': {
-            'order_id': order_id,
-            'cart_items': json.dumps(cart_session)
-        },
-        'redirect_url': url_for('order_status', order_id=order_id, _external=True),
-        'cancel_url': url_for('cart', _external=True),
-    }
-
-    try:
-        charge = client.charge.create(**charge_info)
-        
-        # Save the charge code to the order
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE orders SET charge_code = ?, status = ? WHERE id = ?',
-            (charge.code, 'pending', order_id)
-        )
-        conn.commit()
-        conn.close()
-
-        return redirect(charge.hosted_url)
-    except Exception as e:
-        flash(f'Error creating payment: {e}', 'danger')
-        return redirect(url_for('cart'))
+    # 2. Create a single order for the whole cart (items go to order_items), with its Coinbase Commerce charge request
+    def charge_info(order_id):
+        return {
+            'name': f'Your Order #{order_id} from TonStore',
+            'description': ", ".join(item_descriptions),
+            'local_price': {
+                'amount': str(total_price),
+                'currency': 'RUB'
+            },
+            'pricing_type': 'fixed_price',
+            'metadata': {
+                'order_id': order_id,
+                'cart_items': json.dumps(cart_session)
+            },
+            'redirect_url': url_for('order_status', order_id=order_id, _external=True),
+            'cancel_url': url_for('cart', _external=True),
+        }
+
+    # 3. The charge is created in the background; the order page waits for it
+    return start_checkout(items, charge_info, url_for('cart'))
 
 
 @app.route('/crypto_pay/<product_id>')
@@ -308,124 +731,212 @@ def crypto_pay(product_id):
     if not product:
         return "Товар не найден", 404
 
-    # 1. Create a new order in the database
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO orders (product_id, price, status) VALUES (?, ?, ?)',
-        (product['product_id'], product['price'], 'new')
-    )
-    conn.commit()
-    order_id = cursor.lastrowid
-    conn.close()
-
-    # 2. Create a Coinbase Commerce charge
-    charge_info = {
-        'name': product['model'],
-        'description': f"Order #{order_id}",
-        'local_price': {
-            'amount': str(product['price']),
-            'currency': 'RUB'
-        },
-        'pricing_type': 'fixed_price',
-        'metadata': {
-            'order_id': order_id,
-            'product_id': product['product_id']
-        },
-        'redirect_url': url_for('order_status', order_id=order_id, _external=True),
-        'cancel_url': url_for('product_detail', product_id=product_id, _external=True),
-    }
-
-    try:
-        charge = client.charge.create(**charge_info)
-        
-        # Save the charge code to the order
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE orders SET charge_code = ?, status = ? WHERE id = ?',
-            (charge.code, 'pending', order_id)
-        )
-        conn.commit()
-        conn.close()
-
-        return redirect(charge.hosted_url)
-    except Exception as e:
-        flash(f'Error creating payment: {e}', 'danger')
-        return redirect(url_for('product_detail', product_id=product_id))
+    # Create the order; the Coinbase Commerce charge is created in the background
+    def charge_info(order_id):
+        return {
+            'name': product['model'],
+            'description': f"Order #{order_id}",
+            'local_price': {
+                'amount': str(product['price']),
+                'currency': 'RUB'
+            },
+            'pricing_type': 'fixed_price',
+            'metadata': {
+                'order_id': order_id,
+                'product_id': product['product_id']
+            },
+            'redirect_url': url_for('order_status', order_id=order_id, _external=True),
+            'cancel_url': url_for('product_detail', product_id=product_id, _external=True),
+        }
+
+    return start_checkout([(product['product_id'], 1, product['price'])], charge_info,
+                          url_for('product_detail', product_id=product_id))
 
 
 @app.route('/webhooks/coinbase', methods=['POST'])
 def coinbase_webhook():
-    """Handles incoming webhooks from Coinbase Commerce."""
+    """Handles incoming webhooks from Coinbase Commerce.
+
+    A verified event is appended to the webhook_events log and acknowledged at once;
+    order statuses are updated from the log in batches by webhook_applier.
+    """
     if not COINBASE_WEBHOOK_SECRET:
         return "Webhook secret not configured", 500
 
-    sig_header = request.headers.get('X-CC-Webhook-Signature')
-    payload = request.data
+    sig_header = request.headers.get('X-CC-Webhook-Signature', '')
+    payload = request.get_data(as_text=True)
 
     try:
         event = Webhook.construct_event(payload, sig_header, COINBASE_WEBHOOK_SECRET)
-    except (Webhook.SignatureVerificationError, Webhook.WebhookInvalidPayload) as e:
+    except (SignatureVerificationError, WebhookInvalidPayload) as e:
         return str(e), 400
+    if not event.get('id') or not event.get('type'):
+        return 'Invalid event', 400
 
-    # Handle the event
-    if event.type == 'charge:confirmed':
-        order_id = event.data.metadata.get('order_id')
-        if order_id:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE orders SET status = 'paid' WHERE id = ?",
-                (order_id,)
-            )
-            conn.commit()
-            conn.close()
-            print(f"✅ Order {order_id} marked as paid.")
-
-    elif event.type == 'charge:failed':
-        order_id = event.data.metadata.get('order_id')
-        if order_id:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE orders SET status = 'failed' WHERE id = ?",
-                (order_id,)
-            )
-            conn.commit()
-            conn.close()
-            print(f"❌ Order {order_id} marked as failed.")
-            
+    # A redelivered event (same id) is acknowledged without being logged again
+    with connection() as conn:
+        append_event(conn, event, payload)
+    webhook_applier.wake()
     return 'OK', 200
 
+@app.route('/api/orders/<int:order_id>/checkout')
+def api_order_checkout(order_id):
+    """Charge creation state; the order page polls it until hosted_url is ready."""
+    with connection() as conn:
+        order = conn.execute(
+            'SELECT status, hosted_url, charge_error, charge_requested_at FROM orders WHERE id = ?', (order_id,)
+        ).fetchone()
+        if not order:
+            return jsonify({'error': 'Order not found'}), 404
+
+        # The order was queued by a process that has since restarted: queue it again (same idempotency key)
+        if (order['status'] == 'new' and charges and not charges.in_flight(order_id)
+                and time.time() - (order['charge_requested_at'] or 0) > CHARGE_STALE_AFTER):
+            with conn:
+                conn.execute('UPDATE orders SET charge_requested_at = ? WHERE id = ?', (int(time.time()), order_id))
+            charges.submit(order_id)
+
+    return jsonify({
+        'status': order['status'],
+        'hosted_url': order['hosted_url'],
+        'error': order['charge_error'],
+    })
+
 @app.route('/order_status/<int:order_id>')
 def order_status(order_id):
     """Displays the status of an order after payment attempt."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
-    order = cursor.fetchone()
-    conn.close()
-
-    if not order:
+    # The order and all its items (with current catalog names) in one query
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT o.*, i.product_id AS item_product_id, i.qty, i.unit_price, c.model, c.image_url
+            FROM orders o
+            LEFT JOIN order_items i ON i.order_id = o.id
+            LEFT JOIN iphones_catalog c ON c.product_id = i.product_id
+            WHERE o.id = ?
+        """, (order_id,)).fetchall()
+
+    if not rows:
         return "Order not found", 404
-        
-    product = catalog.get_product_by_id(order['product_id'])
 
-    return render_template('order_status.html', order=order, product=product)
+    order = rows[0]
+    items = [
+        {
+            'product_id': row['item_product_id'],
+            'model': row['model'] or row['item_product_id'],
+            'image_url': row['image_url'],
+            'qty': row['qty'],
+            'formatted_price': f"{row['unit_price']:,} руб.".replace(',', ' '),
+            'formatted_total': f"{row['unit_price'] * row['qty']:,} руб.".replace(',', ' '),
+        }
+        for row in rows if row['item_product_id'] is not None
+    ]
+
+    return render_template('order_status.html', order=order, items=items,
+                           formatted_total=f"{order['price']:,} руб.".replace(',', ' '))
 
 @app.route('/api/products')
+@catalog_etag(encoded=True)
 def api_products():
-    """API для получения товаров (для AJAX)"""
+    """API для получения товаров (для AJAX): ?fields=product_id,model,price - только эти поля товаров.
+    
+    Ответ сжимается (br/gzip по Accept-Encoding); списки без фильтра и
+    поиска одинаковы для всех, поэтому сжимаются один раз на версию
+    каталога и отдаются из api_cache.
+    """
     category = request.args.get('category', 'all')
     sort_by = request.args.get('sort', 'price_desc')
     search = request.args.get('search', '')
+    cursor = request.args.get('cursor')
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    fields = tuple(dict.fromkeys(field for field in request.args.get('fields', '').split(',') if field))
+    unknown = set(fields) - API_PRODUCT_FIELDS
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+    if cursor:
+        try:
+            decode_cursor(cursor, sort_by if sort_by in SORT_ORDERS else 'display_order')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    encoding = request.accept_encodings.best_match(CONTENT_ENCODINGS)
+    
+    cacheable = (category == 'all' and not search)
+    if cacheable:
+        key = (sort_by, cursor, limit, fields, encoding)
+        version = catalog.version()
+        body = api_cache.get(key, version)
+    if not cacheable or body is None:
+        start = time.perf_counter()
+        products, next_cursor = catalog.get_products_page(category, sort_by, search, cursor, limit)
+        body = products_json(catalog.products_json(products, fields), next_cursor)
+        if encoding:
+            body = compress(body, encoding, best=cacheable)
+        if cacheable:
+            api_cache.put(key, version, body, (time.perf_counter() - start) * 1000)
     
-    products = catalog.get_all_products(category, sort_by, search)
-    return jsonify(products)
+    response = app.response_class(body, mimetype='application/json')
+    if encoding:
+        response.content_encoding = encoding
+    return response
+
+@app.route('/api/facets')
+def api_facets():
+    """API фасетного фильтра: ?color=..&memory=..&sim=..&price=..&category=.. (значения можно повторять)"""
+    filters = {facet: request.args.getlist(facet) for facet in FACETS}
+    sort_by = request.args.get('sort', 'price_desc')
+    search = request.args.get('search', '')
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    return jsonify(catalog.get_faceted_products(filters, search, sort_by, limit))
+
+@app.route('/api/search')
+def api_search():
+    """API поиска с ранжированием (подсказки при вводе в веб-приложении)"""
+    search = request.args.get('q', '')
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify(catalog.search_products(search, limit))
+
+@app.route('/api/products/<product_id>/price_history')
+def api_price_history(product_id):
+    """API истории цены товара: ?days=.. (по умолчанию PRICE_HISTORY_DAYS)"""
+    days = request.args.get('days', PRICE_HISTORY_DAYS, type=int)
+    history = catalog.get_price_history(product_id, max(days, 1))
+    if history is None:
+        return jsonify({'error': 'Price history not found'}), 404
+    return jsonify(history)
+
+@app.route('/api/price_drops')
+def api_price_drops():
+    """API подешевевших товаров: ?days=..&limit=.."""
+    days = request.args.get('days', PRICE_DROP_DAYS, type=int)
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(catalog.get_price_drops(max(days, 1), limit))
+
+@app.route('/api/subscriptions', methods=['POST', 'DELETE'])
+def api_subscriptions():
+    """Подписка пользователя Telegram Web App на товар или модель: {init_data, kind, target}"""
+    data = request.get_json(silent=True) or {}
+    user = telegram_user(data.get('init_data'), TELEGRAM_BOT_TOKEN)
+    if user is None:
+        return jsonify({'error': 'Invalid Telegram init data'}), 403
+    
+    kind, target = data.get('kind'), str(data.get('target') or '')
+    if kind not in SUBSCRIPTION_KINDS or not target:
+        return jsonify({'error': 'Unknown subscription target'}), 400
+    if request.method == 'DELETE':
+        return jsonify({'removed': unsubscribe(g.db, user['id'], kind, target)})
+    
+    if kind == 'product' and not catalog.get_product_by_id(target):
+        return jsonify({'error': 'Product not found'}), 404
+    if not subscribe(g.db, user['id'], kind, target):
+        return jsonify({'error': 'Too many subscriptions'}), 400
+    return jsonify({'subscribed': True, 'kind': kind, 'target': target})
+
+@app.route('/api/page_cache')
+def api_page_cache():
+    """Счетчики кэша страниц и ответов API: попадания, промахи, вытеснения и сэкономленное время"""
+    return jsonify({'pages': page_cache.stats(), 'api': api_cache.stats()})
 
 @app.route('/api/categories')
+@catalog_etag()
 def api_categories():
     """API для получения категорий"""
     categories = catalog.get_categories()
@@ -434,31 +945,27 @@ def api_categories():
 @app.route('/cart')
 def cart():
     """Страница корзины"""
-    if 'cart' not in session:
-        session['cart'] = {}
-    
     cart_products = []
     total_price = 0
     
-    for product_id, quantity in session['cart'].items():
-        product = catalog.get_product_by_id(product_id)
+    items = current_cart().items
+    products = catalog.get_products_by_ids(items.keys())
+    for product_id, quantity in items.items():
+        product = products.get(product_id)
         if product:
             product['quantity'] = quantity
             product['total_price'] = product['price'] * quantity
             cart_products.append(product)
             total_price += product['total_price']
             
-    return render_template('cart.html', cart_products=cart_products, total_price=total_price, catalog=catalog, total_products=len(catalog.get_all_products()))
+    return render_template('cart.html', cart_products=cart_products, total_price=total_price, catalog=catalog, total_products=catalog.count_products())
 
 @app.route('/add_to_cart/<product_id>')
 def add_to_cart(product_id):
     """Добавление товара в корзину"""
-    if 'cart' not in session:
-        session['cart'] = {}
-    
-    cart = session['cart']
-    cart[product_id] = cart.get(product_id, 0) + 1
-    session['cart'] = cart
+    items = dict(current_cart().items)
+    items[product_id] = items.get(product_id, 0) + 1
+    save_cart(items)
     
     flash('Товар добавлен в корзину!', 'success')
     return redirect(request.referrer or url_for('index'))
@@ -466,29 +973,39 @@ def add_to_cart(product_id):
 @app.route('/remove_from_cart/<product_id>')
 def remove_from_cart(product_id):
     """Удаление товара из корзины"""
-    if 'cart' in session and product_id in session['cart']:
-        session['cart'].pop(product_id)
+    items = dict(current_cart().items)
+    if items.pop(product_id, None) is not None:
+        save_cart(items)
         flash('Товар удален из корзины!', 'info')
     return redirect(url_for('cart'))
 
 @app.route('/clear_cart')
 def clear_cart():
     """Очистка корзины"""
-    session.pop('cart', None)
+    save_cart({})
     flash('Корзина очищена!', 'info')
     return redirect(url_for('cart'))
 
 @app.context_processor
 def inject_cart_count():
-    """Доступное количество товаров в корзине во всех шаблонах"""
-    cart_count = 0
-    if 'cart' in session:
-        cart_count = sum(session['cart'].values())
-    return dict(cart_count=cart_count)
+    """Количество товаров в корзине и части страницы из сессии во всех шаблонах"""
+    return dict(cart_count=current_cart().count, session_slot=session_slot)
 
 @app.after_request
 def add_header(response):
-    """Add headers to prevent caching."""
+    """Cache-Control по маршруту: статика - на год, каталог - ETag (catalog_etag), остальное - no-store"""
+    if request.endpoint == 'static':
+        version = request.args.get('v')
+        if version and version == static_hash(request.view_args['filename']):
+            response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+        else:
+            # Без хэша в URL (или со старым) - только ревалидация по ETag/Last-Modified
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+    if 'Cache-Control' in response.headers:
+        return response
+    
+    # Сессия, корзина, заказы и оплата
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
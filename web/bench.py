@@ -0,0 +1,895 @@
+# bench.py
+"""Замеры производительности приложения.
+
+Запуск: python bench.py <сценарий> [параметры]
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+from search import fts_query, rebuild_search_index
+from web_db_setup import setup_database
+
+SYNTHETIC_MODELS = ['iPhone 13', 'iPhone 14 Plus', 'iPhone 15 Pro', 'iPhone 16 Pro Max', 'iPhone 17']
+SYNTHETIC_CATEGORIES = ['iPhone', 'iPhone Plus', 'iPhone Pro', 'iPhone Pro Max', 'iPhone Б/У']
+SYNTHETIC_COLORS = ['Black', 'White', 'Deep Blue', 'Cosmic Orange', 'Silver', 'Pink']
+SYNTHETIC_MEMORY = ['128Gb', '256Gb', '512Gb', '1Tb']
+
+
+def requests_per_second(client, path, count):
+    """Количество обработанных запросов в секунду для одного URL"""
+    client.get(path)  # прогрев
+    start = time.perf_counter()
+    for _ in range(count):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+    return count / (time.perf_counter() - start)
+
+
+def time_per_call(func, count):
+    """Среднее время одного вызова в миллисекундах"""
+    func()  # прогрев
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count * 1000
+
+
+def build_synthetic_db(db_path, products):
+    """База со случайным каталогом заданного размера"""
+    setup_database(db_path)
+    rng = random.Random(42)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        rows, colors, memory = [], [], []
+        for i in range(products):
+            product_id = str(100000 + i)
+            model = f"{rng.choice(SYNTHETIC_MODELS)} {rng.choice(SYNTHETIC_MEMORY)}"
+            product_colors = rng.sample(SYNTHETIC_COLORS, 3)
+            rows.append((
+                product_id, model, rng.randrange(20000, 250000, 10), product_colors[0],
+                SYNTHETIC_MEMORY[0], 'nano-SIM + eSIM', rng.choice(SYNTHETIC_CATEGORIES),
+                int(rng.random() < 0.01), i,
+            ))
+            colors.extend((product_id, color) for color in product_colors)
+            memory.extend((product_id, size) for size in SYNTHETIC_MEMORY)
+        conn.executemany('''
+            INSERT INTO iphones_catalog (product_id, model, price, current_color, current_memory,
+                                         current_sim, category, is_featured, display_order)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.executemany('INSERT INTO iphone_catalog_colors (product_id, color_name) VALUES (?, ?)', colors)
+        conn.executemany('INSERT INTO iphone_catalog_memory (product_id, memory_size) VALUES (?, ?)', memory)
+        rebuild_search_index(conn.cursor())
+    conn.close()
+
+
+def synthetic_catalog(args):
+    """Путь к временной синтетической базе размера --products"""
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench_catalog.db')
+    print(f"Синтетическая база: {args.products} товаров -> {db_path}")
+    build_synthetic_db(db_path, args.products)
+    return db_path
+
+
+def latency_percentiles(func, count):
+    """p50 и p99 времени вызова в миллисекундах"""
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def writable_db():
+    """Сценарии, которые пишут заказы, работают только с CATALOG_DB_PATH на копию базы"""
+    if db.DB_PATH == os.path.join(db.BASE_DIR, 'iphones_catalog.db'):
+        print("Бенчмарк пишет заказы: запустите с CATALOG_DB_PATH=<копия базы>")
+        return False
+    return True
+
+
+def fill_cart(client, product_ids):
+    """Корзина с товарами product_ids (по одному) в хранилище корзин приложения"""
+    import app as web_app
+    from cart_store import Cart
+
+    with client.session_transaction() as sess:
+        cart_id = sess.setdefault('cart_id', f'bench-{id(client)}')
+    web_app.carts.save(cart_id, Cart({product_id: 1 for product_id in product_ids}))
+
+
+def bench_pool(args):
+    """Запросы в секунду на /, /catalog и /cart без пула и с пулом соединений"""
+    from app import app, catalog
+
+    product_ids = [p['product_id'] for p in catalog.get_all_products()][:args.cart_items]
+    paths = ['/', '/catalog', '/cart']
+    results = {}
+
+    for label, pool_size in (('без пула', 0), ('пул', args.pool_size)):
+        db.configure(pool_size)
+        client = app.test_client()
+        fill_cart(client, product_ids)
+        results[label] = {path: requests_per_second(client, path, args.requests) for path in paths}
+
+    print(f"{'URL':<12}" + ''.join(f"{label:>14}" for label in results))
+    for path in paths:
+        print(f"{path:<12}" + ''.join(f"{results[label][path]:>10.1f} r/s" for label in results))
+
+
+def bench_revalidate(args):
+    """Повторное открытие страниц: полный ответ против 304 по If-None-Match (запросы в секунду и байты)"""
+    from app import app, catalog
+
+    product_id = catalog.get_all_products()[0]['product_id']
+    paths = ['/', '/catalog', f'/product/{product_id}', '/api/products', '/api/categories']
+    client = app.test_client()
+
+    print(f"{'URL':<22}{'200':>14}{'байт':>9}{'304':>14}{'байт':>7}")
+    for path in paths:
+        first = client.get(path)
+        etag = first.headers['ETag']
+        full = requests_per_second(client, path, args.requests)
+
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            response = client.get(path, headers={'If-None-Match': etag})
+            assert response.status_code == 304, (path, response.status_code)
+        revalidated = args.requests / (time.perf_counter() - start)
+        print(f"{path:<22}{full:>10.1f} r/s{len(first.data):>9}{revalidated:>10.1f} r/s{len(response.data):>7}")
+
+
+def bench_pagecache(args):
+    """Запросы в секунду на страницы каталога без кэша HTML и с ним (с товарами в корзине)"""
+    import app as web_app
+
+    product_ids = [p['product_id'] for p in web_app.catalog.get_all_products()][:args.cart_items]
+    paths = ['/', '/catalog', '/catalog?sort=price_asc', f'/product/{product_ids[0]}']
+    client = web_app.app.test_client()
+    fill_cart(client, product_ids)
+    results = {}
+
+    for label, enabled in (('без кэша', False), ('кэш', True)):
+        web_app.PAGE_CACHE = enabled
+        web_app.page_cache.clear()
+        results[label] = {path: requests_per_second(client, path, args.requests) for path in paths}
+
+    print(f"{'URL':<28}" + ''.join(f"{label:>14}" for label in results))
+    for path in paths:
+        print(f"{path:<28}" + ''.join(f"{results[label][path]:>10.1f} r/s" for label in results))
+    stats = web_app.page_cache.stats()
+    print(f"Попаданий {stats['hit_rate']:.1%}, страниц {stats['entries']}, {stats['size'] // 1024} КБ, "
+          f"сэкономлено рендера {stats['render_ms_saved'] / 1000:.1f} с")
+
+
+def bench_cart(args):
+    """Корзина: размер cookie сессии и запросы в секунду на /, /cart и добавление товара - память против SQLite"""
+    if not writable_db():
+        return
+    import app as web_app
+    from cart_store import make_cart_store
+
+    product_ids = [p['product_id'] for p in web_app.catalog.get_all_products()][:args.cart_items]
+    serializer = web_app.app.session_interface.get_signing_serializer(web_app.app)
+    cookie_cart = serializer.dumps({'cart': {product_id: 1 for product_id in product_ids}})
+    print(f"Cookie с корзиной из {len(product_ids)} товаров: {len(cookie_cart)} байт, "
+          f"с cart_id: {len(serializer.dumps({'cart_id': 'x' * 22}))} байт")
+
+    paths = ['/', '/cart']
+    results = {}
+    for kind in ('memory', 'sqlite'):
+        web_app.carts = make_cart_store(kind)
+        client = web_app.app.test_client()
+        fill_cart(client, product_ids)
+        results[kind] = {path: requests_per_second(client, path, args.requests) for path in paths}
+        add_path = f'/add_to_cart/{product_ids[0]}'
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            assert client.get(add_path).status_code == 302
+        results[kind][add_path] = args.requests / (time.perf_counter() - start)
+    paths.append(add_path)
+
+    print(f"{'URL':<28}" + ''.join(f"{kind:>14}" for kind in results))
+    for path in paths:
+        print(f"{path:<28}" + ''.join(f"{results[kind][path]:>10.1f} r/s" for kind in results))
+
+
+def start_gunicorn(workers):
+    """gunicorn с gunicorn.conf.py и workers воркерами на свободном порту; ждет первого ответа"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+         '--bind', f'127.0.0.1:{port}', '--error-logfile', os.devnull, 'wsgi:app'],
+        cwd=db.BASE_DIR, stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"gunicorn не ответил на порту {port}")
+
+
+def load_test(port, path, concurrency, duration):
+    """concurrency клиентов с keep-alive в течение duration секунд: (запросов в секунду, p50, p99 в мс, ошибок)"""
+    deadline = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        timings, errors = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                errors += 1
+                continue
+            if response.status != 200:
+                errors += 1
+                continue
+            timings.append((time.perf_counter() - start) * 1000)
+        conn.close()
+        return timings, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda _: client(), range(concurrency)))
+    elapsed = time.perf_counter() - start
+    timings = sorted(t for client_timings, _ in results for t in client_timings)
+    if not timings:
+        return 0.0, 0.0, 0.0, sum(errors for _, errors in results)
+    return (len(timings) / elapsed, timings[len(timings) // 2],
+            timings[min(len(timings) - 1, int(len(timings) * 0.99))], sum(errors for _, errors in results))
+
+
+def bench_serve(args):
+    """gunicorn (gunicorn.conf.py): запросы в секунду и p99 на /, /catalog, /product/<id> и /api/products по числу воркеров"""
+    conn = sqlite3.connect(db.DB_PATH)
+    product_id = conn.execute('SELECT product_id FROM iphones_catalog ORDER BY display_order LIMIT 1').fetchone()[0]
+    conn.close()
+    paths = ['/', '/catalog', f'/product/{product_id}', '/api/products']
+    worker_counts = [int(count) for count in args.workers.split(',')]
+
+    print(f"{args.concurrency} клиентов, {args.duration:.0f} с на URL, "
+          f"потоков в воркере: {os.environ.get('WEB_THREADS', 4)}, CPU: {os.cpu_count()}")
+    print(f"{'URL':<22}{'воркеров':>9}{'r/s':>10}{'p50, мс':>10}{'p99, мс':>10}{'ошибок':>8}")
+    for workers in worker_counts:
+        process, port = start_gunicorn(workers)
+        try:
+            for path in paths:
+                load_test(port, path, args.concurrency, 1)  # прогрев кэшей всех воркеров
+                rps, p50, p99, errors = load_test(port, path, args.concurrency, args.duration)
+                print(f"{path:<22}{workers:>9}{rps:>10.1f}{p50:>10.1f}{p99:>10.1f}{errors:>8}")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def bench_api(args):
+    """/api/products: сериализация (мкс на товар) и байты ответа из 100 товаров - jsonify против готового JSON"""
+    import app as web_app
+    from api_json import CONTENT_ENCODINGS, compress, dumps, orjson, products_json
+
+    web_app.catalog = web_app.iPhoneCatalog(synthetic_catalog(args))
+    snapshot = web_app.catalog.snapshot()
+    products = list(snapshot.products)
+    print(f"Сериализатор: {'orjson' if orjson is not None else 'json'}, сжатие: {', '.join(CONTENT_ENCODINGS)}")
+
+    with web_app.app.app_context():
+        cases = [
+            ('jsonify (json.dumps)', lambda: web_app.app.json.dumps(products)),
+            ('dumps по товару', lambda: [dumps(p) for p in products]),
+            ('готовый JSON снимка', lambda: products_json(snapshot.to_json(products), None)),
+        ]
+        for label, func in cases:
+            print(f"{label:<24}{time_per_call(func, args.calls) * 1000 / len(products):>8.2f} мкс/товар")
+
+        page, next_cursor = web_app.catalog.get_products_page(limit=100)
+        fields = ('product_id', 'model', 'price', 'image_url')
+        bodies = [
+            ('jsonify', web_app.app.json.dumps({'products': page, 'next_cursor': next_cursor}).encode('utf-8')),
+            ('компактный JSON', products_json(snapshot.to_json(page), next_cursor)),
+            (f"fields={','.join(fields)}", products_json(web_app.catalog.products_json(page, fields), next_cursor)),
+        ]
+    print(f"\n{'100 товаров':<42}{'identity':>10}" + ''.join(f"{encoding:>10}" for encoding in CONTENT_ENCODINGS))
+    for label, body in bodies:
+        print(f"{label:<42}{len(body):>10}" + ''.join(
+            f"{len(compress(body, encoding, best=True)):>10}" for encoding in CONTENT_ENCODINGS))
+
+    client = web_app.app.test_client()
+    path = '/api/products?limit=100'
+    print()
+    for encoding in ('identity',) + CONTENT_ENCODINGS:
+        client.environ_base['HTTP_ACCEPT_ENCODING'] = encoding
+        print(f"{path} ({encoding}): {requests_per_second(client, path, args.requests):.1f} r/s")
+        print(f"{path}&search=pro ({encoding}): {requests_per_second(client, path + '&search=pro', args.requests):.1f} r/s")
+
+
+def bench_checkout(args):
+    """Оформление заказов при медленном Coinbase (локальный fake_coinbase.py): время ответа и создание платежей.
+
+    Пишет заказы в базу, поэтому запускается только с CATALOG_DB_PATH на копию базы.
+    """
+    from fake_coinbase import start_fake_coinbase
+
+    if not writable_db():
+        return
+    server, api, url = start_fake_coinbase(latency=args.latency, jitter=args.latency, fail_rate=0.05)
+    os.environ.update(COINBASE_COMMERCE_API_KEY='bench', COINBASE_API_URL=url)
+    logging.getLogger('payments').setLevel(logging.ERROR)
+    import app as web_app
+
+    # Таймаут меньше худшей задержки: часть запросов повторяется с тем же ключом идемпотентности
+    web_app.client.timeout = args.latency * 1.8
+    product_ids = [p['product_id'] for p in web_app.catalog.get_all_products()]
+    print(f"Coinbase: задержка {args.latency}-{args.latency * 2} с, 5% ответов 500, таймаут {web_app.client.timeout:.1f} с; "
+          f"{args.requests} заказов, {args.concurrency} одновременных покупателей, "
+          f"{web_app.charges.workers} потоков платежей")
+
+    def checkout(i):
+        client = web_app.app.test_client()
+        start = time.perf_counter()
+        response = client.get(f'/crypto_pay/{product_ids[i % len(product_ids)]}')
+        assert response.status_code == 302 and '/order_status/' in response.location, response.location
+        return (time.perf_counter() - start) * 1000, int(response.location.rsplit('/', 1)[1])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(checkout, range(args.requests)))
+    accepted = time.perf_counter() - start
+    timings = sorted(ms for ms, _ in results)
+    web_app.charges.join()
+    finished = time.perf_counter() - start
+
+    order_ids = [order_id for _, order_id in results]
+    with db.connection() as conn:
+        statuses = dict(conn.execute(f'''
+            SELECT status, COUNT(*) FROM orders WHERE id IN ({','.join('?' * len(order_ids))}) GROUP BY status
+        ''', order_ids).fetchall())
+    stats = web_app.charges.stats
+    print(f"Ответ на оформление: p50 {timings[len(timings) // 2]:.1f} мс, p99 {timings[int(len(timings) * 0.99)]:.1f} мс, "
+          f"все заказы приняты за {accepted:.2f} с")
+    print(f"Платежи созданы за {finished:.1f} с: {statuses}; повторов {stats['retried']}, "
+          f"отказов очереди {stats['rejected']}")
+    print(f"Coinbase: запросов {api.hits['create']}, ответов 500 {api.hits['500']}, "
+          f"повторов по Idempotency-Key {api.hits['replayed']}, платежей {len(api.charges)}")
+    server.shutdown()
+
+
+WEBHOOK_SCENARIOS = [
+    # (доля заказов, события по порядку)
+    (0.70, ('charge:created', 'charge:pending', 'charge:confirmed')),
+    (0.15, ('charge:created', 'charge:failed')),
+    (0.10, ('charge:created', 'charge:failed', 'charge:delayed', 'charge:resolved')),
+    (0.05, ('charge:created', 'charge:pending')),
+]
+
+
+def bench_webhooks(args):
+    """Прием вебхуков Coinbase: --events подписанных событий вперемешку и с повторами, прием и применение.
+
+    Пишет заказы в базу, поэтому запускается только с CATALOG_DB_PATH на копию базы.
+    """
+    import hashlib
+    import hmac
+    import uuid
+
+    from webhooks import EVENT_STATUSES, ORDER_STATUS_RANK
+
+    if not writable_db():
+        return
+    import app as web_app
+
+    secret = 'bench-secret'
+    web_app.COINBASE_WEBHOOK_SECRET = secret
+    rng = random.Random(42)
+    orders = max(args.events // 3, 1)
+    with db.connection() as conn, conn:
+        first_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM orders').fetchone()[0]
+        conn.executemany(
+            "INSERT INTO orders (id, product_id, price, status, charge_code) VALUES (?, '1', 1000, 'pending', ?)",
+            [(first_id + i, f'BENCH{first_id + i}') for i in range(orders)]
+        )
+
+    deliveries, expected = [], {}
+    for i in range(orders):
+        order_id = first_id + i
+        share = rng.random()
+        for weight, events in WEBHOOK_SCENARIOS:
+            if share < weight:
+                break
+            share -= weight
+        expected[order_id] = max((EVENT_STATUSES[t] for t in events), key=ORDER_STATUS_RANK.get)
+        for event_type in events:
+            # Каждое десятое событие без order_id: заказ ищется по коду платежа
+            metadata = {'order_id': order_id} if rng.random() > 0.1 else {}
+            payload = json.dumps({'id': str(uuid.uuid4()), 'event': {
+                'id': str(uuid.uuid4()), 'resource': 'event', 'type': event_type, 'api_version': '2018-03-22',
+                'data': {'code': f'BENCH{order_id}', 'metadata': metadata},
+            }})
+            signature = hmac.new(secret.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest()
+            deliveries.append((payload, signature))
+    # Повторные доставки и произвольный порядок
+    deliveries += rng.sample(deliveries, len(deliveries) // 10)
+    rng.shuffle(deliveries)
+    print(f"Заказов {orders}, доставок {len(deliveries)} (10% повторов, порядок случайный), "
+          f"{args.concurrency} одновременных отправителей")
+
+    local = threading.local()
+
+    def deliver(delivery):
+        client = getattr(local, 'client', None) or web_app.app.test_client()
+        local.client = client
+        payload, signature = delivery
+        start = time.perf_counter()
+        response = client.post('/webhooks/coinbase', data=payload, content_type='application/json',
+                               headers={'X-CC-Webhook-Signature': signature})
+        assert response.status_code == 200, response.data
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        timings = sorted(pool.map(deliver, deliveries))
+    received = time.perf_counter() - start
+    web_app.webhook_applier.drain()
+    applied = time.perf_counter() - start
+
+    with db.connection() as conn:
+        statuses = dict(conn.execute('SELECT id, status FROM orders WHERE id >= ?', (first_id,)).fetchall())
+        logged = conn.execute('SELECT COUNT(*) FROM webhook_events WHERE order_id >= ? OR charge_code LIKE ?',
+                              (first_id, 'BENCH%')).fetchone()[0]
+    wrong = sum(1 for order_id, status in expected.items() if statuses.get(order_id) != status)
+    stats = web_app.webhook_applier.stats
+    print(f"Прием: {len(deliveries) / received:.0f} событий/с, p50 {timings[len(timings) // 2]:.2f} мс, "
+          f"p99 {timings[int(len(timings) * 0.99)]:.2f} мс")
+    print(f"Все события применены через {applied - received:.2f} с после последней доставки: записано в журнал {logged}, "
+          f"пачек {stats['batches']}, заказов с неверным статусом {wrong}")
+
+
+def bench_counts(args):
+    """Счетчик товаров и похожие товары: полная выборка против COUNT/LIMIT"""
+    from app import iPhoneCatalog
+
+    catalog = iPhoneCatalog(synthetic_catalog(args), use_snapshot=False)
+    product = catalog.get_product_by_id('100000')
+
+    cases = [
+        ('len(get_all_products())', lambda: len(catalog.get_all_products())),
+        ('count_products()', lambda: catalog.count_products()),
+        ('get_all_products(category)[:4]', lambda: catalog.get_all_products(category=product['category'])[:4]),
+        ('get_similar_products()', lambda: catalog.get_similar_products(product, 4)),
+    ]
+    for label, func in cases:
+        print(f"{label:<34}{time_per_call(func, args.calls):>10.2f} мс")
+
+
+def bench_pages(args):
+    """Время первой и глубокой страницы каталога при keyset-пагинации"""
+    from app import iPhoneCatalog, SORT_ORDERS
+
+    catalog = iPhoneCatalog(synthetic_catalog(args), use_snapshot=False)
+    for sort_by in SORT_ORDERS:
+        # Курсор на середину каталога
+        cursor = None
+        for _ in range(args.products // 2 // 100):
+            _, cursor = catalog.get_products_page(sort_by=sort_by, cursor=cursor, limit=100)
+
+        first = time_per_call(lambda: catalog.get_products_page(sort_by=sort_by), args.calls)
+        deep = time_per_call(lambda: catalog.get_products_page(sort_by=sort_by, cursor=cursor), args.calls)
+        print(f"{sort_by:<16}страница 1: {first:>8.2f} мс   середина каталога: {deep:>8.2f} мс")
+
+
+SEARCH_QUERIES = ['pro', 'iphone 15', 'айфон про макс', 'deep blue', '256 гб', 'pink', 'plus 1tb']
+
+
+def bench_search(args):
+    """Поиск: LIKE '%term%' против FTS5, p50/p99 на страницу результатов вместе со счетчиком"""
+    conn = sqlite3.connect(synthetic_catalog(args))
+    like_where = 'WHERE model LIKE ? OR current_color LIKE ?'
+    fts_where = 'WHERE id IN (SELECT rowid FROM catalog_search WHERE catalog_search MATCH ?)'
+
+    def search_page(where, params, count_sql):
+        conn.execute(f'SELECT product_id FROM iphones_catalog {where} ORDER BY price DESC LIMIT 24', params).fetchall()
+        conn.execute(count_sql, params).fetchone()
+
+    like_count = f'SELECT COUNT(*) FROM iphones_catalog {like_where}'
+    fts_count = 'SELECT COUNT(*) FROM catalog_search WHERE catalog_search MATCH ?'
+
+    print(f"{'запрос':<18}{'LIKE p50/p99':>22}{'FTS5 p50/p99':>22}")
+    for query in SEARCH_QUERIES:
+        like = latency_percentiles(
+            lambda: search_page(like_where, (f'%{query}%', f'%{query}%'), like_count), args.calls)
+        fts = latency_percentiles(lambda: search_page(fts_where, (fts_query(query),), fts_count), args.calls)
+        print(f"{query:<18}{like[0]:>10.2f}/{like[1]:<8.2f} мс{fts[0]:>10.2f}/{fts[1]:<8.2f} мс")
+    conn.close()
+
+
+def bench_facets(args):
+    """Фасетный фильтр на битовых масках против эквивалентного SQL с JOIN"""
+    from app import iPhoneCatalog
+
+    catalog = iPhoneCatalog(synthetic_catalog(args))
+    conn = sqlite3.connect(catalog.db_path)
+    start = time.perf_counter()
+    catalog.snapshot()
+    print(f"Построение снимка с фасетами: {(time.perf_counter() - start) * 1000:.0f} мс")
+
+    filters = {'color': ['Deep Blue', 'Pink'], 'memory': ['512Gb'], 'category': ['iPhone Pro']}
+    sql = '''
+        SELECT DISTINCT ic.product_id FROM iphones_catalog ic
+        JOIN iphone_catalog_colors icc ON icc.product_id = ic.product_id
+        JOIN iphone_catalog_memory icm ON icm.product_id = ic.product_id
+        WHERE icc.color_name IN (?, ?) AND icm.memory_size = ? AND ic.category = ?
+        ORDER BY ic.price DESC LIMIT 24
+    '''
+    params = ('Deep Blue', 'Pink', '512Gb', 'iPhone Pro')
+
+    bitmap = latency_percentiles(lambda: catalog.get_faceted_products(filters), args.calls)
+    joined = latency_percentiles(lambda: conn.execute(sql, params).fetchall(), args.calls)
+    print(f"битовые маски + счетчики фасетов: p50 {bitmap[0]:.2f} мс, p99 {bitmap[1]:.2f} мс")
+    print(f"SQL с JOIN (без счетчиков):        p50 {joined[0]:.2f} мс, p99 {joined[1]:.2f} мс")
+    conn.close()
+
+
+def bench_prices(args):
+    """История цен: точки товара за 90 дней и подешевевшие за неделю на истории за год"""
+    from price_history import DAY, price_drops, price_points, timestamp
+
+    db_path = synthetic_catalog(args)
+    conn = sqlite3.connect(db_path)
+    now = timestamp()
+    rng = random.Random(7)
+    product_ids = [row[0] for row in conn.execute('SELECT product_id FROM iphones_catalog')]
+    with conn:
+        # Каждый товар меняет цену в среднем раз в две недели
+        conn.executemany(
+            'INSERT OR IGNORE INTO price_history (product_id, ts, price, old_price) VALUES (?, ?, ?, ?)',
+            (
+                (product_id, now - rng.randrange(365 * DAY), rng.randrange(20000, 250000, 10), None)
+                for product_id in product_ids for _ in range(26)
+            )
+        )
+    points = conn.execute('SELECT COUNT(*) FROM price_history').fetchone()[0]
+    size = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE '%price_history%'").fetchone()[0]
+    print(f"Точек истории: {points}, таблица и индекс: {size / 1024 / 1024:.1f} МБ ({size / points:.0f} байт/точку)")
+
+    history = latency_percentiles(lambda: price_points(conn, rng.choice(product_ids), 90, now), args.calls)
+    drops = latency_percentiles(lambda: price_drops(conn, 7, 20, now), args.calls)
+    print(f"история товара за 90 дней: p50 {history[0]:.2f} мс, p99 {history[1]:.2f} мс")
+    print(f"подешевевшие за 7 дней:    p50 {drops[0]:.2f} мс, p99 {drops[1]:.2f} мс")
+    conn.close()
+
+
+def bench_notify(args):
+    """Рассылка событий каталога --subscribers чатам через локальный Bot API (fake_bot_api.py)"""
+    import asyncio
+
+    from fake_bot_api import start_fake_bot_api
+    from notifier import ChatRateLimiter, make_bot, notify_pending
+
+    db_path = synthetic_catalog(args)
+    conn = sqlite3.connect(db_path)
+    rng = random.Random(7)
+    dropped = [row[0] for row in conn.execute('SELECT product_id FROM iphones_catalog LIMIT 1000')]
+    with conn:
+        conn.executemany(
+            'INSERT INTO catalog_events (ts, kind, product_id, model, was_price, price) '
+            "SELECT 0, 'price_drop', product_id, model, price + 1000, price FROM iphones_catalog WHERE product_id = ?",
+            [(product_id,) for product_id in dropped]
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO subscriptions (kind, target, chat_id, created_at) VALUES ('product', ?, ?, 0)",
+            ((rng.choice(dropped), chat_id) for chat_id in range(1, args.subscribers + 1))
+        )
+    conn.close()
+
+    server, api, base_url = start_fake_bot_api(global_rate=args.rate, blocked=range(1, args.subscribers, 100))
+
+    async def run():
+        async with make_bot('1:bench', base_url, args.concurrency) as bot:
+            return await notify_pending(bot, db_path, args.concurrency, ChatRateLimiter(args.rate))
+
+    stats = asyncio.run(run())
+    server.shutdown()
+    print(f"Подписчиков: {args.subscribers}, воркеров: {args.concurrency}, лимит: {args.rate:.0f} сообщ./с")
+    print(f"отправлено {stats['sent']}, отписано {len(stats['blocked'])}, ошибок {stats['failed']}, "
+          f"ответов 429: {api.hits['429']}, за {stats['elapsed']:.1f} с "
+          f"({(stats['sent'] + len(stats['blocked'])) / stats['elapsed']:.0f} сообщ./с)")
+
+
+def bench_parse(args):
+    """Скорость разбора карточек (карточек в секунду): BeautifulSoup против lxml"""
+    from parsing import IPhoneCatalogParser, PARSER_BACKENDS
+
+    with open(args.html, 'r', encoding='utf-8') as f:
+        html = f.read()
+
+    # Отладочный HTML парсер пишет в текущий каталог, вывод в терминал не замеряем
+    os.chdir(tempfile.mkdtemp())
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for backend in PARSER_BACKENDS:
+            parser = IPhoneCatalogParser(backend)
+            products = parser.parse_catalog_html(html)['products']
+            ms = time_per_call(lambda: parser.parse_catalog_html(html), args.calls)
+            results[backend] = (products, ms)
+
+    reference = json.dumps(results['bs4'][0], ensure_ascii=False)
+    for backend, (products, ms) in results.items():
+        same = json.dumps(products, ensure_ascii=False) == reference
+        print(f"{backend:<6}{len(products) / ms * 1000:>10.0f} карточек/с  "
+              f"({ms:.1f} мс на {len(products)} карточек, совпадает с bs4: {'да' if same else 'НЕТ'})")
+
+
+def bench_diagnostics(args):
+    """Разбор страницы с отладкой (дамп HTML + лог по карточкам) и в обычном режиме"""
+    from parsing import IPhoneCatalogParser, PARSER_BACKENDS, logger
+
+    with open(args.html, 'r', encoding='utf-8') as f:
+        html = f.read()
+    debug_dir = tempfile.mkdtemp()
+    log_handler = logging.FileHandler(os.path.join(debug_dir, 'parsing.log'), encoding='utf-8')
+
+    print(f"{'парсер':<8}{'с отладкой':>14}{'обычный':>14}{'экономия':>12}")
+    for backend in PARSER_BACKENDS:
+        logger.addHandler(log_handler)
+        logger.setLevel(logging.DEBUG)
+        debug_parser = IPhoneCatalogParser(backend, debug_dir=debug_dir)
+        with_debug = time_per_call(lambda: debug_parser.parse_catalog_html(html), args.calls)
+        logger.removeHandler(log_handler)
+        logger.setLevel(logging.INFO)
+
+        parser = IPhoneCatalogParser(backend, debug_dir=None)
+        plain = time_per_call(lambda: parser.parse_catalog_html(html), args.calls)
+        print(f"{backend:<8}{with_debug:>11.1f} мс{plain:>11.1f} мс{(1 - plain / with_debug) * 100:>10.0f} %")
+        print(f"        этапы: {parser.parse_catalog_html(html)['stats']['timings_ms']}")
+    log_handler.close()
+
+
+def synthetic_scrape(count, seed=42):
+    """Товары в формате IPhoneCatalogParser для count карточек"""
+    rng = random.Random(seed)
+    products = []
+    for i in range(count):
+        price = rng.randrange(20000, 250000, 10)
+        products.append({
+            'product_id': str(100000 + i),
+            'model': f"{rng.choice(SYNTHETIC_MODELS)} {rng.choice(SYNTHETIC_MEMORY)}",
+            'numeric_price': price,
+            'old_price': '',
+            'current_color': rng.choice(SYNTHETIC_COLORS),
+            'available_colors': rng.sample(SYNTHETIC_COLORS, 3),
+            'current_memory': SYNTHETIC_MEMORY[0],
+            'memory_options': list(SYNTHETIC_MEMORY),
+            'current_sim': 'nano-SIM + eSIM',
+            'image_url': f'https://edwardpnz.ru/img_goods/{i}.jpg',
+            'product_url': f'https://edwardpnz.ru/catalog/smartfony/{100000 + i}',
+        })
+    return products
+
+
+def bench_save(args):
+    """Запись выгрузки: первая загрузка, повтор без изменений и 5% изменений цен + 1% новых"""
+    from parsing import iPhoneDatabase
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench_catalog.db')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        database = iPhoneDatabase(db_path)
+    products = synthetic_scrape(args.products)
+
+    rng = random.Random(7)
+    changed = [dict(product) for product in products]
+    for product in rng.sample(changed, len(changed) // 20):
+        product['numeric_price'] -= 1000
+    changed += synthetic_scrape(len(products) // 100, seed=8)
+    for i, product in enumerate(changed[len(products):]):
+        product['product_id'] = str(900000 + i)
+
+    print(f"{'выгрузка':<22}{'новых':>8}{'изменено':>10}{'без изм.':>10}{'удалено':>9}{'время':>12}")
+    for label, scrape in (('первая загрузка', products), ('без изменений', products),
+                          ('5% цен + 1% новых', changed)):
+        database.save_products(iter(scrape), remove_missing=True)
+        counts = database.last_save
+        print(f"{label:<22}{counts['inserted']:>8}{counts['updated']:>10}{counts['unchanged']:>10}"
+              f"{counts['removed']:>9}{counts['write_ms']:>9.0f} мс")
+
+
+def synthetic_pages(html_path, pages):
+    """Страницы каталога из html_path с перенумерованными карточками"""
+    from fixture_server import CARD_ID
+
+    with open(html_path, 'r', encoding='utf-8') as f:
+        page = f.read()
+    return [CARD_ID.sub(lambda m: str(int(m.group()) + i * 100000), page) for i in range(pages)]
+
+
+def bench_parallel(args):
+    """Карточек в секунду при разборе в 1/2/4/8 процессах: по страницам и потоком по карточкам"""
+    from parsing import IPhoneCatalogParser
+
+    pages = synthetic_pages(args.html, args.pages)
+    dump_path = os.path.join(tempfile.mkdtemp(), 'catalog_dump.html')
+    with open(dump_path, 'w', encoding='utf-8') as f:
+        f.writelines(pages)
+    print(f"Синтетический каталог: {args.pages} страниц, CPU: {os.cpu_count()}")
+
+    print(f"{'процессов':<10}{'по страницам':>20}{'поток карточек':>22}")
+    for workers in (1, 2, 4, 8):
+        parser = IPhoneCatalogParser(workers=workers)
+        start = time.perf_counter()
+        cards = parser.parse_catalog_pages(pages)['stats']['cards_parsed']
+        by_page = cards / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        streamed = sum(1 for _ in parser.iter_catalog_cards(dump_path))
+        by_card = streamed / (time.perf_counter() - start)
+        print(f"{workers:<10}{by_page:>12.0f} карт./с{by_card:>14.0f} карт./с")
+
+
+def bench_incremental(args):
+    """Повторный разбор и запись выгрузки целиком и по хэшам: без изменений и с 1% измененных страниц"""
+    from parsing import IPhoneCatalogParser, ScrapeHashes, iPhoneDatabase
+
+    pages = synthetic_pages(args.html, args.pages)
+    changed = list(pages)
+    for index in random.Random(7).sample(range(len(pages)), max(len(pages) // 100, 1)):
+        changed[index] = changed[index].replace('card_name">iPhone', 'card_name">Apple iPhone', 1)
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench_catalog.db')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        database = iPhoneDatabase(db_path)
+    parser = IPhoneCatalogParser()
+    known = ScrapeHashes()
+    database.save_catalog(parser.parse_catalog_pages(pages, known), known)
+    print(f"Синтетический каталог: {args.pages} страниц")
+
+    print(f"{'выгрузка':<22}{'режим':<12}{'разобрано':>10}{'изменено':>10}{'время':>12}")
+    for label, scrape in (('без изменений', pages), ('1% страниц', changed)):
+        for mode in ('по хэшам', 'целиком'):
+            start = time.perf_counter()
+            known = database.load_scrape_hashes() if mode == 'по хэшам' else None
+            result = parser.parse_catalog_pages(scrape, known)
+            database.save_catalog(result, known)
+            elapsed = time.perf_counter() - start
+            print(f"{label:<22}{mode:<12}{result['stats']['cards_parsed']:>10}"
+                  f"{database.last_save['updated']:>10}{elapsed * 1000:>9.0f} мс")
+
+
+def _catalog_in_memory(html_path, db_path):
+    """Прежний путь: весь файл в строку, весь DOM, список товаров, затем запись"""
+    from parsing import IPhoneCatalogParser, iPhoneDatabase
+
+    with open(html_path, 'r', encoding='utf-8') as f:
+        html = f.read()
+    result = IPhoneCatalogParser('lxml').parse_catalog_html(html)
+    iPhoneDatabase(db_path).save_catalog(result)
+    return result['total_products']
+
+
+def _catalog_streaming(html_path, db_path):
+    """Потоковый путь: карточки из iter_catalog_cards сразу уходят в запись пачками"""
+    from parsing import IPhoneCatalogParser, iPhoneDatabase
+
+    counted = 0
+
+    def count(products):
+        nonlocal counted
+        for product in products:
+            counted += 1
+            yield product
+
+    iPhoneDatabase(db_path).save_products(count(IPhoneCatalogParser().iter_catalog_cards(html_path)))
+    return counted
+
+
+def _peak_rss_worker(target, html_path, queue):
+    """Запуск в отдельном процессе: пиковый RSS, время и число товаров"""
+    os.chdir(tempfile.mkdtemp())
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        count = target(html_path, 'bench_catalog.db')
+    seconds = time.perf_counter() - start
+    # ru_maxrss в Linux - в килобайтах
+    queue.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, seconds, count))
+
+
+def bench_stream(args):
+    """Пиковая память разбора большой склеенной выгрузки: целиком в памяти против потока"""
+    from fixture_server import CARD_ID
+
+    with open(args.html, 'r', encoding='utf-8') as f:
+        page = f.read()
+    dump_path = os.path.join(tempfile.mkdtemp(), 'catalog_dump.html')
+    with open(dump_path, 'w', encoding='utf-8') as f:
+        for i in range(args.pages):
+            f.write(CARD_ID.sub(lambda m: str(int(m.group()) + i * 100000), page))
+    print(f"Выгрузка: {args.pages} страниц, {os.path.getsize(dump_path) / 2 ** 20:.0f} МБ")
+
+    context = multiprocessing.get_context('spawn')
+    for label, target in (('в памяти', _catalog_in_memory), ('поток', _catalog_streaming)):
+        queue = context.Queue()
+        process = context.Process(target=_peak_rss_worker, args=(target, dump_path, queue))
+        process.start()
+        peak_mb, seconds, count = queue.get()
+        process.join()
+        print(f"{label:<10}пиковый RSS {peak_mb:>8.0f} МБ, {seconds:>6.1f} с, товаров {count}")
+
+
+SCENARIOS = {
+    'pool': bench_pool,
+    'revalidate': bench_revalidate,
+    'pagecache': bench_pagecache,
+    'api': bench_api,
+    'cart': bench_cart,
+    'checkout': bench_checkout,
+    'serve': bench_serve,
+    'webhooks': bench_webhooks,
+    'counts': bench_counts,
+    'pages': bench_pages,
+    'search': bench_search,
+    'facets': bench_facets,
+    'notify': bench_notify,
+    'prices': bench_prices,
+    'parse': bench_parse,
+    'stream': bench_stream,
+    'diagnostics': bench_diagnostics,
+    'save': bench_save,
+    'parallel': bench_parallel,
+    'incremental': bench_incremental,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры производительности')
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='запросов на URL')
+    parser.add_argument('--pool-size', type=int, default=db.DB_POOL_SIZE)
+    parser.add_argument('--cart-items', type=int, default=5, help='товаров в корзине для /cart')
+    parser.add_argument('--products', type=int, default=50000, help='размер синтетического каталога')
+    parser.add_argument('--calls', type=int, default=5, help='вызовов на замер')
+    parser.add_argument('--html', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'site-html.txt'),
+                        help='страница каталога для разбора')
+    parser.add_argument('--pages', type=int, default=300, help='страниц в склеенной выгрузке для stream')
+    parser.add_argument('--subscribers', type=int, default=100000, help='чатов-подписчиков для notify')
+    parser.add_argument('--rate', type=float, default=1000, help='сообщений в секунду для notify')
+    parser.add_argument('--concurrency', type=int, default=16, help='одновременных запросов для notify, checkout и serve')
+    parser.add_argument('--latency', type=float, default=1.0, help='задержка Coinbase для checkout, секунд')
+    parser.add_argument('--events', type=int, default=10000, help='событий Coinbase для webhooks')
+    parser.add_argument('--workers', default='1,2,4', help='числа воркеров gunicorn для serve, через запятую')
+    parser.add_argument('--duration', type=float, default=10, help='секунд нагрузки на URL для serve')
+    args = parser.parse_args()
+    SCENARIOS[args.scenario](args)
+
+
+if __name__ == '__main__':
+    main()
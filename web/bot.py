@@ -1,7 +1,12 @@
+import json
 import logging
-import uuid
+import os
 from telegram import Update, WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
+
+from db import connection
+from notifier import notify_loop
+from subscriptions import SUBSCRIPTION_KINDS, list_subscriptions, subscribe as add_subscription, unsubscribe as remove_subscription
 
 # Enable logging
 logging.basicConfig(
@@ -9,17 +14,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Your bot's token
-TOKEN = "7724093672:AAFnWkmxXRm6Thd0UalWtL-s9HIKW08X8Ho"
+# Your bot's token (the web app verifies subscriptions with the same token)
+TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', "7724093672:AAFnWkmxXRm6Thd0UalWtL-s9HIKW08X8Ho")
+WEB_APP_URL = os.environ.get('WEB_APP_URL', "https://5c876e87308d.ngrok-free.app")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a message with a button that opens the web app."""
-    # Generate a unique version parameter to bypass cache
-    cache_buster = uuid.uuid4()
-    web_app_url = f"https://5c876e87308d.ngrok-free.app?v={cache_buster}"
-    
+    # The web app revalidates pages by ETag and versions static files itself, no cache buster needed
     keyboard = [
-        [InlineKeyboardButton("Open Store", web_app=WebAppInfo(url=web_app_url))]
+        [InlineKeyboardButton("Open Store", web_app=WebAppInfo(url=WEB_APP_URL))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(
@@ -27,16 +30,74 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         reply_markup=reply_markup
     )
 
+def _subscription_target(text: str):
+    """(kind, target) from "/subscribe 2796" (product id) or "/subscribe iPhone 17 Pro" (model)"""
+    text = text.strip()
+    if not text:
+        return None
+    return ('product', text) if text.isdigit() else ('model', text)
+
+async def _reply_subscribed(update: Update, subscribed: bool, target: str) -> None:
+    """Confirms a subscription, or explains why it was refused."""
+    if subscribed:
+        await update.message.reply_text(f"You will be notified about {target}.")
+    else:
+        await update.message.reply_text("Too many subscriptions, /unsubscribe from something first.")
+
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Subscribes the chat to price drops and restocks of a product or a model."""
+    target = _subscription_target(' '.join(context.args))
+    if target is None:
+        await update.message.reply_text("Usage: /subscribe <product id or model>")
+        return
+    with connection() as conn:
+        subscribed = add_subscription(conn, update.effective_chat.id, *target)
+    await _reply_subscribed(update, subscribed, target[1])
+
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Removes one subscription, or all of them without arguments."""
+    target = _subscription_target(' '.join(context.args))
+    with connection() as conn:
+        removed = remove_subscription(conn, update.effective_chat.id, *(target or ()))
+    await update.message.reply_text(f"Subscriptions removed: {removed}")
+
+async def subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Lists the chat's subscriptions."""
+    with connection() as conn:
+        rows = list_subscriptions(conn, update.effective_chat.id)
+    if not rows:
+        await update.message.reply_text("No subscriptions. Use /subscribe <product id or model>.")
+        return
+    await update.message.reply_text('\n'.join(f"{kind}: {target}" for kind, target in rows))
+
 async def web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Processes data from the web app."""
     data = update.message.web_app_data.data
+    # {"action": "subscribe", "kind": "product" | "model", "target": "..."} from the product page
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        payload = None
+    if isinstance(payload, dict) and payload.get('action') == 'subscribe' \
+            and payload.get('kind') in SUBSCRIPTION_KINDS and payload.get('target'):
+        with connection() as conn:
+            subscribed = add_subscription(conn, update.effective_chat.id, payload['kind'], str(payload['target']))
+        await _reply_subscribed(update, subscribed, payload['target'])
+        return
     await update.message.reply_text(f"You have selected: {data}")
 
+async def post_init(application: Application) -> None:
+    """Starts sending catalog events (price drops, restocks) to subscribers."""
+    application.create_task(notify_loop(application.bot))
+
 def main() -> None:
     """Start the bot."""
-    application = ApplicationBuilder().token(TOKEN).build()
+    application = ApplicationBuilder().token(TOKEN).post_init(post_init).build()
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("subscribe", subscribe))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe))
+    application.add_handler(CommandHandler("subscriptions", subscriptions))
     application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, web_app_data))
 
     application.run_polling()
@@ -0,0 +1,135 @@
+# cart_store.py
+"""Корзины покупателей на сервере.
+
+В cookie сессии остается только случайный cart_id, а товары корзины
+(product_id -> количество) вместе с посчитанным числом товаров лежат в
+хранилище: SqliteCartStore (таблица carts, общая для всех процессов
+приложения) или MemoryCartStore (словарь в памяти одного процесса, для
+разработки и одного воркера). Число считается при изменении корзины,
+поэтому счетчик в шапке страницы - одно чтение по ключу. Сумма не
+хранится: цены меняются с новой выгрузкой каталога, поэтому страница
+корзины и оплата считают ее по текущим ценам. Корзина живет CART_TTL
+секунд с последнего изменения.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import DB_PATH, connection
+
+# Хранилище корзин: sqlite или memory
+CART_STORE = os.environ.get('CART_STORE', 'sqlite')
+# Сколько секунд корзина хранится после последнего изменения
+CART_TTL = int(os.environ.get('CART_TTL', 14 * 24 * 3600))
+# Максимум корзин в памяти (MemoryCartStore), самые старые вытесняются
+CART_MEMORY_MAX = int(os.environ.get('CART_MEMORY_MAX', 100000))
+# Как часто SqliteCartStore удаляет просроченные корзины, секунд
+CART_PRUNE_INTERVAL = 3600
+
+
+class Cart:
+    """Товары корзины {product_id: количество} и их число"""
+    __slots__ = ('items', 'count')
+
+    def __init__(self, items=None, count=None):
+        self.items = items or {}
+        self.count = sum(self.items.values()) if count is None else count
+
+
+class MemoryCartStore:
+    """Корзины в памяти процесса; порядок словаря - порядок изменения, он же порядок истечения"""
+
+    def __init__(self, ttl=CART_TTL, max_carts=CART_MEMORY_MAX):
+        self.ttl = ttl
+        self.max_carts = max_carts
+        # cart_id -> (Cart, истекает в)
+        self._carts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cart_id):
+        entry = self._carts.get(cart_id)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def save(self, cart_id, cart):
+        with self._lock:
+            self._carts[cart_id] = (cart, time.time() + self.ttl)
+            self._carts.move_to_end(cart_id)
+            self._prune(time.time())
+
+    def delete(self, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+    def prune(self):
+        """Удаление просроченных корзин; возвращает их число"""
+        with self._lock:
+            return self._prune(time.time())
+
+    def _prune(self, now):
+        removed = 0
+        while self._carts:
+            cart_id, (_, expires_at) = next(iter(self._carts.items()))
+            if expires_at > now and len(self._carts) <= self.max_carts:
+                break
+            del self._carts[cart_id]
+            removed += 1
+        return removed
+
+    def __len__(self):
+        return len(self._carts)
+
+
+class SqliteCartStore:
+    """Корзины в таблице carts (миграция 12); просроченные удаляются раз в CART_PRUNE_INTERVAL"""
+
+    def __init__(self, db_path=DB_PATH, ttl=CART_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._pruned_at = time.monotonic()
+
+    def get(self, cart_id):
+        with connection(self.db_path) as conn:
+            row = conn.execute(
+                'SELECT items, item_count FROM carts WHERE cart_id = ? AND expires_at > ?',
+                (cart_id, int(time.time()))
+            ).fetchone()
+        if row is None:
+            return None
+        return Cart(json.loads(row[0]), row[1])
+
+    def save(self, cart_id, cart):
+        with connection(self.db_path) as conn, conn:
+            conn.execute('''
+                INSERT INTO carts (cart_id, items, item_count, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(cart_id) DO UPDATE SET
+                    items = excluded.items, item_count = excluded.item_count, expires_at = excluded.expires_at
+            ''', (cart_id, json.dumps(cart.items, separators=(',', ':')), cart.count, int(time.time()) + self.ttl))
+        if time.monotonic() - self._pruned_at > CART_PRUNE_INTERVAL:
+            self._pruned_at = time.monotonic()
+            self.prune()
+
+    def delete(self, cart_id):
+        with connection(self.db_path) as conn, conn:
+            conn.execute('DELETE FROM carts WHERE cart_id = ?', (cart_id,))
+
+    def prune(self):
+        """Удаление просроченных корзин; возвращает их число"""
+        with connection(self.db_path) as conn, conn:
+            return conn.execute('DELETE FROM carts WHERE expires_at <= ?', (int(time.time()),)).rowcount
+
+    def __len__(self):
+        with connection(self.db_path) as conn:
+            return conn.execute('SELECT COUNT(*) FROM carts').fetchone()[0]
+
+
+def make_cart_store(kind=CART_STORE, db_path=DB_PATH, ttl=CART_TTL):
+    """Хранилище корзин по имени: sqlite или memory"""
+    if kind == 'sqlite':
+        return SqliteCartStore(db_path, ttl)
+    if kind == 'memory':
+        return MemoryCartStore(ttl)
+    raise ValueError(f"Unknown cart store: {kind}")
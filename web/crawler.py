@@ -0,0 +1,190 @@
+# crawler.py
+"""Загрузка страниц каталога edwardpnz.ru.
+
+Первая страница каталога - обычный GET, следующие сайт отдает по
+POST /aj/show_category_goods.php со смещением padding (по 24 товара).
+Все запросы идут через один requests.Session с пулом соединений,
+повторами с экспоненциальной паузой и ограничением частоты на хост;
+для GET используются ETag/Last-Modified, ответ 304 берется из кэша.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SITE_URL = 'https://edwardpnz.ru'
+CATALOG_PATH = '/catalog/smartfony'
+NEXT_PAGE_PATH = '/aj/show_category_goods.php'
+PAGE_SIZE = 24
+
+logger = logging.getLogger('crawler')
+
+
+class HostRateLimiter:
+    """Не чаще rate запросов в секунду на один хост"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next_at = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_at.get(host, now))
+            self._next_at[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class CatalogCrawler:
+    def __init__(self, base_url=SITE_URL, headers=None, max_workers=4, rate_limit=4.0,
+                 retries=3, backoff=0.5, timeout=15, cache_path=None):
+        self.base_url = base_url.rstrip('/')
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.limiter = HostRateLimiter(rate_limit)
+        self.stats = {'requests': 0, 'not_modified': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,  # следующие страницы каталога - POST, их тоже повторяем
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        # url -> {'etag', 'last_modified', 'body'}
+        self.validators = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                self.validators = json.load(f)
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def fetch(self, url, data=None):
+        """GET (с условными заголовками) или POST, если передан data; возвращает HTML"""
+        self.limiter.wait(url)
+        self._count('requests')
+
+        if data is not None:
+            response = self.session.post(url, data=data, timeout=self.timeout)
+            response.raise_for_status()
+            return response.text
+
+        headers = {}
+        cached = self.validators.get(url)
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached:
+            self._count('not_modified')
+            return cached['body']
+        response.raise_for_status()
+
+        if response.headers.get('ETag') or response.headers.get('Last-Modified'):
+            self.validators[url] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'body': response.text,
+            }
+        return response.text
+
+    def _counted_fetch(self, url, data=None):
+        """fetch со счетчиком ошибок; исключение requests пробрасывается"""
+        try:
+            return self.fetch(url, data)
+        except requests.RequestException as e:
+            self._count('errors')
+            logger.warning("Ошибка загрузки %s: %s", url, e)
+            raise
+
+    def _safe_fetch(self, url, data=None):
+        """fetch, который при ошибке возвращает None (для необязательных страниц)"""
+        try:
+            return self._counted_fetch(url, data)
+        except requests.RequestException:
+            return None
+
+    @staticmethod
+    def _listing_params(html):
+        """Параметры выбранной категории для запроса следующих страниц"""
+        soup = BeautifulSoup(html, 'html.parser')
+        params = {'load': 'next'}
+        for key, selector in (('cat', '.catbox_act'), ('id', '.catalog_cat_link_act'),
+                              ('id2', '.catalog_cat_link_act2'), ('id3', '.catalog_cat_link_act3')):
+            element = soup.select_one(selector)
+            if element and element.get('data-id'):
+                params[key] = element['data-id']
+        return params
+
+    def crawl_listing(self, path=CATALOG_PATH, max_pages=100):
+        """HTML всех страниц каталога: первая страница и подгружаемые следующие.
+
+        Ошибка загрузки любой страницы (после повторов) пробрасывается как
+        requests.RequestException: неполный список страниц нельзя сохранять
+        как весь каталог, иначе товары с незагруженных страниц удалятся.
+        """
+        first = self._counted_fetch(self.base_url + path)
+        pages = [first]
+        params = self._listing_params(first)
+        next_url = self.base_url + NEXT_PAGE_PATH
+
+        # Следующие страницы запрашиваем пачками по max_workers, пока не придет пустая
+        padding = PAGE_SIZE
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(pages) < max_pages:
+                batch = [dict(params, padding=padding + i * PAGE_SIZE) for i in range(self.max_workers)]
+                padding += len(batch) * PAGE_SIZE
+                # Ошибка страницы после пустой (конец каталога) не важна: до нее цикл не дойдет
+                for html in executor.map(lambda data: self._counted_fetch(next_url, data), batch):
+                    if not html or 'card_c_' not in html:
+                        return pages
+                    pages.append(html)
+        return pages
+
+    def _site_url(self, url):
+        """Ссылка товара относительно base_url (парсер сохраняет абсолютные ссылки на сайт)"""
+        parts = urlsplit(url)
+        return self.base_url + parts.path + (f'?{parts.query}' if parts.query else '')
+
+    def crawl_product_pages(self, product_urls):
+        """{ссылка товара: HTML} страниц товаров, загруженных параллельно (незагруженные пропускаются)"""
+        urls = [url for url in dict.fromkeys(product_urls) if url]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pages = dict(zip(urls, executor.map(lambda url: self._safe_fetch(self._site_url(url)), urls)))
+        return {url: html for url, html in pages.items() if html}
+
+    def save_cache(self):
+        """Сохранение ETag/Last-Modified и тел ответов для следующего запуска"""
+        if self.cache_path:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(self.validators, f, ensure_ascii=False)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,156 @@
+# db.py
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Абсолютный путь к базе данных
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get('CATALOG_DB_PATH', os.path.join(BASE_DIR, 'iphones_catalog.db'))
+
+# Размер пула соединений (0 - без пула, соединение открывается на каждый вызов)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+# Сколько подготовленных выражений sqlite3 держит в кэше на соединение
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', 256))
+# Сколько секунд ждать снятия блокировки записи
+DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 5.0))
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=67108864',
+)
+
+
+class ConnectionPool:
+    """Пул SQLite-соединений с привязкой к потоку.
+
+    Поток получает соединение из пула при первом входе в connection()
+    и возвращает его при выходе из самого внешнего блока, поэтому
+    вложенные вызовы (например, несколько методов каталога внутри
+    одного запроса) работают на одном соединении.
+    """
+
+    def __init__(self, db_path=DB_PATH, pool_size=DB_POOL_SIZE):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self._idle = queue.LifoQueue(maxsize=max(pool_size, 1))
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        if self.pool_size > 0:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+        return self._connect()
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self.pool_size > 0:
+            try:
+                self._idle.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Соединение текущего потока (берется из пула при необходимости)"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None:
+            local.depth += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+
+        conn = self._acquire()
+        local.conn = conn
+        local.depth = 1
+        try:
+            yield conn
+        finally:
+            local.conn = None
+            local.depth = 0
+            self._release(conn)
+
+    def close(self):
+        """Закрытие всех свободных соединений пула"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=DB_PATH):
+    """Пул соединений для указанной базы (создается один раз на процесс)"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = _pools[db_path] = ConnectionPool(db_path, DB_POOL_SIZE)
+    return pool
+
+
+def connection(db_path=DB_PATH):
+    """Контекстный менеджер соединения из пула"""
+    return get_pool(db_path).connection()
+
+
+def configure(pool_size):
+    """Смена размера пула: существующие пулы закрываются и пересоздаются"""
+    global DB_POOL_SIZE
+    with _pools_lock:
+        DB_POOL_SIZE = pool_size
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+CATALOG_VERSION_KEY = 'catalog_version'
+
+
+def get_catalog_version(conn):
+    """Текущая версия каталога (увеличивается при каждом сохранении парсером)"""
+    try:
+        row = conn.execute(
+            'SELECT value FROM catalog_meta WHERE key = ?', (CATALOG_VERSION_KEY,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # База создана до появления catalog_meta
+        return 0
+    return row[0] if row else 0
+
+
+def bump_catalog_version(cursor):
+    """Увеличение версии каталога (вызывается внутри транзакции записи)"""
+    cursor.execute('''
+        INSERT INTO catalog_meta (key, value) VALUES (?, 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    ''', (CATALOG_VERSION_KEY,))
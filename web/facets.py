@@ -0,0 +1,148 @@
+# facets.py
+"""Фасетный фильтр каталога на битовых масках.
+
+Для каждого значения фасета (цвет, память, SIM, категория, диапазон
+цены) хранится целое число, в котором бит i установлен, если товар
+с позицией i в снимке имеет это значение. Фильтр - AND по фасетам
+и OR по значениям внутри фасета, количество - число единичных бит.
+Индекс строится вместе со снимком каталога, то есть заново после
+каждого iPhoneDatabase.save_catalog.
+"""
+
+# Диапазоны цены: (ключ, от включительно, до не включительно)
+PRICE_RANGES = (
+    ('0-50000', 0, 50000),
+    ('50000-80000', 50000, 80000),
+    ('80000-110000', 80000, 110000),
+    ('110000-150000', 110000, 150000),
+    ('150000+', 150000, None),
+)
+
+_PRICE_ORDER = {key: index for index, (key, _, _) in enumerate(PRICE_RANGES)}
+
+FACETS = ('category', 'color', 'memory', 'sim', 'price')
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+# int.bit_count() появился только в Python 3.10
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count  # noqa: F811
+
+
+def _positions_to_bits(positions, size):
+    """Маска из списка позиций (собирается в байтах, без сдвигов больших чисел)"""
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def _price_range(price):
+    for key, low, high in PRICE_RANGES:
+        if price >= low and (high is None or price < high):
+            return key
+    return None
+
+
+def _facet_values(product):
+    """Значения всех фасетов одного товара"""
+    return {
+        'category': [product['category']] if product['category'] else [],
+        'color': product['colors_list'],
+        'memory': product['memory_list'],
+        'sim': [product['current_sim']] if product['current_sim'] else [],
+        'price': [_price_range(product['price'] or 0)],
+    }
+
+
+class FacetIndex:
+    """Инвертированный индекс значение фасета -> битовая маска товаров"""
+
+    def __init__(self, products):
+        self.products = tuple(products)
+        self.all_bits = (1 << len(self.products)) - 1
+        positions = {facet: {} for facet in FACETS}
+
+        for position, product in enumerate(self.products):
+            for facet, values in _facet_values(product).items():
+                for value in values:
+                    if value is not None:
+                        positions[facet].setdefault(value, []).append(position)
+
+        size = len(self.products)
+        self.bitmaps = {
+            facet: {value: _positions_to_bits(value_positions, size) for value, value_positions in values.items()}
+            for facet, values in positions.items()
+        }
+
+    def _facet_bits(self, facet, values):
+        bitmap = self.bitmaps[facet]
+        bits = 0
+        for value in values:
+            bits |= bitmap.get(value, 0)
+        return bits
+
+    def bits_for(self, predicate):
+        """Маска товаров, для которых predicate(product) истинно"""
+        return _positions_to_bits(
+            (position for position, product in enumerate(self.products) if predicate(product)),
+            len(self.products),
+        )
+
+    def filter(self, filters, base_bits=None):
+        """Маска товаров и счетчики фасетов для {фасет: [значения]}.
+
+        Счетчик значения считается с учетом всех выбранных фильтров,
+        кроме фильтра по его собственному фасету, чтобы внутри фасета
+        было видно, сколько товаров добавит еще одно значение.
+        """
+        base = self.all_bits if base_bits is None else base_bits
+        selected = {
+            facet: self._facet_bits(facet, values)
+            for facet, values in filters.items() if facet in self.bitmaps and values
+        }
+
+        result = base
+        for bits in selected.values():
+            result &= bits
+
+        counts = {}
+        for facet, bitmap in self.bitmaps.items():
+            others = base
+            for other, bits in selected.items():
+                if other != facet:
+                    others &= bits
+            values = [
+                {'value': value, 'count': _popcount(others & bits)}
+                for value, bits in bitmap.items()
+            ]
+            if facet == 'price':
+                values.sort(key=lambda item: _PRICE_ORDER[item['value']])
+            else:
+                values.sort(key=lambda item: (-item['count'], item['value']))
+            counts[facet] = [item for item in values if item['count']]
+        return result, counts
+
+    def count(self, bits):
+        return _popcount(bits)
+
+    def products_for(self, bits, order=None, limit=None):
+        """Не больше limit товаров из маски в порядке позиций order (по умолчанию - порядок индекса)"""
+        flags = bin(bits)[:1:-1]  # младший бит - первый символ
+        products = []
+        if order is None:
+            position = flags.find('1')
+            while position != -1 and (limit is None or len(products) < limit):
+                products.append(self.products[position])
+                position = flags.find('1', position + 1)
+        else:
+            size = len(flags)
+            for position in order:
+                if position < size and flags[position] == '1':
+                    products.append(self.products[position])
+                    if limit is not None and len(products) >= limit:
+                        break
+        return products
@@ -0,0 +1,121 @@
+# fake_bot_api.py
+"""Локальная замена Telegram Bot API для проверки notifier.py.
+
+Отвечает на getMe и sendMessage как api.telegram.org, запоминает
+отправленные сообщения и, как настоящий сервер, отвечает 429 с
+retry_after, если бот пишет в один чат чаще раза в chat_interval
+секунд или всего чаще global_rate сообщений в секунду, и 403 для
+чатов из blocked (бот заблокирован пользователем).
+
+Запуск: python fake_bot_api.py [--port 8081] [--rate 30]
+затем:  python notifier.py --base-url http://127.0.0.1:8081/bot
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class FakeBotAPI:
+    def __init__(self, global_rate=30, chat_interval=1.0, blocked=()):
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.blocked = set(blocked)
+        self.messages = []
+        self.hits = {'sendMessage': 0, '429': 0, '403': 0}
+        self._lock = threading.Lock()
+        self._chat_sent_at = {}
+        self._second = 0
+        self._second_count = 0
+
+    def send_message(self, chat_id, text):
+        """(HTTP-статус, ответ Bot API) на sendMessage"""
+        with self._lock:
+            self.hits['sendMessage'] += 1
+            if chat_id in self.blocked:
+                self.hits['403'] += 1
+                return 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+
+            now = time.monotonic()
+            second = int(now)
+            if second != self._second:
+                self._second, self._second_count = second, 0
+            last = self._chat_sent_at.get(chat_id)
+            if (self.global_rate and self._second_count >= self.global_rate) or \
+                    (last is not None and now - last < self.chat_interval):
+                self.hits['429'] += 1
+                return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                             'parameters': {'retry_after': 1}}
+
+            self._second_count += 1
+            self._chat_sent_at[chat_id] = now
+            self.messages.append((chat_id, text))
+            message_id = len(self.messages)
+        return 200, {'ok': True, 'result': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+            'text': text,
+        }}
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive: клиент держит пул соединений
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _params(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length).decode('utf-8')
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                return json.loads(body or '{}')
+            return dict(parse_qsl(body))
+
+        def do_POST(self):
+            # /bot<token>/<method>
+            method = self.path.rsplit('/', 1)[-1]
+            params = self._params()
+            if method == 'getMe':
+                return self._send(200, {'ok': True, 'result': {
+                    'id': 1, 'is_bot': True, 'first_name': 'TonStore', 'username': 'tonstore_test_bot',
+                }})
+            if method == 'sendMessage':
+                return self._send(*api.send_message(int(params['chat_id']), params.get('text', '')))
+            self._send(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+        do_GET = do_POST
+
+    return Handler
+
+
+def start_fake_bot_api(port=0, **kwargs):
+    """Запуск в фоновом потоке; возвращает (server, api, base_url для Bot)"""
+    api = FakeBotAPI(**kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, api, f'http://127.0.0.1:{server.server_address[1]}/bot'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальный Telegram Bot API')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--rate', type=float, default=30, help='сообщений в секунду до ответа 429')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.rate)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(api))
+    print(f"🤖 Bot API: http://127.0.0.1:{args.port}/bot<token>/sendMessage")
+    server.serve_forever()
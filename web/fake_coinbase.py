@@ -0,0 +1,136 @@
+# fake_coinbase.py
+"""Локальная замена Coinbase Commerce API для проверки оформления заказа.
+
+Отвечает на POST /charges и GET /charges/<code> как
+api.commerce.coinbase.com, с задержкой latency (+ случайные до jitter)
+секунд и ответом 500 с вероятностью fail_rate. Повторный запрос с тем
+же заголовком Idempotency-Key возвращает уже созданный платеж, даже
+если первый запрос клиент бросил по таймауту.
+
+Запуск: python fake_coinbase.py [--port 8082] [--latency 2]
+затем:  COINBASE_COMMERCE_API_KEY=test COINBASE_API_URL=http://127.0.0.1:8082/ python app.py
+"""
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeCoinbase:
+    def __init__(self, latency=0.0, jitter=0.0, fail_rate=0.0, base_url='http://127.0.0.1'):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.base_url = base_url
+        self.charges = {}
+        self.hits = {'create': 0, 'replayed': 0, '500': 0}
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(42)
+
+    def delay(self):
+        with self._lock:
+            extra = self._random.random() * self.jitter
+        time.sleep(self.latency + extra)
+
+    def create_charge(self, params, idempotency_key):
+        """(HTTP-статус, ответ API) на POST /charges"""
+        with self._lock:
+            self.hits['create'] += 1
+            if self.fail_rate and self._random.random() < self.fail_rate:
+                self.hits['500'] += 1
+                return 500, {'error': {'type': 'internal_server_error', 'message': 'Internal server error'}}
+            if idempotency_key and idempotency_key in self._by_key:
+                self.hits['replayed'] += 1
+                return 201, {'data': self.charges[self._by_key[idempotency_key]]}
+
+            code = secrets.token_hex(4).upper()
+            charge = {
+                'id': str(uuid.uuid4()),
+                'resource': 'charge',
+                'code': code,
+                'name': params.get('name'),
+                'description': params.get('description'),
+                'pricing_type': params.get('pricing_type'),
+                'pricing': {'local': params.get('local_price')},
+                'metadata': params.get('metadata', {}),
+                'redirect_url': params.get('redirect_url'),
+                'cancel_url': params.get('cancel_url'),
+                'hosted_url': f'{self.base_url}/pay/{code}',
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'timeline': [{'status': 'NEW', 'time': datetime.now(timezone.utc).isoformat()}],
+            }
+            self.charges[code] = charge
+            if idempotency_key:
+                self._by_key[idempotency_key] = code
+        return 201, {'data': charge}
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент не дождался ответа (таймаут)
+                pass
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length) or b'{}')
+            if not self.headers.get('X-CC-Api-Key'):
+                return self._send(401, {'error': {'type': 'authentication_error', 'message': 'No API key'}})
+            if self.path.rstrip('/') != '/charges':
+                return self._send(404, {'error': {'type': 'not_found', 'message': 'Not found'}})
+            # Платеж создается до задержки: клиент, бросивший запрос по таймауту, получит его при повторе
+            status, body = api.create_charge(params, self.headers.get('Idempotency-Key'))
+            api.delay()
+            self._send(status, body)
+
+        def do_GET(self):
+            code = self.path.rstrip('/').rsplit('/', 1)[-1]
+            charge = api.charges.get(code)
+            if charge is None:
+                return self._send(404, {'error': {'type': 'not_found', 'message': 'Not found'}})
+            self._send(200, {'data': charge})
+
+    return Handler
+
+
+def start_fake_coinbase(port=0, **kwargs):
+    """Запуск в фоновом потоке; возвращает (server, api, base_url для COINBASE_API_URL)"""
+    api = FakeCoinbase(**kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(api))
+    server.daemon_threads = True
+    api.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, api, api.base_url + '/'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальный Coinbase Commerce API')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--latency', type=float, default=0.5, help='задержка ответа, секунд')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, секунд')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='доля ответов 500')
+    args = parser.parse_args()
+
+    api = FakeCoinbase(args.latency, args.jitter, args.fail_rate, f'http://127.0.0.1:{args.port}')
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(api))
+    print(f"💳 Coinbase Commerce API: http://127.0.0.1:{args.port}/charges")
+    server.serve_forever()
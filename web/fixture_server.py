@@ -0,0 +1,122 @@
+# fixture_server.py
+"""Локальная замена edwardpnz.ru для проверки crawler.py.
+
+Отдает сохраненный site-html.txt как первую страницу каталога, копии
+его карточек с другими ID как следующие страницы (POST
+/aj/show_category_goods.php) и debug_soup.html как страницу товара.
+Поддерживает ETag/If-Modified-Since (ответ 304).
+
+Запуск: python fixture_server.py [--port 8765] [--pages 3]
+затем:  python parsing.py --crawl --base-url http://127.0.0.1:8765
+"""
+import argparse
+import hashlib
+import os
+import re
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CARD_START = '<div class = "flex flex_col flex_center_center card"'
+CARD_ID = re.compile(r'(?<=_c_)\d+')
+
+
+def _read(name):
+    with open(os.path.join(BASE_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _extract_cards(html):
+    """HTML карточек товаров первой страницы одним фрагментом"""
+    start = html.index(CARD_START)
+    end = html.index('<div class = "flex flex_center load_next_catalog">')
+    fragment = html[start:end]
+    # Отрезаем закрывающие теги контейнера catalog_con
+    return fragment[:fragment.rindex('</div>', 0, fragment.rindex('</div>'))]
+
+
+class FixtureSite:
+    def __init__(self, pages=3):
+        self.first_page = _read('site-html.txt')
+        self.product_page = _read('debug_soup.html')
+        self.cards = _extract_cards(self.first_page)
+        self.pages = pages
+        self.last_modified = formatdate(usegmt=True)
+        self.hits = {'GET': 0, 'POST': 0, '304': 0}
+
+    def next_page(self, padding):
+        """Страница padding // 24: те же карточки со сдвинутыми ID, пусто после последней"""
+        page = padding // 24
+        if page <= 0 or page >= self.pages:
+            return ''
+        offset = page * 100000
+        return CARD_ID.sub(lambda m: str(int(m.group()) + offset), self.cards)
+
+
+def make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, body, status=200, headers=None):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            site.hits['GET'] += 1
+            path = self.path.split('?', 1)[0]
+            if path.rstrip('/') == '/catalog/smartfony':
+                body = site.first_page
+            elif path.startswith('/catalog/'):
+                body = site.product_page
+            else:
+                return self._send('Not found', 404)
+
+            etag = '"%s"' % hashlib.md5(body.encode('utf-8')).hexdigest()
+            if self.headers.get('If-None-Match') == etag or \
+                    self.headers.get('If-Modified-Since') == site.last_modified:
+                site.hits['304'] += 1
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self._send(body, headers={'ETag': etag, 'Last-Modified': site.last_modified})
+
+        def do_POST(self):
+            site.hits['POST'] += 1
+            if self.path != '/aj/show_category_goods.php':
+                return self._send('Not found', 404)
+            length = int(self.headers.get('Content-Length', 0))
+            form = parse_qs(self.rfile.read(length).decode('utf-8'))
+            padding = int(form.get('padding', ['0'])[0])
+            self._send(site.next_page(padding))
+
+    return Handler
+
+
+def start_fixture_server(port=0, pages=3):
+    """Запуск в фоновом потоке; возвращает (server, site, base_url)"""
+    site = FixtureSite(pages)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, site, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальная копия каталога edwardpnz.ru')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pages', type=int, default=3, help='страниц каталога по 24 товара')
+    args = parser.parse_args()
+
+    site = FixtureSite(args.pages)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(site))
+    print(f"🌐 Каталог: http://127.0.0.1:{args.port}/catalog/smartfony ({args.pages} стр.)")
+    server.serve_forever()
@@ -0,0 +1,76 @@
+# gunicorn.conf.py
+"""Продакшен-запуск: gunicorn -c gunicorn.conf.py wsgi:app
+
+WEB_WORKERS процессов по WEB_THREADS потоков. Приложение загружается в
+мастере до fork (preload_app, см. wsgi.py). Мастер раз в
+CATALOG_RELOAD_INTERVAL секунд сверяет версию каталога в БД и, если
+парсер сохранил новую выгрузку, перезагружает воркеров по SIGHUP:
+строит новый снимок у себя, запускает новых воркеров и дает старым
+дообработать запросы (graceful_timeout).
+"""
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+
+# Процессов и потоков в каждом
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 4))
+# Как часто мастер сверяет версию каталога с БД, секунд (0 - не перезагружать воркеров)
+CATALOG_RELOAD_INTERVAL = float(os.environ.get('CATALOG_RELOAD_INTERVAL', 10))
+
+# Новую версию приносит перезагрузка, поэтому воркерам незачем сверять ее на каждом запросе
+if CATALOG_RELOAD_INTERVAL:
+    os.environ.setdefault('CATALOG_VERSION_TTL', str(CATALOG_RELOAD_INTERVAL))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = WEB_WORKERS
+threads = WEB_THREADS
+worker_class = 'gthread'
+preload_app = True
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+accesslog = os.environ.get('ACCESS_LOG')
+errorlog = '-'
+# Heartbeat воркеров в памяти, а не на диске контейнера
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def _read_catalog_version():
+    # Модули приложения доступны только после загрузки приложения (--chdir добавляет путь позже)
+    from db import DB_PATH, get_catalog_version
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return get_catalog_version(conn)
+    finally:
+        conn.close()
+
+
+def _watch_catalog_version(server):
+    version = _read_catalog_version()
+    while True:
+        time.sleep(CATALOG_RELOAD_INTERVAL)
+        try:
+            current = _read_catalog_version()
+        except sqlite3.Error as e:
+            server.log.warning("Не удалось проверить версию каталога: %s", e)
+            continue
+        if current != version:
+            server.log.info("Версия каталога %s -> %s, перезагрузка воркеров", version, current)
+            version = current
+            os.kill(server.pid, signal.SIGHUP)
+
+
+def when_ready(server):
+    if CATALOG_RELOAD_INTERVAL:
+        threading.Thread(target=_watch_catalog_version, args=(server,), name='catalog-watch', daemon=True).start()
+
+
+def on_reload(server):
+    # Вызывается в мастере до запуска новых воркеров: они получат новый снимок уже готовым
+    import wsgi
+    server.log.info("Каталог версии %s загружен", wsgi.preload())
@@ -0,0 +1,457 @@
+# migrations.py
+"""Версионированная схема базы каталога.
+
+Номер примененной миграции хранится в PRAGMA user_version. Схему
+создают и обновляют и парсер (parsing.py), и web_db_setup.py, вызывая
+migrate(). Проверка планов горячих запросов: python migrations.py --check
+"""
+import argparse
+import json
+import re
+import sqlite3
+import sys
+
+from price_history import parse_price, timestamp
+from search import rebuild_search_index
+
+
+def _create_base_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS iphones_catalog (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id TEXT UNIQUE,
+            model TEXT NOT NULL,
+            price INTEGER DEFAULT 0,
+            currency TEXT DEFAULT 'RUB',
+            old_price TEXT,
+            current_color TEXT,
+            current_memory TEXT,
+            current_sim TEXT,
+            image_url TEXT,
+            product_url TEXT,
+            parsed_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            category TEXT DEFAULT 'iPhone',
+            is_featured INTEGER DEFAULT 0,
+            display_order INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Таблица могла быть создана старым parsing.py без этих колонок
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(iphones_catalog)')}
+    for column, definition in (
+        ('category', "TEXT DEFAULT 'iPhone'"),
+        ('is_featured', 'INTEGER DEFAULT 0'),
+        ('display_order', 'INTEGER DEFAULT 0'),
+    ):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE iphones_catalog ADD COLUMN {column} {definition}')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS iphone_catalog_colors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id TEXT,
+            color_name TEXT,
+            FOREIGN KEY (product_id) REFERENCES iphones_catalog (product_id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS iphone_catalog_memory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id TEXT,
+            memory_size TEXT,
+            FOREIGN KEY (product_id) REFERENCES iphones_catalog (product_id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'new',
+            charge_code TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES iphones_catalog (product_id)
+        )
+    ''')
+
+
+def _create_catalog_meta(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+
+
+def _create_indexes(cursor):
+    # Покрывающие индексы для GROUP_CONCAT по цветам и памяти
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_colors_product ON iphone_catalog_colors (product_id, color_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_product ON iphone_catalog_memory (product_id, memory_size)')
+    # Фильтр по категории, похожие товары и счетчики категорий
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_catalog_category_price ON iphones_catalog (category, price)')
+    # Рекомендуемые товары
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_catalog_featured_price ON iphones_catalog (is_featured, price)')
+    # Сортировки каталога
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_catalog_price ON iphones_catalog (price)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_catalog_display_order ON iphones_catalog (display_order)')
+    # Поиск заказа из вебхука
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_charge_code ON orders (charge_code)')
+
+
+def _create_keyset_indexes(cursor):
+    # Keyset-пагинация: (колонка сортировки, product_id) для каждого варианта sort_by
+    cursor.execute('DROP INDEX IF EXISTS idx_catalog_price')
+    cursor.execute('DROP INDEX IF EXISTS idx_catalog_display_order')
+    cursor.execute('DROP INDEX IF EXISTS idx_catalog_category_price')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_catalog_price_id ON iphones_catalog (price, product_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_catalog_model_id ON iphones_catalog (model, product_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_catalog_display_order_id ON iphones_catalog (display_order, product_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_catalog_category_price_id ON iphones_catalog (category, price, product_id)')
+
+
+def _create_search_index(cursor):
+    # Поисковый индекс; строки пересобирает iPhoneDatabase.save_catalog
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS catalog_search USING fts5(
+            model,
+            colors,
+            memory,
+            sim,
+            category,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '1 2 3'
+        )
+    ''')
+    rebuild_search_index(cursor)
+
+
+def _create_scrape_hashes(cursor):
+    # Хэши HTML карточек и страниц прошлого разбора: неизменившиеся не разбираются повторно
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS card_hashes (
+            product_id TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            page TEXT
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS page_hashes (
+            page TEXT PRIMARY KEY,
+            hash TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _create_price_history(cursor):
+    # Точки истории цен подряд по товару и времени; индекс по ts - для поиска подешевевших товаров
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS price_history (
+            product_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            price INTEGER NOT NULL,
+            old_price INTEGER,
+            PRIMARY KEY (product_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_price_history_ts ON price_history (ts)')
+    # Первая точка - текущая цена каталога на дату последнего разбора
+    rows = cursor.execute('''
+        SELECT product_id, COALESCE(parsed_at, created_at), price, old_price FROM iphones_catalog
+    ''').fetchall()
+    cursor.executemany(
+        'INSERT OR IGNORE INTO price_history (product_id, ts, price, old_price) VALUES (?, ?, ?, ?)',
+        [
+            (product_id, timestamp(parsed_at) if parsed_at else timestamp(), price or 0, parse_price(old_price))
+            for product_id, parsed_at, price, old_price in rows
+        ]
+    )
+
+
+def _create_subscriptions(cursor):
+    # Подписки бота: поиск подписчиков события идет по (kind, target)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            kind TEXT NOT NULL,
+            target TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (kind, target, chat_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_chat ON subscriptions (chat_id)')
+    # События каталога для рассылки; бот удаляет их после отправки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_events (
+            id INTEGER PRIMARY KEY,
+            ts INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            model TEXT,
+            was_price INTEGER,
+            price INTEGER
+        )
+    ''')
+
+
+def _add_order_checkout(cursor):
+    # Платеж создается в фоне (payments.py): запрос к Coinbase, ключ идемпотентности и результат
+    for column in ('checkout_key TEXT', 'charge_request TEXT', 'charge_requested_at INTEGER',
+                   'hosted_url TEXT', 'charge_error TEXT'):
+        cursor.execute(f'ALTER TABLE orders ADD COLUMN {column}')
+
+
+def _create_webhook_events(cursor):
+    # Журнал вебхуков Coinbase (webhooks.py): id события уникален - повторная доставка не записывается
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            id INTEGER PRIMARY KEY,
+            event_id TEXT NOT NULL UNIQUE,
+            type TEXT NOT NULL,
+            order_id INTEGER,
+            charge_code TEXT,
+            payload TEXT NOT NULL,
+            received_at INTEGER NOT NULL,
+            applied_at INTEGER
+        )
+    ''')
+    # Непримененные события по порядку получения; индекс содержит только их
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_webhook_events_pending ON webhook_events (id) WHERE applied_at IS NULL
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_webhook_events_applied ON webhook_events (applied_at)')
+
+
+def _create_order_items(cursor):
+    # Товары заказа отдельными строками вместо ID через запятую в orders.product_id
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id INTEGER NOT NULL,
+            product_id TEXT NOT NULL,
+            qty INTEGER NOT NULL,
+            unit_price INTEGER NOT NULL,
+            PRIMARY KEY (order_id, product_id),
+            FOREIGN KEY (order_id) REFERENCES orders (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, created_at)')
+
+    # Перенос старых заказов. Количество известно только из metadata.cart_items
+    # запроса платежа (заказы после миграции 9), иначе 1; цена за штуку - цена
+    # заказа для заказа из одного товара, иначе текущая цена каталога
+    catalog_prices = dict(cursor.execute('SELECT product_id, price FROM iphones_catalog').fetchall())
+    items = []
+    for order_id, product_ids, price, charge_request in cursor.execute(
+        'SELECT id, product_id, price, charge_request FROM orders'
+    ).fetchall():
+        quantities = {}
+        if charge_request:
+            cart_items = json.loads(charge_request).get('metadata', {}).get('cart_items')
+            quantities = json.loads(cart_items) if cart_items else {}
+        order_items = {}
+        for product_id in filter(None, product_ids.split(',')):
+            order_items[product_id] = order_items.get(product_id, 0) + int(quantities.get(product_id, 1))
+        for product_id, qty in order_items.items():
+            unit_price = price // qty if len(order_items) == 1 else catalog_prices.get(product_id, 0)
+            items.append((order_id, product_id, qty, unit_price))
+    cursor.executemany('INSERT OR IGNORE INTO order_items VALUES (?, ?, ?, ?)', items)
+
+
+def _create_carts(cursor):
+    # Корзины на сервере (cart_store.py): в cookie сессии только cart_id
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS carts (
+            cart_id TEXT PRIMARY KEY,
+            items TEXT NOT NULL,
+            item_count INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_carts_expires_at ON carts (expires_at)')
+
+
+def _add_notification_retries(cursor):
+    # Разосланные события помечаются, а не удаляются сразу: событие живет, пока есть недоставленные
+    # сообщения о нем (notification_retries - чаты, которым отправка не удалась, и число попыток)
+    cursor.execute('ALTER TABLE catalog_events ADD COLUMN notified_at INTEGER')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_retries (
+            chat_id INTEGER NOT NULL,
+            event_id INTEGER NOT NULL,
+            attempts INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, event_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notification_retries_event ON notification_retries (event_id)')
+
+
+def _drop_cart_totals(cursor):
+    # Сумма корзины устаревала при смене цен: ее считают по текущим ценам каталога
+    cursor.execute('ALTER TABLE carts DROP COLUMN total')
+
+
+# (версия, описание, функция); новые миграции добавляются только в конец
+MIGRATIONS = [
+    (1, 'base catalog and orders tables', _create_base_tables),
+    (2, 'catalog_meta with catalog_version', _create_catalog_meta),
+    (3, 'indexes for catalog and order lookups', _create_indexes),
+    (4, 'keyset pagination indexes', _create_keyset_indexes),
+    (5, 'FTS5 catalog search index', _create_search_index),
+    (6, 'card and page content hashes for incremental scrapes', _create_scrape_hashes),
+    (7, 'price history', _create_price_history),
+    (8, 'bot subscriptions and catalog events', _create_subscriptions),
+    (9, 'background charge creation columns for orders', _add_order_checkout),
+    (10, 'coinbase webhook event log', _create_webhook_events),
+    (11, 'normalized order items', _create_order_items),
+    (12, 'server-side carts', _create_carts),
+    (13, 'notification retries', _add_notification_retries),
+    (14, 'drop stored cart totals', _drop_cart_totals),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """Применение всех недостающих миграций; возвращает итоговую версию схемы"""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            apply(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        print(f"🛠 Миграция {version}: {description}")
+        current = version
+    return current
+
+
+# Горячие запросы приложения: ни один не должен читать таблицу целиком без индекса
+HOT_QUERIES = [
+    ('product by id', '''
+        SELECT ic.*, GROUP_CONCAT(DISTINCT icc.color_name), GROUP_CONCAT(DISTINCT icm.memory_size)
+        FROM iphones_catalog ic
+        LEFT JOIN iphone_catalog_colors icc ON ic.product_id = icc.product_id
+        LEFT JOIN iphone_catalog_memory icm ON ic.product_id = icm.product_id
+        WHERE ic.product_id IN (?, ?)
+        GROUP BY ic.product_id
+    ''', ('1', '2')),
+    ('catalog listing', '''
+        SELECT ic.*, GROUP_CONCAT(DISTINCT icc.color_name), GROUP_CONCAT(DISTINCT icm.memory_size)
+        FROM iphones_catalog ic
+        LEFT JOIN iphone_catalog_colors icc ON ic.product_id = icc.product_id
+        LEFT JOIN iphone_catalog_memory icm ON ic.product_id = icm.product_id
+        WHERE ic.category = ?
+        GROUP BY ic.product_id
+        ORDER BY ic.price DESC
+    ''', ('iPhone',)),
+    ('catalog page', '''
+        SELECT ic.*,
+               (SELECT GROUP_CONCAT(DISTINCT color_name) FROM iphone_catalog_colors
+                WHERE product_id = ic.product_id),
+               (SELECT GROUP_CONCAT(DISTINCT memory_size) FROM iphone_catalog_memory
+                WHERE product_id = ic.product_id)
+        FROM iphones_catalog ic
+        WHERE (ic.price, ic.product_id) < (?, ?)
+        ORDER BY ic.price DESC, ic.product_id DESC LIMIT ?
+    ''', (100000, '1', 25)),
+    ('search count', '''
+        SELECT COUNT(*) FROM iphones_catalog ic
+        WHERE ic.id IN (SELECT rowid FROM catalog_search WHERE catalog_search MATCH ?)
+    ''', ('"iphone"* "pro"*',)),
+    ('categories', '''
+        SELECT category, COUNT(*) as count FROM iphones_catalog GROUP BY category ORDER BY count DESC
+    ''', ()),
+    ('count by category', 'SELECT COUNT(*) FROM iphones_catalog WHERE category = ?', ('iPhone',)),
+    ('similar products', '''
+        SELECT * FROM iphones_catalog WHERE category = ? AND product_id != ? ORDER BY price DESC LIMIT ?
+    ''', ('iPhone', '1', 4)),
+    ('featured products', '''
+        SELECT * FROM iphones_catalog WHERE is_featured = 1 ORDER BY price DESC LIMIT ?
+    ''', (6,)),
+    ('order by id', 'SELECT * FROM orders WHERE id = ?', (1,)),
+    ('order by charge code', 'SELECT * FROM orders WHERE charge_code = ?', ('ABC',)),
+    ('orders by status', '''
+        SELECT id FROM orders WHERE status = ? AND created_at < ? ORDER BY created_at
+    ''', ('new', '2024-01-01')),
+    ('order with items', '''
+        SELECT o.*, i.product_id, i.qty, i.unit_price, c.model, c.image_url
+        FROM orders o
+        LEFT JOIN order_items i ON i.order_id = o.id
+        LEFT JOIN iphones_catalog c ON c.product_id = i.product_id
+        WHERE o.id = ?
+    ''', (1,)),
+    ('pending webhook events', '''
+        SELECT id, type, order_id, charge_code FROM webhook_events
+        WHERE applied_at IS NULL ORDER BY id LIMIT ?
+    ''', (500,)),
+    ('cart by id', 'SELECT items, item_count FROM carts WHERE cart_id = ? AND expires_at > ?', ('a', 0)),
+    ('expired carts', 'DELETE FROM carts WHERE expires_at <= ?', (0,)),
+    ('price history', '''
+        SELECT ts, price, old_price FROM price_history
+        WHERE product_id = ? AND ts >= (
+            SELECT COALESCE(MAX(ts), 0) FROM price_history WHERE product_id = ? AND ts <= ?
+        )
+        ORDER BY ts
+    ''', ('1', '1', 0)),
+    ('subscribers of product', '''
+        SELECT chat_id FROM subscriptions WHERE kind = 'product' AND target = ?
+    ''', ('1',)),
+    ('subscriptions of chat', 'SELECT kind, target FROM subscriptions WHERE chat_id = ?', (1,)),
+    ('price drops', '''
+        SELECT c.product_id,
+               (SELECT h.price FROM price_history h WHERE h.product_id = c.product_id AND h.ts < ?
+                ORDER BY h.ts DESC LIMIT 1)
+        FROM iphones_catalog c
+        WHERE c.product_id IN (SELECT product_id FROM price_history WHERE ts >= ?)
+    ''', (0, 0)),
+]
+
+# "SCAN table" без индекса - полный просмотр таблицы
+_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def check_query_plans(conn):
+    """EXPLAIN QUERY PLAN горячих запросов; возвращает список найденных полных сканов"""
+    problems = []
+    for name, query, params in HOT_QUERIES:
+        for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params):
+            detail = row[-1]
+            if _FULL_SCAN.match(detail):
+                problems.append(f'{name}: {detail}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Миграции схемы каталога')
+    parser.add_argument('db_path', nargs='?', default='iphones_catalog.db')
+    parser.add_argument('--check', action='store_true', help='проверить планы горячих запросов')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_path)
+    try:
+        version = migrate(conn)
+        print(f"Схема базы {args.db_path}: версия {version}")
+        problems = check_query_plans(conn) if args.check else []
+    finally:
+        conn.close()
+
+    if args.check:
+        for problem in problems:
+            print(f"❌ Полный скан: {problem}")
+        if problems:
+            sys.exit(1)
+        print("✅ Полных сканов в горячих запросах нет")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+# notifier.py
+"""Рассылка событий каталога подписчикам бота.
+
+События одного чата собираются в одно сообщение (длинные делятся по
+4096 символов), сообщения отправляются из ограниченной asyncio-очереди
+несколькими воркерами с общим ограничением частоты (Telegram: около
+30 сообщений в секунду на бота) и не чаще одного сообщения в секунду в
+один чат (в группу - раз в 3 секунды). На 429 вся рассылка ждет
+retry_after, чаты, заблокировавшие бота, отписываются.
+
+Получатели копируются во временную таблицу одним запросом и читаются
+пачками по NOTIFY_BATCH строк; запросы к SQLite идут в потоке
+(asyncio.to_thread), не останавливая отправку. Сообщение, которое не
+удалось отправить, запоминается в notification_retries и повторяется
+при следующей рассылке (до NOTIFY_MAX_ATTEMPTS раз); событие удаляется,
+только когда о нем некому больше сообщать.
+
+Запуск один раз (например, после parsing.py): python notifier.py
+Проверка на локальном сервере: python notifier.py --base-url http://127.0.0.1:8081/bot
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from itertools import groupby
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+
+from db import DB_BUSY_TIMEOUT, DB_PATH
+from subscriptions import queue_notifications
+
+# Одновременных запросов к Bot API
+NOTIFY_CONCURRENCY = int(os.environ.get('NOTIFY_CONCURRENCY', 32))
+# Сообщений в секунду на бота (с allow_paid_broadcast Telegram разрешает до 1000)
+NOTIFY_GLOBAL_RATE = float(os.environ.get('NOTIFY_GLOBAL_RATE', 30))
+# Секунд между сообщениями в один личный чат и в группу
+NOTIFY_CHAT_INTERVAL = float(os.environ.get('NOTIFY_CHAT_INTERVAL', 1.0))
+NOTIFY_GROUP_INTERVAL = float(os.environ.get('NOTIFY_GROUP_INTERVAL', 3.0))
+# Как часто бот проверяет новые события, секунд
+NOTIFY_INTERVAL = float(os.environ.get('NOTIFY_INTERVAL', 60))
+NOTIFY_RETRIES = 3
+# Строк получателей в одной пачке рассылки
+NOTIFY_BATCH = int(os.environ.get('NOTIFY_BATCH', 5000))
+# Сколько рассылок подряд пробовать доставить сообщение, прежде чем от него отказаться
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 5))
+MESSAGE_LIMIT = 4096
+
+logger = logging.getLogger('notifier')
+
+
+def _format_price(price):
+    return f"{price:,} руб.".replace(',', ' ')
+
+
+def _event_line(kind, model, was_price, price):
+    if kind == 'price_drop':
+        return f"📉 {model}: {_format_price(was_price)} → {_format_price(price)}"
+    return f"✅ Снова в наличии: {model}, {_format_price(price)}"
+
+
+def chat_messages(rows):
+    """(chat_id, текст) из строк notify_queue: все события чата в одном сообщении"""
+    for chat_id, chat_rows in groupby(rows, key=lambda row: row[0]):
+        text = ''
+        for _, _, kind, _, model, was_price, price in chat_rows:
+            line = _event_line(kind, model, was_price, price)
+            if text and len(text) + 1 + len(line) > MESSAGE_LIMIT:
+                yield chat_id, text
+                text = ''
+            text = f"{text}\n{line}" if text else line[:MESSAGE_LIMIT]
+        if text:
+            yield chat_id, text
+
+
+class ChatRateLimiter:
+    """Не чаще global_rate сообщений в секунду всего и одного в chat_interval секунд в чат"""
+
+    def __init__(self, global_rate=NOTIFY_GLOBAL_RATE, chat_interval=NOTIFY_CHAT_INTERVAL,
+                 group_interval=NOTIFY_GROUP_INTERVAL):
+        self.interval = 1.0 / global_rate if global_rate > 0 else 0
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self._next_at = 0.0
+        self._chat_next_at = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        slot = max(now, self._next_at)
+        self._next_at = slot + self.interval
+        # Отрицательный chat_id - группа или канал
+        slot = max(slot, self._chat_next_at.get(chat_id, slot))
+        self._chat_next_at[chat_id] = slot + (self.group_interval if chat_id < 0 else self.chat_interval)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        """Ответ 429: никаких отправок ближайшие seconds секунд"""
+        self._next_at = max(self._next_at, time.monotonic() + seconds)
+
+
+def _seconds(retry_after):
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+async def fan_out(bot, messages, concurrency=NOTIFY_CONCURRENCY, limiter=None, retries=NOTIFY_RETRIES):
+    """Отправка (chat_id, текст) из итератора messages; возвращает счетчики.
+
+    Очередь ограничена, поэтому итератор читается по мере отправки и
+    рассылка любого размера держит в памяти не больше 4 * concurrency
+    сообщений. В stats['undelivered'] - чаты, отправка в которые не
+    удалась после всех повторов (ее стоит повторить позже).
+    """
+    limiter = limiter or ChatRateLimiter()
+    queue = asyncio.Queue(maxsize=concurrency * 4)
+    stats = {'sent': 0, 'failed': 0, 'retried': 0, 'blocked': [], 'undelivered': set()}
+
+    async def send(chat_id, text):
+        for attempt in range(retries + 1):
+            if attempt:
+                stats['retried'] += 1
+            await limiter.wait(chat_id)
+            try:
+                await bot.send_message(chat_id, text)
+                stats['sent'] += 1
+                return
+            except RetryAfter as e:
+                limiter.pause(_seconds(e.retry_after))
+            except Forbidden as e:
+                # Бот заблокирован или удален из чата - чат отписывается
+                logger.info("Чат %s недоступен: %s", chat_id, e)
+                stats['blocked'].append(chat_id)
+                return
+            except BadRequest as e:
+                # Повтор не поможет; несуществующий чат тоже отписывается
+                logger.info("Сообщение в чат %s отклонено: %s", chat_id, e)
+                if 'chat not found' in str(e).lower():
+                    stats['blocked'].append(chat_id)
+                else:
+                    stats['failed'] += 1
+                return
+            except TelegramError as e:
+                logger.warning("Ошибка отправки в чат %s (попытка %d): %s", chat_id, attempt + 1, e)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        stats['failed'] += 1
+        stats['undelivered'].add(chat_id)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                await send(*item)
+            finally:
+                queue.task_done()
+
+    start = time.perf_counter()
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for message in messages:
+            await queue.put(message)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    stats['elapsed'] = time.perf_counter() - start
+    return stats
+
+
+def _next_batch(conn, after, size=NOTIFY_BATCH):
+    """Строки notify_queue после rowid after: size строк и остаток последнего чата (его события - одним сообщением)"""
+    rows = conn.execute('SELECT rowid, * FROM temp.notify_queue WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                        (after, size)).fetchall()
+    if len(rows) == size:
+        rows += conn.execute('SELECT rowid, * FROM temp.notify_queue WHERE chat_id = ? AND rowid > ? ORDER BY rowid',
+                             (rows[-1][1], rows[-1][0])).fetchall()
+    return rows
+
+
+def _record_batch(conn, rows, undelivered):
+    """Недоставленные сообщения пачки - в notification_retries, доставленные - из нее"""
+    with conn:
+        conn.executemany('''
+            INSERT INTO notification_retries (chat_id, event_id, attempts) VALUES (?, ?, 1)
+            ON CONFLICT (chat_id, event_id) DO UPDATE SET attempts = attempts + 1
+        ''', [(row[1], row[2]) for row in rows if row[1] in undelivered])
+        conn.executemany('DELETE FROM notification_retries WHERE chat_id = ? AND event_id = ?',
+                         [(row[1], row[2]) for row in rows if row[1] not in undelivered])
+
+
+def _finish(conn, last_event_id, blocked, max_attempts=NOTIFY_MAX_ATTEMPTS):
+    """События до last_event_id разосланы: отписка blocked и удаление событий, о которых некому сообщать"""
+    with conn:
+        conn.execute('UPDATE catalog_events SET notified_at = ? WHERE id <= ? AND notified_at IS NULL',
+                     (int(time.time()), last_event_id))
+        conn.executemany('DELETE FROM subscriptions WHERE chat_id = ?', [(chat_id,) for chat_id in blocked])
+        conn.executemany('DELETE FROM notification_retries WHERE chat_id = ?', [(chat_id,) for chat_id in blocked])
+        dropped = conn.execute('DELETE FROM notification_retries WHERE attempts >= ?', (max_attempts,)).rowcount
+        if dropped:
+            logger.warning("Отказ от %d сообщений после %d попыток доставки", dropped, max_attempts)
+        conn.execute('''
+            DELETE FROM catalog_events WHERE notified_at IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM notification_retries r WHERE r.event_id = catalog_events.id)
+        ''')
+
+
+async def notify_pending(bot, db_path=DB_PATH, concurrency=NOTIFY_CONCURRENCY, limiter=None, batch=NOTIFY_BATCH):
+    """Рассылка накопленных событий каталога и недоставленных сообщений; None, если событий нет.
+
+    Пачка за пачкой: доставленные сообщения забываются, недоставленные
+    остаются в notification_retries, заблокировавшие бота чаты
+    отписываются. Сбой посреди рассылки повторит ее целиком (лучше
+    дважды, чем ни разу).
+    """
+    limiter = limiter or ChatRateLimiter()
+    # Соединением по очереди пользуются потоки asyncio.to_thread
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    try:
+        last_event_id = (await asyncio.to_thread(
+            lambda: conn.execute('SELECT MAX(id) FROM catalog_events').fetchone()
+        ))[0]
+        if last_event_id is None:
+            return None
+        await asyncio.to_thread(queue_notifications, conn, last_event_id)
+
+        stats = {'sent': 0, 'failed': 0, 'retried': 0, 'blocked': [], 'elapsed': 0.0}
+        after = 0
+        while True:
+            rows = await asyncio.to_thread(_next_batch, conn, after, batch)
+            if not rows:
+                break
+            after = rows[-1][0]
+            batch_stats = await fan_out(bot, chat_messages(row[1:] for row in rows), concurrency, limiter)
+            await asyncio.to_thread(_record_batch, conn, rows, batch_stats['undelivered'])
+            for key in ('sent', 'failed', 'retried', 'blocked', 'elapsed'):
+                stats[key] += batch_stats[key]
+        await asyncio.to_thread(_finish, conn, last_event_id, stats['blocked'])
+    finally:
+        conn.close()
+    logger.info("Рассылка: отправлено %d, ошибок %d, повторов %d, отписано чатов %d за %.1f с",
+                stats['sent'], stats['failed'], stats['retried'], len(stats['blocked']), stats['elapsed'])
+    return stats
+
+
+async def notify_loop(bot, db_path=DB_PATH, interval=NOTIFY_INTERVAL):
+    """Проверка новых событий раз в interval секунд (запускается ботом)"""
+    while True:
+        try:
+            await notify_pending(bot, db_path)
+        except Exception:
+            logger.exception("Ошибка рассылки событий каталога")
+        await asyncio.sleep(interval)
+
+
+def make_bot(token, base_url=None, concurrency=NOTIFY_CONCURRENCY):
+    """Bot с пулом соединений на concurrency запросов (по умолчанию у Bot одно соединение)"""
+    kwargs = {'base_url': base_url} if base_url else {}
+    return Bot(token, request=HTTPXRequest(connection_pool_size=concurrency), **kwargs)
+
+
+async def _main(args):
+    async with make_bot(args.token, args.base_url, args.concurrency) as bot:
+        limiter = ChatRateLimiter(args.rate)
+        stats = await notify_pending(bot, args.db, args.concurrency, limiter)
+    if stats is None:
+        print("Новых событий нет")
+    else:
+        print(f"📨 Отправлено: {stats['sent']}, ошибок: {stats['failed']}, "
+              f"отписано чатов: {len(stats['blocked'])}, {stats['elapsed']:.1f} с")
+
+
+if __name__ == '__main__':
+    from bot import TOKEN
+
+    arg_parser = argparse.ArgumentParser(description='Рассылка событий каталога подписчикам бота')
+    arg_parser.add_argument('--db', default=DB_PATH)
+    arg_parser.add_argument('--token', default=TOKEN)
+    arg_parser.add_argument('--base-url', help='адрес Bot API, например fake_bot_api.py')
+    arg_parser.add_argument('--concurrency', type=int, default=NOTIFY_CONCURRENCY)
+    arg_parser.add_argument('--rate', type=float, default=NOTIFY_GLOBAL_RATE, help='сообщений в секунду')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    asyncio.run(_main(args))
@@ -0,0 +1,95 @@
+# page_cache.py
+"""Кэш отрендеренных страниц каталога.
+
+Ключ - (шаблон, нормализованные параметры запроса, версия каталога),
+поэтому после сохранения выгрузки старые страницы больше не находятся
+и вытесняются. Части страницы, зависящие от сессии (счетчик корзины,
+flash-сообщения), в кэш не попадают: при рендере для кэша на их месте
+остается метка SLOT_MARKER, которую fill_slots заменяет при каждом
+запросе.
+"""
+import threading
+from collections import OrderedDict
+
+SLOT_MARKER = '<!--session-slot:{}-->'
+
+
+def fill_slots(html, slots):
+    """Подстановка {имя: HTML} на место меток SLOT_MARKER"""
+    for name, value in slots.items():
+        html = html.replace(SLOT_MARKER.format(name), value)
+    return html
+
+
+class PageCache:
+    """LRU-кэш HTML с ограничением по числу страниц и по суммарному размеру (в символах).
+
+    Хранит страницы одной версии каталога: с первым обращением с другой
+    версией кэш очищается.
+    """
+
+    def __init__(self, max_entries=512, max_size=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        # ключ -> (HTML, время рендера в мс)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_ms = 0.0
+
+    def get(self, key, version):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += entry[1]
+            return entry[0]
+
+    def put(self, key, version, html, render_ms):
+        if len(html) > self.max_size:
+            return
+        with self._lock:
+            self._check_version(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._entries[key] = (html, render_ms)
+            self._size += len(html)
+            while len(self._entries) > self.max_entries or self._size > self.max_size:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def _check_version(self, version):
+        """Сменилась версия каталога: страницы прежней версии уже не понадобятся"""
+        if version != self._version:
+            self._entries.clear()
+            self._size = 0
+            self._version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size': self._size,
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 3) if requests else 0.0,
+                'evictions': self.evictions,
+                'render_ms_saved': round(self.saved_ms, 1),
+            }
@@ -1,61 +1,410 @@
 import requests
 from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
+import argparse
+import hashlib
+import io
+import logging
+import os
 import sqlite3
 import json
 import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from crawler import CatalogCrawler, SITE_URL
+from db import DB_BUSY_TIMEOUT, PRAGMAS, bump_catalog_version
+from price_history import parse_price, record_price_changes, timestamp
+from subscriptions import record_catalog_events
+from migrations import migrate
+from search import update_search_index
 
-class IPhoneCatalogParser:
+# Разбор карточек: 'lxml' (быстрый) или 'bs4' (BeautifulSoup + html.parser), результат одинаковый
+PARSER_BACKENDS = ('lxml', 'bs4')
+PARSER_BACKEND = os.environ.get('PARSER_BACKEND', 'lxml')
+# Отладка: PARSER_DEBUG_DIR - куда сохранять HTML страницы, PARSER_LOG_LEVEL=DEBUG - лог по карточкам
+PARSER_DEBUG_DIR = os.environ.get('PARSER_DEBUG_DIR') or None
+PARSER_LOG_LEVEL = os.environ.get('PARSER_LOG_LEVEL', 'INFO')
+
+logger = logging.getLogger('parsing')
+
+# Размер куска файла для потокового разбора и пачки записи в базу
+STREAM_CHUNK_SIZE = 64 * 1024
+SAVE_BATCH_SIZE = 500
+
+# Параллельный разбор: число процессов и карточек в одной задаче для процесса
+PARSER_WORKERS = int(os.environ.get('PARSER_WORKERS', 1))
+PARALLEL_CHUNK_CARDS = 200
+
+# То же, что soup.find_all('div', class_='card')
+_LXML_CARDS = etree.XPath("//div[contains(concat(' ', normalize-space(@class), ' '), ' card ')]")
+# Текст элемента без комментариев, как Tag.get_text()
+_LXML_TEXT = etree.XPath('string()')
+
+# Открывающий или закрывающий тег div и атрибут class в нем
+_DIV_TAG = re.compile(rb'<(/?)div\b[^>]*>', re.IGNORECASE)
+_CLASS_ATTR = re.compile(rb'''\sclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+
+def _is_card_tag(tag):
+    match = _CLASS_ATTR.search(tag)
+    if not match:
+        return False
+    value = next(group for group in match.groups() if group is not None)
+    return b'card' in value.split()
+
+def _iter_card_fragments(source, chunk_size):
+    """HTML карточек товаров (div с классом card) из бинарного потока, по одной.
+    
+    libxml2 при инкрементальном разборе HTML держит весь прочитанный
+    ввод, поэтому поток режется на карточки по тегам div, а в буфере
+    остается только незаконченная карточка или незакрытый тег.
+    """
+    buffer = b''
+    pos = 0
+    card_start = None
+    depth = 0
+    while True:
+        chunk = source.read(chunk_size)
+        buffer += chunk
+        
+        for match in _DIV_TAG.finditer(buffer, pos):
+            pos = match.end()
+            if card_start is None:
+                if not match.group(1) and _is_card_tag(match.group()):
+                    card_start, depth = match.start(), 1
+            elif match.group(1):
+                depth -= 1
+                if depth == 0:
+                    yield buffer[card_start:pos]
+                    card_start = None
+            else:
+                depth += 1
+        
+        if not chunk:
+            return
+        
+        # Отбрасываем разобранное: оставляем начатую карточку или незакрытый тег в конце
+        if card_start is not None:
+            keep = card_start
+            card_start = 0
+        else:
+            keep = buffer.find(b'<', max(pos, buffer.rfind(b'>') + 1))
+            if keep == -1:
+                keep = len(buffer)
+        buffer = buffer[keep:]
+        pos = max(pos - keep, 0)
+
+def _content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+class ScrapeHashes:
+    """Хэши HTML карточек и страниц прошлого запуска (iPhoneDatabase.load_scrape_hashes)"""
+    
+    def __init__(self, cards=None, pages=None):
+        # хэш карточки -> (product_id, страница)
+        self.cards = {content_hash: product_id for content_hash, (product_id, _) in (cards or {}).items()}
+        self.page_cards = {}
+        for product_id, page in (cards or {}).values():
+            if page is not None:
+                self.page_cards.setdefault(page, []).append(product_id)
+        # страница -> хэш
+        self.pages = dict(pages or {})
+        # Заполняются при разборе: (product_id, страница) пропущенных карточек и новые хэши страниц
+        self.unchanged = []
+        self.new_pages = {}
+
+class ParseStats:
+    """Счетчики карточек и время этапов одного разбора"""
+    
     def __init__(self):
+        self.cards_found = 0
+        self.cards_parsed = 0
+        self.cards_failed = 0
+        # Не разобраны, потому что HTML не изменился с прошлого запуска
+        self.cards_skipped = 0
+        self.pages_skipped = 0
+        # Страницы или пачки карточек, на которых упал процесс пула
+        self.chunks_failed = 0
+        self.timings = {}
+    
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+    
+    def count_card(self, product_data):
+        """Учет результата разбора карточки; возвращает, удалась ли она"""
+        self.cards_found += 1
+        if product_data:
+            self.cards_parsed += 1
+            return True
+        self.cards_failed += 1
+        return False
+    
+    def merge(self, other):
+        self.cards_found += other.cards_found
+        self.cards_parsed += other.cards_parsed
+        self.cards_failed += other.cards_failed
+        self.chunks_failed += other.chunks_failed
+        self.cards_skipped += other.cards_skipped
+        self.pages_skipped += other.pages_skipped
+        for name, seconds in other.timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+    
+    def as_dict(self):
+        return {
+            'cards_found': self.cards_found,
+            'cards_parsed': self.cards_parsed,
+            'cards_failed': self.cards_failed,
+            'chunks_failed': self.chunks_failed,
+            'cards_skipped': self.cards_skipped,
+            'pages_skipped': self.pages_skipped,
+            'timings_ms': {name: round(seconds * 1000, 3) for name, seconds in self.timings.items()},
+        }
+
+class IPhoneCatalogParser:
+    def __init__(self, backend=PARSER_BACKEND, debug_dir=PARSER_DEBUG_DIR, workers=PARSER_WORKERS):
+        if backend not in PARSER_BACKENDS:
+            raise ValueError(f"Unknown parser backend: {backend}")
+        self.backend = backend
+        # Каталог для отформатированного HTML страницы; None - не сохранять
+        self.debug_dir = debug_dir
+        # Процессов для разбора; 1 - в текущем процессе
+        self.workers = max(1, workers)
+        self.last_stats = ParseStats()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         }
     
     def parse_catalog_html(self, html_content):
         """Парсинг HTML страницы каталога iPhone"""
-        print("🔍 Анализируем каталог HTML...")
+        stats = self.last_stats = ParseStats()
         
         if not html_content or len(html_content.strip()) < 100:
-            print("❌ HTML слишком короткий или пустой")
-            return {'success': False, 'error': 'Empty HTML'}
+            logger.warning("HTML слишком короткий или пустой")
+            return {'success': False, 'error': 'Empty HTML', 'stats': stats.as_dict()}
         
-        soup = BeautifulSoup(html_content, 'html.parser')
+        with stats.stage('dom'):
+            if self.backend == 'lxml':
+                document = lxml_html.fromstring(html_content)
+            else:
+                document = BeautifulSoup(html_content, 'html.parser')
         
-        # Сохраним HTML для отладки
-        with open('debug_catalog.html', 'w', encoding='utf-8') as f:
-            f.write(soup.prettify())
-        print("💾 Каталог HTML сохранен в debug_catalog.html")
+        if self.debug_dir:
+            with stats.stage('debug_dump'):
+                self._dump_debug_html(document)
         
         # Ищем все карточки товаров
-        products = self._extract_products(soup)
+        with stats.stage('extract'):
+            if self.backend == 'lxml':
+                products = self._extract_products_lxml(document, stats)
+            else:
+                products = self._extract_products(document, stats)
         
         result = {
             'products': products,
             'total_products': len(products),
             'parsed_at': datetime.now().isoformat(),
-            'success': True
+            'success': True,
+            'stats': stats.as_dict()
         }
         
-        print(f"📊 Найдено товаров: {len(products)}")
+        logger.info("Найдено товаров: %d (ошибок разбора карточек: %d)", len(products), stats.cards_failed)
         return result
     
-    def _extract_products(self, soup):
-        """Извлечение всех товаров из каталога"""
-        print("🔍 Ищем карточки товаров...")
+    def _dump_debug_html(self, document):
+        """Отформатированный HTML страницы в debug_dir (только при включенной отладке)"""
+        os.makedirs(self.debug_dir, exist_ok=True)
+        path = os.path.join(self.debug_dir, 'debug_catalog.html')
+        if self.backend == 'lxml':
+            debug_html = lxml_html.tostring(document, pretty_print=True, encoding='unicode')
+        else:
+            debug_html = document.prettify()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(debug_html)
+        logger.debug("Каталог HTML сохранен в %s", path)
+    
+    def iter_catalog_cards(self, source, chunk_size=STREAM_CHUNK_SIZE, known=None):
+        """Товары из HTML каталога по одному, по мере чтения файла.
         
-        products = []
+        source - путь или открытый бинарный файл, в том числе с несколькими
+        склеенными страницами. Файл читается кусками по chunk_size, в памяти
+        держится только текущая карточка, она разбирается lxml отдельно.
+        Товары совпадают с parse_catalog_html, счетчики и время разбора -
+        в self.last_stats; при debug_dir HTML карточек пишется в debug_cards.html.
+        
+        С known (ScrapeHashes прошлого запуска) карточки с тем же HTML не
+        разбираются и не возвращаются, их product_id попадают в
+        known.unchanged, а у новых товаров заполняется content_hash.
+        """
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as f:
+                yield from self.iter_catalog_cards(f, chunk_size, known)
+            return
+        
+        stats = self.last_stats = ParseStats()
+        items = self._card_items(_iter_card_fragments(source, chunk_size), known, stats)
+        yield from self._iter_products(items, stats)
+    
+    def _card_items(self, fragments, known, stats, page=None):
+        """(HTML карточки, хэш, страница) для карточек, которые нужно разобрать"""
+        for fragment in fragments:
+            content_hash = None
+            if known is not None:
+                content_hash = _content_hash(fragment)
+                product_id = known.cards.get(content_hash)
+                if product_id is not None:
+                    stats.cards_found += 1
+                    stats.cards_skipped += 1
+                    known.unchanged.append((product_id, page))
+                    continue
+            yield fragment, content_hash, page
+    
+    def _iter_products(self, items, stats):
+        """Разбор карточек из _card_items в этом процессе или в пуле"""
+        debug_file = None
+        if self.debug_dir:
+            os.makedirs(self.debug_dir, exist_ok=True)
+            debug_file = open(os.path.join(self.debug_dir, 'debug_cards.html'), 'wb')
+        
+        def logged(items):
+            for item in items:
+                if debug_file:
+                    with stats.stage('debug_dump'):
+                        debug_file.write(item[0] + b'\n')
+                yield item
+        
+        try:
+            if self.workers > 1:
+                yield from self._parse_fragments_parallel(logged(items), stats)
+                return
+            for item in logged(items):
+                with stats.stage('extract'):
+                    product_data = self._parse_card_item(item)
+                if stats.count_card(product_data):
+                    yield product_data
+        finally:
+            if debug_file:
+                debug_file.close()
+    
+    def _parse_card_item(self, item):
+        fragment, content_hash, page = item
+        card = lxml_html.fragment_fromstring(fragment.decode('utf-8'))
+        product_data = self._parse_single_card_lxml(card)
+        if product_data and content_hash is not None:
+            product_data['content_hash'] = content_hash
+            product_data['scrape_page'] = page
+        return product_data
+    
+    def _parse_fragments_parallel(self, items, stats):
+        """Разбор карточек пачками в пуле процессов; товары выходят в исходном порядке.
+        
+        В работе держится не больше 2 * workers пачек, поэтому поток
+        по-прежнему не накапливается в памяти.
+        """
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for chunk in _chunked(items, PARALLEL_CHUNK_CARDS):
+                pending.append(executor.submit(_parse_fragments_in_worker, chunk))
+                if len(pending) >= 2 * self.workers:
+                    yield from self._collect(pending.popleft(), stats)
+            while pending:
+                yield from self._collect(pending.popleft(), stats)
+    
+    @staticmethod
+    def _collect(future, stats):
+        try:
+            products, worker_stats = future.result()
+        except Exception as e:
+            stats.chunks_failed += 1
+            logger.error("Ошибка разбора пачки карточек в процессе: %s", e)
+            return []
+        stats.merge(worker_stats)
+        return products
+    
+    def parse_catalog_pages(self, pages, known=None):
+        """Парсинг нескольких страниц каталога в один результат (повторы товаров отбрасываются).
+        
+        При workers > 1 страницы разбираются в пуле процессов, порядок товаров
+        тот же, счетчики процессов суммируются. С known страницы, HTML
+        которых не изменился с прошлого запуска, пропускаются целиком, а
+        в остальных разбираются только изменившиеся карточки.
+        """
+        products = {}
+        stats = ParseStats()
+        if known is None:
+            for result, page_stats in self._parse_pages(pages, stats):
+                stats.merge(page_stats)
+                if result.get('success'):
+                    for product in result['products']:
+                        products.setdefault(product['product_id'], product)
+        else:
+            for product in self._iter_products(self._changed_page_cards(pages, known, stats), stats):
+                products.setdefault(product['product_id'], product)
+        self.last_stats = stats
+        
+        return {
+            'products': list(products.values()),
+            'total_products': len(products),
+            'parsed_at': datetime.now().isoformat(),
+            'success': bool(products) or stats.cards_skipped > 0,
+            'stats': stats.as_dict()
+        }
+    
+    def _changed_page_cards(self, pages, known, stats):
+        for index, html in enumerate(pages):
+            page = str(index)
+            data = html.encode('utf-8')
+            page_hash = _content_hash(data)
+            known.new_pages[page] = page_hash
+            if known.pages.get(page) == page_hash:
+                stats.pages_skipped += 1
+                skipped = known.page_cards.get(page, [])
+                stats.cards_found += len(skipped)
+                stats.cards_skipped += len(skipped)
+                known.unchanged.extend((product_id, page) for product_id in skipped)
+                continue
+            yield from self._card_items(_iter_card_fragments(io.BytesIO(data), len(data) + 1), known, stats, page)
+    
+    def _parse_pages(self, pages, stats):
+        """(результат, счетчики) каждой страницы по порядку"""
+        if self.workers <= 1:
+            for html in pages:
+                result = self.parse_catalog_html(html)
+                yield result, self.last_stats
+            return
         
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(_parse_page_in_worker, self.backend, html) for html in pages]
+            for future in futures:
+                try:
+                    yield future.result()
+                except Exception as e:
+                    stats.chunks_failed += 1
+                    logger.error("Ошибка разбора страницы в процессе: %s", e)
+    
+    def _extract_products(self, soup, stats):
+        """Извлечение всех товаров из каталога"""
         # Ищем все div с классом card (карточки товаров)
         card_elements = soup.find_all('div', class_='card')
-        print(f"🔍 Найдено карточек товаров: {len(card_elements)}")
-        
-        for i, card in enumerate(card_elements):
-            print(f"\n📦 Обрабатываем товар {i+1}/{len(card_elements)}...")
-            
-            product_data = self._parse_single_card(card)
-            if product_data:
+        return self._parse_cards(card_elements, self._parse_single_card, stats)
+    
+    def _extract_products_lxml(self, document, stats):
+        """Извлечение всех товаров из каталога (lxml)"""
+        return self._parse_cards(_LXML_CARDS(document), self._parse_single_card_lxml, stats)
+    
+    def _parse_cards(self, card_elements, parse_card, stats):
+        logger.debug("Найдено карточек товаров: %d", len(card_elements))
+        products = []
+        for card in card_elements:
+            product_data = parse_card(card)
+            if stats.count_card(product_data):
                 products.append(product_data)
-        
         return products
     
     def _parse_single_card(self, card):
@@ -63,7 +412,6 @@ class IPhoneCatalogParser:
         try:
             # ID товара
             card_id = card.get('id', '')
-            product_id = card_id.replace('card_c_', '') if 'card_c_' in card_id else 'unknown'
             
             # Название модели
             name_elem = card.find('a', class_='card_name')
@@ -72,14 +420,6 @@ class IPhoneCatalogParser:
             # Цена
             price_elem = card.find('span', class_='card_price')
             price_text = price_elem.get_text().strip() if price_elem else ''
-            numeric_price = 0
-            
-            if price_text:
-                clean_price = price_text.replace(' ', '').replace('руб.', '')
-                try:
-                    numeric_price = int(clean_price)
-                except ValueError:
-                    numeric_price = 0
             
             # Старая цена (если есть)
             old_price_elem = card.find('strike')
@@ -129,108 +469,331 @@ class IPhoneCatalogParser:
             image_url = img_elem.get('src', '') if img_elem else ''
             image_alt = img_elem.get('alt', '') if img_elem else ''
             
-            if image_url and not image_url.startswith('http'):
-                image_url = 'https://edwardpnz.ru' + image_url
-            
             # Ссылка на товар
             link_elem = card.find('a', class_='card_btn')
             product_url = link_elem.get('href', '') if link_elem else ''
-            if product_url and not product_url.startswith('http'):
-                product_url = 'https://edwardpnz.ru' + product_url
             
-            product_data = {
-                'product_id': product_id,
-                'model': model_name,
-                'price': f"{numeric_price:,} руб.".replace(',', ' ') if numeric_price > 0 else 'Не указана',
-                'numeric_price': numeric_price,
-                'old_price': old_price,
-                'current_color': current_color,
-                'available_colors': colors,
-                'current_memory': current_memory,
-                'memory_options': memory_options,
-                'current_sim': current_sim,
-                'sim_options': sim_options,
-                'image_url': image_url,
-                'image_alt': image_alt,
-                'product_url': product_url,
-                'colors_count': len(colors),
-                'memory_count': len(memory_options)
-            }
+            return self._make_product(card_id, model_name, price_text, old_price, current_color, colors,
+                                      current_memory, memory_options, current_sim, sim_options,
+                                      image_url, image_alt, product_url)
             
-            print(f"✅ Товар {product_id}: {model_name} - {numeric_price} руб.")
-            return product_data
+        except Exception as e:
+            logger.warning("Ошибка парсинга карточки %s: %s", card.get('id', ''), e)
+            return None
+    
+    def _parse_single_card_lxml(self, card):
+        """Парсинг одной карточки товара за один проход по ее элементам (lxml)"""
+        try:
+            card_id = card.get('id', '')
+            model_name = price_text = old_price = current_color = None
+            colors, memory_options, sim_options = [], [], []
+            current_memory, current_sim = 'Не указана', 'Не указано'
+            img_elem = link_elem = None
+            
+            for element in card.iterdescendants():
+                tag = element.tag
+                if tag == 'strike':
+                    if old_price is None:
+                        old_price = _LXML_TEXT(element).strip()
+                    continue
+                if tag not in ('a', 'span', 'small', 'button', 'div', 'img'):
+                    continue
+                classes = element.get('class', '').split()
+                if not classes:
+                    continue
+                
+                if tag == 'div' and 'multi_txt' in classes:
+                    # Память и SIM в одном списке вариантов, различаются по id
+                    elem_id = element.get('id', '')
+                    text = None
+                    if 'two_' in elem_id:
+                        text = _LXML_TEXT(element).strip()
+                        if text:
+                            memory_options.append(text)
+                            if 'multi_txt_act' in classes:
+                                current_memory = text
+                    if 'three_' in elem_id:
+                        text = text if text is not None else _LXML_TEXT(element).strip()
+                        if text:
+                            sim_options.append(text)
+                            if 'multi_txt_act' in classes:
+                                current_sim = text
+                elif tag == 'button' and 'multi_color' in classes:
+                    color_name = element.get('data-name-color') or element.get('title', '')
+                    if color_name and color_name not in colors:
+                        colors.append(color_name)
+                elif tag == 'a':
+                    if model_name is None and 'card_name' in classes:
+                        model_name = _LXML_TEXT(element).strip()
+                    if link_elem is None and 'card_btn' in classes:
+                        link_elem = element
+                elif tag == 'span' and price_text is None and 'card_price' in classes:
+                    price_text = _LXML_TEXT(element).strip()
+                elif tag == 'small' and current_color is None and 'act_color_name' in classes:
+                    current_color = _LXML_TEXT(element).strip()
+                elif tag == 'img' and img_elem is None and 'card_photo_img' in classes:
+                    img_elem = element
+            
+            return self._make_product(
+                card_id,
+                model_name if model_name is not None else 'Неизвестно',
+                price_text or '',
+                old_price or '',
+                current_color if current_color is not None else 'Не указан',
+                colors, current_memory, memory_options, current_sim, sim_options,
+                img_elem.get('src', '') if img_elem is not None else '',
+                img_elem.get('alt', '') if img_elem is not None else '',
+                link_elem.get('href', '') if link_elem is not None else '',
+            )
             
         except Exception as e:
-            print(f"❌ Ошибка парсинга карточки: {e}")
+            logger.warning("Ошибка парсинга карточки %s: %s", card.get('id', ''), e)
             return None
+    
+    def _make_product(self, card_id, model_name, price_text, old_price, current_color, colors,
+                      current_memory, memory_options, current_sim, sim_options,
+                      image_url, image_alt, product_url):
+        """Словарь товара из извлеченных полей карточки (общий для обоих парсеров)"""
+        product_id = card_id.replace('card_c_', '') if 'card_c_' in card_id else 'unknown'
+        
+        numeric_price = 0
+        if price_text:
+            clean_price = price_text.replace(' ', '').replace('руб.', '')
+            try:
+                numeric_price = int(clean_price)
+            except ValueError:
+                numeric_price = 0
+        
+        if image_url and not image_url.startswith('http'):
+            image_url = 'https://edwardpnz.ru' + image_url
+        
+        if product_url and not product_url.startswith('http'):
+            product_url = 'https://edwardpnz.ru' + product_url
+        
+        product_data = {
+            'product_id': product_id,
+            'model': model_name,
+            'price': f"{numeric_price:,} руб.".replace(',', ' ') if numeric_price > 0 else 'Не указана',
+            'numeric_price': numeric_price,
+            'old_price': old_price,
+            'current_color': current_color,
+            'available_colors': colors,
+            'current_memory': current_memory,
+            'memory_options': memory_options,
+            'current_sim': current_sim,
+            'sim_options': sim_options,
+            'image_url': image_url,
+            'image_alt': image_alt,
+            'product_url': product_url,
+            'colors_count': len(colors),
+            'memory_count': len(memory_options),
+        }
+        
+        logger.debug("Товар %s: %s - %s руб.", product_id, model_name, numeric_price)
+        return product_data
+
+def _chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _parse_page_in_worker(backend, html):
+    """Разбор одной страницы в процессе пула (функция модуля, чтобы ее можно было передать)"""
+    parser = IPhoneCatalogParser(backend, debug_dir=None, workers=1)
+    result = parser.parse_catalog_html(html)
+    return result, parser.last_stats
+
+def _parse_fragments_in_worker(items):
+    """Разбор пачки HTML карточек в процессе пула"""
+    parser = IPhoneCatalogParser('lxml', debug_dir=None, workers=1)
+    stats = ParseStats()
+    products = []
+    for item in items:
+        with stats.stage('extract'):
+            product_data = parser._parse_card_item(item)
+        if stats.count_card(product_data):
+            products.append(product_data)
+    return products, stats
 
 class iPhoneDatabase:
     def __init__(self, db_name='iphones_catalog.db'):
         self.db_name = db_name
+        # Счетчики последнего save_products: inserted, updated, unchanged, removed, missing, write_ms
+        self.last_save = {}
         self._create_tables()
     
     def _create_tables(self):
-        """Создание таблиц базы данных для каталога"""
+        """Создание и обновление схемы базы данных каталога"""
         conn = sqlite3.connect(self.db_name)
+        migrate(conn)
+        conn.close()
+    
+    def save_catalog(self, catalog_data, known=None):
+        """Сохранение всего каталога в базу данных"""
+        if not catalog_data.get('success', False):
+            return False
+        return self.save_products(catalog_data.get('products', []), catalog_data.get('parsed_at'), known=known)
+    
+    def load_scrape_hashes(self):
+        """Хэши HTML карточек и страниц, сохраненные прошлым запуском, для пропуска неизменившихся"""
+        conn = sqlite3.connect(self.db_name, timeout=DB_BUSY_TIMEOUT)
+        try:
+            # Только для товаров, которые еще есть в каталоге
+            cards = {
+                content_hash: (product_id, page)
+                for content_hash, product_id, page in conn.execute('''
+                    SELECT h.hash, h.product_id, h.page FROM card_hashes h
+                    JOIN iphones_catalog c ON c.product_id = h.product_id
+                ''')
+            }
+            pages = dict(conn.execute('SELECT page, hash FROM page_hashes'))
+        finally:
+            conn.close()
+        return ScrapeHashes(cards, pages)
+    
+    def save_products(self, products, parsed_at=None, batch_size=SAVE_BATCH_SIZE, remove_missing=False,
+                      known=None):
+        """Сохранение товаров из любого итератора пачками по batch_size.
+        
+        Товары не собираются в список: пачки пишутся executemany во временные
+        таблицы, затем одним набором запросов сравниваются с каталогом, и
+        UPSERT применяет только новые и изменившиеся товары. id, category,
+        is_featured и display_order существующих товаров не трогаются.
+        remove_missing=True удаляет товары, которых нет в выгрузке.
+        known - ScrapeHashes инкрементального разбора: пропущенные парсером
+        карточки считаются неизменившимися, новые хэши сохраняются.
+        Счетчики и время записи - в self.last_save.
+        """
+        parsed_at = parsed_at or datetime.now().isoformat()
+        start = time.perf_counter()
+        conn = sqlite3.connect(self.db_name, timeout=DB_BUSY_TIMEOUT)
+        # Те же настройки, что у соединений веб-приложения (WAL: чтение не ждет записи)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
         cursor = conn.cursor()
         
+        try:
+            self._create_staging_tables(cursor)
+            
+            batch = {}
+            for product in products:
+                # Повтор товара заменяет предыдущий
+                batch[product.get('product_id')] = product
+                if len(batch) >= batch_size:
+                    self._stage_batch(cursor, batch)
+                    batch = {}
+            if batch:
+                self._stage_batch(cursor, batch)
+            unchanged = known.unchanged if known is not None else []
+            cursor.executemany('INSERT OR IGNORE INTO scrape_unchanged (product_id) VALUES (?)',
+                               [(product_id,) for product_id, _ in unchanged])
+            
+            staged = cursor.execute('SELECT COUNT(*) FROM scrape_catalog').fetchone()[0]
+            skipped = cursor.execute('SELECT COUNT(*) FROM scrape_unchanged').fetchone()[0]
+            if not staged and not skipped:
+                logger.warning("Нет товаров для сохранения")
+                conn.rollback()
+                return False
+            
+            counts = self._apply_changes(cursor, parsed_at, remove_missing)
+            if known is not None:
+                self._save_scrape_hashes(cursor, known)
+            
+            # Новая версия каталога только при изменениях: веб-приложение перестроит снимок
+            if counts['inserted'] or counts['updated'] or counts['removed']:
+                bump_catalog_version(cursor)
+            conn.commit()
+            
+            counts['write_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            self.last_save = counts
+            logger.info("Сохранено товаров: %d (новых %d, изменено %d, без изменений %d, удалено %d, "
+                        "нет в выгрузке %d, новых цен %d) за %.0f мс",
+                        counts['inserted'] + counts['updated'] + counts['unchanged'], counts['inserted'],
+                        counts['updated'], counts['unchanged'], counts['removed'], counts['missing'],
+                        counts['price_changes'], counts['write_ms'])
+            return True
+            
+        except Exception as e:
+            logger.error("Ошибка сохранения каталога: %s", e)
+            return False
+        finally:
+            conn.close()
+    
+    def _save_scrape_hashes(self, cursor, known):
+        """Хэши разобранных карточек и всех страниц этого запуска"""
+        cursor.execute('''
+            INSERT INTO card_hashes (product_id, hash, page)
+            SELECT product_id, content_hash, scrape_page FROM scrape_catalog
+            WHERE content_hash IS NOT NULL
+            ON CONFLICT (product_id) DO UPDATE SET hash = excluded.hash, page = excluded.page
+        ''')
+        # Неизменившаяся карточка могла переехать на другую страницу
+        cursor.executemany('UPDATE card_hashes SET page = ? WHERE product_id = ?',
+                           [(page, product_id) for product_id, page in known.unchanged if page is not None])
+        cursor.executemany('''
+            INSERT INTO page_hashes (page, hash) VALUES (?, ?)
+            ON CONFLICT (page) DO UPDATE SET hash = excluded.hash
+        ''', list(known.new_pages.items()))
+    
+    def _create_staging_tables(self, cursor):
+        """Временные таблицы для выгрузки (видны только этому соединению)"""
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS iphones_catalog (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id TEXT UNIQUE,
-                model TEXT NOT NULL,
-                price INTEGER DEFAULT 0,
-                currency TEXT DEFAULT 'RUB',
+            CREATE TEMP TABLE scrape_catalog (
+                product_id TEXT PRIMARY KEY,
+                model TEXT,
+                price INTEGER,
+                currency TEXT,
                 old_price TEXT,
                 current_color TEXT,
                 current_memory TEXT,
                 current_sim TEXT,
                 image_url TEXT,
                 product_url TEXT,
-                parsed_at DATETIME,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                content_hash TEXT,
+                scrape_page TEXT,
+                old_price_value INTEGER
             )
         ''')
-        
+        # Товары, карточки которых парсер пропустил как неизменившиеся
+        cursor.execute('CREATE TEMP TABLE scrape_unchanged (product_id TEXT PRIMARY KEY)')
+        # position сохраняет порядок вариантов на сайте
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS iphone_catalog_colors (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+            CREATE TEMP TABLE scrape_colors (
                 product_id TEXT,
+                position INTEGER,
                 color_name TEXT,
-                FOREIGN KEY (product_id) REFERENCES iphones_catalog (product_id)
+                PRIMARY KEY (product_id, color_name)
             )
         ''')
-        
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS iphone_catalog_memory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+            CREATE TEMP TABLE scrape_memory (
                 product_id TEXT,
+                position INTEGER,
                 memory_size TEXT,
-                FOREIGN KEY (product_id) REFERENCES iphones_catalog (product_id)
+                PRIMARY KEY (product_id, memory_size)
             )
         ''')
-        
-        conn.commit()
-        conn.close()
+        # Новые (is_new = 1) и изменившиеся товары выгрузки
+        cursor.execute('CREATE TEMP TABLE scrape_changes (product_id TEXT PRIMARY KEY, is_new INTEGER)')
     
-    def save_catalog(self, catalog_data):
-        """Сохранение всего каталога в базу данных"""
-        if not catalog_data.get('success', False):
-            return False
-            
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+    def _stage_batch(self, cursor, batch):
+        """Запись пачки {product_id: товар} во временные таблицы"""
+        # Товар мог встретиться в предыдущей пачке: его варианты заменяются целиком
+        placeholders = ','.join('?' * len(batch))
+        seen = cursor.execute(
+            f'SELECT product_id FROM scrape_catalog WHERE product_id IN ({placeholders})', list(batch)
+        ).fetchall()
         
-        saved_count = 0
-        try:
-            for product in catalog_data.get('products', []):
-                cursor.execute('''
-                    INSERT OR REPLACE INTO iphones_catalog 
-                    (product_id, model, price, currency, old_price, current_color, 
-                     current_memory, current_sim, image_url, product_url, parsed_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    product.get('product_id'),
+        cursor.executemany(
+            'INSERT OR REPLACE INTO scrape_catalog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (
+                    product_id,
                     product.get('model'),
                     product.get('numeric_price'),
                     'RUB',
@@ -240,71 +803,215 @@ class iPhoneDatabase:
                     product.get('current_sim'),
                     product.get('image_url'),
                     product.get('product_url'),
-                    catalog_data.get('parsed_at')
-                ))
-                
-                product_id = product.get('product_id')
-                
-                # Сохраняем цвета
-                cursor.execute('DELETE FROM iphone_catalog_colors WHERE product_id = ?', (product_id,))
-                for color in product.get('available_colors', []):
-                    cursor.execute('INSERT INTO iphone_catalog_colors (product_id, color_name) VALUES (?, ?)', (product_id, color))
-                
-                # Сохраняем память
-                cursor.execute('DELETE FROM iphone_catalog_memory WHERE product_id = ?', (product_id,))
-                for memory in product.get('memory_options', []):
-                    cursor.execute('INSERT INTO iphone_catalog_memory (product_id, memory_size) VALUES (?, ?)', (product_id, memory))
-                
-                saved_count += 1
-            
-            conn.commit()
-            print(f"💾 Сохранено товаров: {saved_count}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Ошибка сохранения каталога: {e}")
-            return False
-        finally:
-            conn.close()
-
-def main_catalog():
-    """Основная функция для парсинга каталога"""
-    parser = IPhoneCatalogParser()
-    db = iPhoneDatabase()
-    
-    # Читаем HTML из файла
-    try:
-        with open('site-html.txt', 'r', encoding='utf-8') as f:
-            catalog_html = f.read()
-        print(f"📁 HTML загружен из файла, размер: {len(catalog_html)} символов")
-    except FileNotFoundError:
-        print("❌ Файл site-html.txt не найден")
-        return
-    
-    print("=== ПАРСИНГ КАТАЛОГА IPHONE ===")
-    
-    result = parser.parse_catalog_html(catalog_html)
+                    product.get('content_hash'),
+                    product.get('scrape_page'),
+                    parse_price(product.get('old_price')),
+                )
+                for product_id, product in batch.items()
+            ]
+        )
+        
+        for table, column, key in (('scrape_colors', 'color_name', 'available_colors'),
+                                   ('scrape_memory', 'memory_size', 'memory_options')):
+            cursor.executemany(f'DELETE FROM {table} WHERE product_id = ?', seen)
+            cursor.executemany(
+                f'INSERT OR IGNORE INTO {table} (product_id, position, {column}) VALUES (?, ?, ?)',
+                [(product_id, position, value) for product_id, product in batch.items()
+                 for position, value in enumerate(product.get(key, []))]
+            )
     
-    if result.get('success'):
-        print(f"\n✅ УСПЕШНЫЙ РЕЗУЛЬТАТ ПАРСИНГА КАТАЛОГА:")
-        print(f"📊 Всего товаров: {result['total_products']}")
+    def _apply_changes(self, cursor, parsed_at, remove_missing):
+        """Сравнение выгрузки с каталогом и запись только отличий"""
+        cursor.execute('''
+            INSERT INTO scrape_changes (product_id, is_new)
+            SELECT s.product_id, c.product_id IS NULL
+            FROM scrape_catalog s
+            LEFT JOIN iphones_catalog c ON c.product_id = s.product_id
+            WHERE c.product_id IS NULL
+               OR c.model IS NOT s.model OR c.price IS NOT s.price OR c.currency IS NOT s.currency
+               OR c.old_price IS NOT s.old_price OR c.current_color IS NOT s.current_color
+               OR c.current_memory IS NOT s.current_memory OR c.current_sim IS NOT s.current_sim
+               OR c.image_url IS NOT s.image_url OR c.product_url IS NOT s.product_url
+        ''')
+        # Изменился набор цветов или памяти (в любую сторону)
+        for table, scrape_table, column in (('iphone_catalog_colors', 'scrape_colors', 'color_name'),
+                                            ('iphone_catalog_memory', 'scrape_memory', 'memory_size')):
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO scrape_changes (product_id, is_new)
+                SELECT v.product_id, 0 FROM {scrape_table} v
+                WHERE NOT EXISTS (SELECT 1 FROM {table} t
+                                  WHERE t.product_id = v.product_id AND t.{column} = v.{column})
+                UNION
+                SELECT t.product_id, 0 FROM scrape_catalog s
+                JOIN {table} t ON t.product_id = s.product_id
+                WHERE NOT EXISTS (SELECT 1 FROM {scrape_table} v
+                                  WHERE v.product_id = t.product_id AND v.{column} = t.{column})
+            ''')
+        
+        counts = dict(zip(('inserted', 'updated'), cursor.execute(
+            'SELECT COALESCE(SUM(is_new), 0), COALESCE(SUM(1 - is_new), 0) FROM scrape_changes'
+        ).fetchone()))
+        # Без изменений: выгруженные товары вне scrape_changes и пропущенные парсером карточки,
+        # которых нет в выгрузке (товар может попасть в обе таблицы и считается один раз)
+        counts['unchanged'] = cursor.execute('''
+            SELECT (SELECT COUNT(*) FROM scrape_catalog s
+                    WHERE NOT EXISTS (SELECT 1 FROM scrape_changes ch WHERE ch.product_id = s.product_id))
+                 + (SELECT COUNT(*) FROM scrape_unchanged u
+                    WHERE NOT EXISTS (SELECT 1 FROM scrape_catalog s WHERE s.product_id = u.product_id))
+        ''').fetchone()[0]
+        missing = '''
+            SELECT product_id FROM iphones_catalog c
+            WHERE NOT EXISTS (SELECT 1 FROM scrape_catalog s WHERE s.product_id = c.product_id)
+              AND NOT EXISTS (SELECT 1 FROM scrape_unchanged u WHERE u.product_id = c.product_id)
+        '''
+        counts['missing'] = cursor.execute(f'SELECT COUNT(*) FROM ({missing})').fetchone()[0]
+        # Подешевевшие и появившиеся товары для рассылки подписчикам бота (до обновления цен)
+        counts['events'] = record_catalog_events(cursor, '''
+            SELECT s.product_id, s.model, c.price AS was_price, s.price, ch.is_new FROM scrape_catalog s
+            JOIN scrape_changes ch ON ch.product_id = s.product_id
+            LEFT JOIN iphones_catalog c ON c.product_id = s.product_id
+        ''', timestamp(parsed_at))
+        
+        # WHERE обязателен: без него SQLite принимает ON CONFLICT за часть JOIN
+        cursor.execute('''
+            INSERT INTO iphones_catalog
+            (product_id, model, price, currency, old_price, current_color,
+             current_memory, current_sim, image_url, product_url, parsed_at)
+            SELECT s.product_id, s.model, s.price, s.currency, s.old_price, s.current_color,
+                   s.current_memory, s.current_sim, s.image_url, s.product_url, ?
+            FROM scrape_catalog s
+            JOIN scrape_changes ch ON ch.product_id = s.product_id
+            WHERE true
+            ON CONFLICT (product_id) DO UPDATE SET
+                model = excluded.model,
+                price = excluded.price,
+                currency = excluded.currency,
+                old_price = excluded.old_price,
+                current_color = excluded.current_color,
+                current_memory = excluded.current_memory,
+                current_sim = excluded.current_sim,
+                image_url = excluded.image_url,
+                product_url = excluded.product_url,
+                parsed_at = excluded.parsed_at
+        ''', (parsed_at,))
+        
+        for table, scrape_table, column in (('iphone_catalog_colors', 'scrape_colors', 'color_name'),
+                                            ('iphone_catalog_memory', 'scrape_memory', 'memory_size')):
+            cursor.execute(f'DELETE FROM {table} WHERE product_id IN (SELECT product_id FROM scrape_changes)')
+            cursor.execute(f'''
+                INSERT INTO {table} (product_id, {column})
+                SELECT v.product_id, v.{column} FROM {scrape_table} v
+                JOIN scrape_changes ch ON ch.product_id = v.product_id
+                ORDER BY v.product_id, v.position
+            ''')
         
-        # Покажем первые 5 товаров для проверки
-        for i, product in enumerate(result['products'][:5]):
+        counts['removed'] = 0
+        if remove_missing and counts['missing']:
+            cursor.execute(f'DELETE FROM card_hashes WHERE product_id IN ({missing})')
+            cursor.execute(f'DELETE FROM catalog_search WHERE rowid IN '
+                           f'(SELECT id FROM iphones_catalog WHERE product_id IN ({missing}))')
+            cursor.execute(f'DELETE FROM iphone_catalog_colors WHERE product_id IN ({missing})')
+            cursor.execute(f'DELETE FROM iphone_catalog_memory WHERE product_id IN ({missing})')
+            counts['removed'] = cursor.execute(f'DELETE FROM iphones_catalog WHERE product_id IN ({missing})').rowcount
+        
+        # Поисковый индекс - только для изменившихся товаров
+        update_search_index(cursor, 'SELECT product_id FROM scrape_changes')
+        # История - только если изменилась цена или старая цена
+        counts['price_changes'] = record_price_changes(cursor, '''
+            SELECT s.product_id, COALESCE(s.price, 0) AS price, s.old_price_value AS old_price FROM scrape_catalog s
+            JOIN scrape_changes ch ON ch.product_id = s.product_id
+        ''', timestamp(parsed_at))
+        return counts
+
+def _preview_products(products, count=5):
+    """Пропускает товары дальше, показывая первые count для проверки"""
+    for i, product in enumerate(products):
+        if i < count:
             print(f"\n--- Товар {i+1} ---")
             print(f"📱 Модель: {product['model']}")
             print(f"💰 Цена: {product['price']}")
             print(f"🎨 Цвет: {product['current_color']}")
             print(f"💾 Память: {product['current_memory']}")
             print(f"🆔 ID: {product['product_id']}")
+        yield product
+
+def _print_parse_stats(stats):
+    timings = ', '.join(f"{name} {ms:.0f} мс" for name, ms in stats['timings_ms'].items())
+    print(f"📊 Карточек: {stats['cards_found']}, разобрано: {stats['cards_parsed']}, "
+          f"без изменений: {stats['cards_skipped']} (страниц {stats['pages_skipped']}), "
+          f"ошибок: {stats['cards_failed']} ({timings})")
+
+def main_catalog(html_path='site-html.txt', debug_dir=PARSER_DEBUG_DIR, parse_workers=PARSER_WORKERS,
+                 full=False):
+    """Основная функция для парсинга каталога (full=True - разобрать заново и неизменившиеся карточки)"""
+    parser = IPhoneCatalogParser(debug_dir=debug_dir, workers=parse_workers)
+    db = iPhoneDatabase()
+    known = ScrapeHashes() if full else db.load_scrape_hashes()
+    
+    # HTML читается из файла потоком: файл может содержать много склеенных страниц
+    if not os.path.exists(html_path):
+        print(f"❌ Файл {html_path} не найден")
+        return
+    print(f"📁 HTML читается из файла {html_path}, размер: {os.path.getsize(html_path)} байт")
+    
+    print("=== ПАРСИНГ КАТАЛОГА IPHONE ===")
+    
+    # Разбор и запись в базу идут одновременно, карточка за карточкой
+    products = _preview_products(parser.iter_catalog_cards(html_path, known=known))
+    saved = db.save_products(products, datetime.now().isoformat(), known=known)
+    _print_parse_stats(parser.last_stats.as_dict())
+    if saved:
+        print(f"\n💾 Весь каталог сохранен в базу данных")
+    else:
+        print("❌ Ошибка парсинга или сохранения каталога")
+
+def _save_product_pages(crawler, products, pages_dir):
+    """Страницы новых и изменившихся товаров в pages_dir/<product_id>.html"""
+    urls = {product['product_url']: product['product_id'] for product in products if product.get('product_url')}
+    pages = crawler.crawl_product_pages(urls)
+    os.makedirs(pages_dir, exist_ok=True)
+    for url, html in pages.items():
+        with open(os.path.join(pages_dir, f'{urls[url]}.html'), 'w', encoding='utf-8') as f:
+            f.write(html)
+    print(f"📄 Страниц товаров: {len(pages)} из {len(urls)} -> {pages_dir}")
+
+def main_crawl(base_url=SITE_URL, workers=4, rate_limit=4.0, max_pages=100, cache_path='crawl_cache.json',
+               debug_dir=PARSER_DEBUG_DIR, parse_workers=PARSER_WORKERS, full=False, product_pages_dir=None):
+    """Загрузка всех страниц каталога с сайта и сохранение в базу.
+    
+    С product_pages_dir загружаются и сохраняются страницы товаров,
+    карточки которых разобраны в этом запуске (новые и изменившиеся).
+    """
+    parser = IPhoneCatalogParser(debug_dir=debug_dir, workers=parse_workers)
+    db = iPhoneDatabase()
+    known = ScrapeHashes() if full else db.load_scrape_hashes()
+    crawler = CatalogCrawler(base_url, headers=parser.headers, max_workers=workers,
+                             rate_limit=rate_limit, cache_path=cache_path)
+    
+    print(f"=== ЗАГРУЗКА КАТАЛОГА {base_url} ===")
+    start = time.perf_counter()
+    try:
+        try:
+            pages = crawler.crawl_listing(max_pages=max_pages)
+        except requests.RequestException as e:
+            # Каталог загружен не полностью: не сохраняем, чтобы не удалить товары с незагруженных страниц
+            print(f"❌ Ошибка загрузки каталога: {e}")
+            return
+        print(f"📥 Страниц: {len(pages)}, запросов: {crawler.stats['requests']}, "
+              f"304: {crawler.stats['not_modified']}, ошибок: {crawler.stats['errors']}, "
+              f"{time.perf_counter() - start:.1f} с")
         
-        # Сохраняем в базу
-        if db.save_catalog(result):
-            print(f"\n💾 Весь каталог сохранен в базу данных")
-        else:
-            print("❌ Ошибка сохранения каталога в базу")
+        result = parser.parse_catalog_pages(pages, known)
+        _print_parse_stats(result['stats'])
+        if product_pages_dir and result.get('success'):
+            _save_product_pages(crawler, result['products'], product_pages_dir)
+    finally:
+        crawler.close()
+    if result.get('success') and db.save_catalog(result, known):
+        crawler.save_cache()
+        print(f"\n💾 Каталог из {len(pages)} страниц сохранен в базу данных")
     else:
-        print("❌ Ошибка парсинга каталога")
+        print("❌ Ошибка парсинга или сохранения каталога")
 
 def main_single():
     """Функция для парсинга одного товара (оригинальная)"""
@@ -331,8 +1038,30 @@ def main_single():
         print("❌ Ошибка парсинга одного товара")
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Парсинг каталога iPhone')
+    arg_parser.add_argument('--crawl', action='store_true', help='загрузить каталог с сайта вместо site-html.txt')
+    arg_parser.add_argument('--base-url', default=SITE_URL)
+    arg_parser.add_argument('--workers', type=int, default=4, help='параллельных запросов')
+    arg_parser.add_argument('--rate', type=float, default=4.0, help='запросов в секунду на хост')
+    arg_parser.add_argument('--max-pages', type=int, default=100)
+    arg_parser.add_argument('--html', default='site-html.txt', help='файл HTML каталога (можно несколько склеенных страниц)')
+    arg_parser.add_argument('--parse-workers', type=int, default=PARSER_WORKERS, help='процессов для разбора карточек')
+    arg_parser.add_argument('--log-level', default=PARSER_LOG_LEVEL, help='DEBUG - по строке на каждую карточку')
+    arg_parser.add_argument('--debug-dir', default=PARSER_DEBUG_DIR, help='сохранять отформатированный HTML страниц сюда')
+    arg_parser.add_argument('--full', action='store_true', help='разобрать все карточки, даже если HTML не изменился')
+    arg_parser.add_argument('--product-pages', help='с --crawl: сохранить страницы новых и изменившихся товаров в этот каталог')
+    args = arg_parser.parse_args()
+    
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                        level=args.log_level.upper())
+    
     # Запускаем парсинг каталога
-    main_catalog()
+    if args.crawl:
+        main_crawl(args.base_url, args.workers, args.rate, args.max_pages,
+                   debug_dir=args.debug_dir, parse_workers=args.parse_workers, full=args.full,
+                   product_pages_dir=args.product_pages)
+    else:
+        main_catalog(args.html, debug_dir=args.debug_dir, parse_workers=args.parse_workers, full=args.full)
     
     print("\n" + "="*50)
     
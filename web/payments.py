@@ -0,0 +1,261 @@
+# payments.py
+"""Создание платежей Coinbase Commerce вне обработки запроса.
+
+Оформление только записывает заказ со статусом 'new' вместе с запросом
+платежа (charge_request) и ключом идемпотентности, ставит заказ в
+ограниченную очередь и сразу отвечает; страница заказа опрашивает
+/api/orders/<id>/checkout и уходит на оплату, как только платеж создан.
+
+Платежи создают CHARGE_WORKERS потоков. У запроса к Coinbase таймаут
+CHARGE_TIMEOUT; сетевые ошибки, 429 и 5xx повторяются с растущей паузой
+и тем же заголовком Idempotency-Key, поэтому повтор после таймаута не
+создает второй платеж. Медленный Coinbase занимает только эти потоки,
+а не воркеры WSGI, а переполненная очередь сразу отвечает отказом.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+from coinbase_commerce.client import Client
+from coinbase_commerce.error import APIError
+
+from db import DB_PATH, connection
+
+# Потоков, создающих платежи (почти все время ждут ответа Coinbase), и заказов в очереди к ним
+CHARGE_WORKERS = int(os.environ.get('CHARGE_WORKERS', 16))
+CHARGE_QUEUE_SIZE = int(os.environ.get('CHARGE_QUEUE_SIZE', 256))
+# Таймаут одного запроса к Coinbase и число повторов, секунд
+CHARGE_TIMEOUT = float(os.environ.get('CHARGE_TIMEOUT', 10))
+CHARGE_RETRIES = int(os.environ.get('CHARGE_RETRIES', 3))
+CHARGE_BACKOFF = 0.5
+# Сколько раз браться за заказ после непредвиденной ошибки (сеть, SQLite), прежде чем пометить его 'failed'
+CHARGE_MAX_ATTEMPTS = int(os.environ.get('CHARGE_MAX_ATTEMPTS', 3))
+# Заказ 'new', не получивший платеж за столько секунд, ставится в очередь заново
+# (например, процесс перезапустился, пока заказ ждал в очереди)
+CHARGE_STALE_AFTER = float(os.environ.get('CHARGE_STALE_AFTER', 60))
+
+logger = logging.getLogger('payments')
+
+
+class CoinbaseClient(Client):
+    """Client Coinbase Commerce с таймаутом запросов (у библиотеки его нет)"""
+
+    def __init__(self, api_key, base_api_uri=None, timeout=CHARGE_TIMEOUT):
+        super().__init__(api_key, base_api_uri)
+        self.timeout = timeout
+
+    def _request(self, method, *relative_path_parts, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super()._request(method, *relative_path_parts, **kwargs)
+
+    def create_charge(self, charge_info, idempotency_key):
+        """(code, hosted_url) созданного платежа; APIError при ошибке"""
+        response = self.post('charges', data=charge_info, headers={'Idempotency-Key': idempotency_key})
+        charge = response.data['data']
+        return charge['code'], charge['hosted_url']
+
+
+def retryable(error):
+    """Стоит ли повторять запрос: сетевая ошибка или таймаут (нет HTTP-статуса), 429, 5xx"""
+    status = getattr(error, 'http_status', None)
+    return status is None or status == 429 or status >= 500
+
+
+def transient(error):
+    """Непредвиденная ошибка, после которой заказ стоит взять еще раз: сеть или занятая база.
+
+    Остальное (KeyError, ValueError на неожиданном ответе Coinbase и т. п.)
+    повторится и при следующей попытке.
+    """
+    return isinstance(error, (requests.RequestException, sqlite3.OperationalError))
+
+
+def create_order(conn, items, charge_info):
+    """Заказ 'new' из items [(product_id, qty, unit_price)] с запросом платежа charge_info(order_id).
+
+    Заказ, его товары (order_items), запрос платежа и ключ идемпотентности
+    пишутся одной транзакцией. Возвращает order_id.
+    """
+    price = sum(qty * unit_price for _, qty, unit_price in items)
+    with conn:
+        # orders.product_id (NOT NULL в исходной схеме) остается для совместимости: ID товаров через запятую
+        order_id = conn.execute(
+            'INSERT INTO orders (product_id, price, status, checkout_key) VALUES (?, ?, ?, ?)',
+            (','.join(product_id for product_id, _, _ in items), price, 'new', uuid.uuid4().hex)
+        ).lastrowid
+        conn.executemany(
+            'INSERT INTO order_items (order_id, product_id, qty, unit_price) VALUES (?, ?, ?, ?)',
+            [(order_id, product_id, qty, unit_price) for product_id, qty, unit_price in items]
+        )
+        conn.execute(
+            'UPDATE orders SET charge_request = ?, charge_requested_at = ? WHERE id = ?',
+            (json.dumps(charge_info(order_id), ensure_ascii=False), int(time.time()), order_id)
+        )
+    return order_id
+
+
+def stale_orders(conn, older_than=CHARGE_STALE_AFTER):
+    """ID заказов 'new', созданных больше older_than секунд назад (индекс idx_orders_status)"""
+    return [row[0] for row in conn.execute(
+        "SELECT id FROM orders WHERE status = 'new' AND created_at < datetime('now', ?) ORDER BY created_at",
+        (f'-{int(older_than)} seconds',)
+    )]
+
+
+def fail_order(conn, order_id, error):
+    """Платеж создать не удалось: заказ 'failed' с текстом ошибки"""
+    with conn:
+        conn.execute(
+            "UPDATE orders SET status = 'failed', charge_error = ? WHERE id = ? AND status = 'new'",
+            (error, order_id)
+        )
+
+
+class ChargeQueue:
+    """Ограниченная очередь заказов и пул потоков, создающих для них платежи"""
+
+    def __init__(self, client, db_path=DB_PATH, workers=CHARGE_WORKERS, maxsize=CHARGE_QUEUE_SIZE,
+                 retries=CHARGE_RETRIES, backoff=CHARGE_BACKOFF, max_attempts=CHARGE_MAX_ATTEMPTS):
+        self.client = client
+        self.db_path = db_path
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_attempts = max_attempts
+        self.stats = {'created': 0, 'failed': 0, 'retried': 0, 'rejected': 0}
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._in_flight = set()
+        # order_id -> число непредвиденных ошибок подряд
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, order_id):
+        """Постановка заказа в очередь; False, если очередь переполнена"""
+        with self._lock:
+            started = not self._threads
+            if started:
+                self._start()
+            queued = self._put(order_id)
+        if started:
+            self.requeue_stale()
+        return queued
+
+    def requeue_stale(self):
+        """Постановка в очередь заказов 'new', оставшихся без платежа (например, после перезапуска)"""
+        with connection(self.db_path) as conn:
+            order_ids = stale_orders(conn)
+        with self._lock:
+            return sum(self._put(order_id) for order_id in order_ids)
+
+    def _put(self, order_id):
+        if order_id in self._in_flight:
+            return True
+        try:
+            self._queue.put_nowait(order_id)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            return False
+        self._in_flight.add(order_id)
+        return True
+
+    def in_flight(self, order_id):
+        with self._lock:
+            return order_id in self._in_flight
+
+    def pending(self):
+        """Заказов в очереди и в работе"""
+        with self._lock:
+            return len(self._in_flight)
+
+    def _start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'charge-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            order_id = self._queue.get()
+            try:
+                self.process(order_id)
+                self._errors.pop(order_id, None)
+            except Exception as e:
+                logger.exception("Ошибка создания платежа для заказа %s", order_id)
+                self._give_up_or_retry(order_id, e)
+            finally:
+                with self._lock:
+                    self._in_flight.discard(order_id)
+                self._queue.task_done()
+
+    def process(self, order_id):
+        """Создание платежа заказа и перевод заказа 'new' в 'pending' (или 'failed').
+
+        Вебхук charge:created может прийти раньше, чем поток сохранит
+        результат (особенно после повтора по таймауту), и уже перевести
+        заказ в 'pending': код платежа и hosted_url все равно записываются,
+        а статус меняется, только если заказ еще 'new'.
+        """
+        with connection(self.db_path) as conn:
+            order = conn.execute(
+                'SELECT checkout_key, charge_request, charge_code, charge_error FROM orders WHERE id = ?',
+                (order_id,)
+            ).fetchone()
+        # Платеж уже сохранен или его создание не удалось
+        if order is None or order['charge_code'] or order['charge_error']:
+            return
+
+        # Соединение не держится, пока ждем Coinbase
+        try:
+            code, hosted_url = self._create_charge(json.loads(order['charge_request']), order['checkout_key'])
+        except APIError as e:
+            logger.warning("Платеж для заказа %s не создан: %s", order_id, e)
+            self.stats['failed'] += 1
+            with connection(self.db_path) as conn:
+                fail_order(conn, order_id, str(e).strip().split('\n')[0][:200] or type(e).__name__)
+            return
+
+        with connection(self.db_path) as conn, conn:
+            conn.execute('''
+                UPDATE orders SET charge_code = ?, hosted_url = ?,
+                    status = CASE WHEN status = 'new' THEN 'pending' ELSE status END
+                WHERE id = ?
+            ''', (code, hosted_url, order_id))
+        self.stats['created'] += 1
+
+    def _give_up_or_retry(self, order_id, error):
+        """После непредвиденной ошибки: заказ 'failed', если ошибка не временная или попытки кончились.
+
+        Иначе заказ остается 'new' и вернется в очередь через requeue_stale.
+        """
+        with self._lock:
+            attempts = self._errors[order_id] = self._errors.get(order_id, 0) + 1
+        if transient(error) and attempts < self.max_attempts:
+            return
+        self._errors.pop(order_id, None)
+        self.stats['failed'] += 1
+        try:
+            with connection(self.db_path) as conn:
+                fail_order(conn, order_id, f"{type(error).__name__}: {error}"[:200])
+        except sqlite3.Error:
+            logger.exception("Не удалось пометить заказ %s как failed", order_id)
+
+    def _create_charge(self, charge_info, idempotency_key):
+        for attempt in range(self.retries + 1):
+            try:
+                return self.client.create_charge(charge_info, idempotency_key)
+            except APIError as e:
+                if attempt == self.retries or not retryable(e):
+                    raise
+                self.stats['retried'] += 1
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def join(self):
+        """Ожидание обработки всех поставленных заказов"""
+        self._queue.join()
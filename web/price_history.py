@@ -0,0 +1,129 @@
+# price_history.py
+"""История цен каталога.
+
+Таблица price_history (WITHOUT ROWID, первичный ключ (product_id, ts))
+хранит точки одного товара подряд и по времени, поэтому история товара
+за период и цена на дату читаются одним поиском по B-дереву. Точка
+добавляется при сохранении выгрузки, только если цена или старая цена
+товара изменились; ts - секунды Unix, old_price - число, а не текст.
+"""
+import re
+import time
+from datetime import datetime
+
+DAY = 86400
+
+_DIGITS = re.compile(r'\d+')
+
+
+def parse_price(text):
+    """Цена из текста вида "62 990 руб." (None, если цифр нет)"""
+    if not text:
+        return None
+    digits = ''.join(_DIGITS.findall(str(text)))
+    return int(digits) if digits else None
+
+
+def timestamp(value=None):
+    """Секунды Unix для ISO-даты (как parsed_at в выгрузке) или текущего времени"""
+    if value is None:
+        return int(time.time())
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def record_price_changes(cursor, rows_sql, ts):
+    """Точки истории для строк (product_id, price, old_price) из подзапроса rows_sql.
+
+    Пишутся только строки, отличающиеся от последней точки товара;
+    повторное сохранение в ту же секунду заменяет точку. Возвращает
+    число записанных точек.
+    """
+    return cursor.execute(f'''
+        INSERT INTO price_history (product_id, ts, price, old_price)
+        SELECT r.product_id, ?, r.price, r.old_price FROM ({rows_sql}) r
+        WHERE NOT EXISTS (
+            SELECT 1 FROM (SELECT price, old_price FROM price_history h
+                           WHERE h.product_id = r.product_id ORDER BY h.ts DESC LIMIT 1) last
+            WHERE last.price IS r.price AND last.old_price IS r.old_price
+        )
+        ON CONFLICT (product_id, ts) DO UPDATE SET
+            price = excluded.price,
+            old_price = excluded.old_price
+    ''', (ts,)).rowcount
+
+
+def price_points(conn, product_id, days=None, now=None):
+    """[(ts, price, old_price)] товара за последние days дней по возрастанию ts.
+
+    Первой идет точка, действовавшая на начало периода (даже если она
+    записана раньше), чтобы минимум и максимум учитывали и ее.
+    """
+    if days is None:
+        return conn.execute(
+            'SELECT ts, price, old_price FROM price_history WHERE product_id = ? ORDER BY ts',
+            (product_id,)
+        ).fetchall()
+    since = (timestamp() if now is None else now) - days * DAY
+    return conn.execute('''
+        SELECT ts, price, old_price FROM price_history
+        WHERE product_id = ? AND ts >= (
+            SELECT COALESCE(MAX(ts), 0) FROM price_history WHERE product_id = ? AND ts <= ?
+        )
+        ORDER BY ts
+    ''', (product_id, product_id, since)).fetchall()
+
+
+def price_summary(points):
+    """Минимум, максимум, первая и последняя цена по точкам price_points (None, если точек нет)"""
+    if not points:
+        return None
+    prices = [point[1] for point in points]
+    first, last = prices[0], prices[-1]
+    return {
+        'min': min(prices),
+        'max': max(prices),
+        'first': first,
+        'last': last,
+        'change': last - first,
+        'change_percent': round((last - first) * 100 / first, 1) if first else 0,
+        'changes': len(points) - 1,
+        'points': [
+            {'ts': ts, 'price': price, 'old_price': old_price}
+            for ts, price, old_price in points
+        ],
+    }
+
+
+def price_drops(conn, days=7, limit=20, now=None):
+    """Товары каталога, подешевевшие за последние days дней, по убыванию скидки в процентах.
+
+    Текущая цена сравнивается с ценой, действовавшей на начало периода;
+    смотрятся только товары, у которых за период есть точки (индекс по ts).
+    """
+    since = (timestamp() if now is None else now) - days * DAY
+    rows = conn.execute('''
+        SELECT product_id, model, price, was_price, changed_at FROM (
+            SELECT c.product_id, c.model, c.price,
+                   (SELECT h.price FROM price_history h
+                    WHERE h.product_id = c.product_id AND h.ts < ?
+                    ORDER BY h.ts DESC LIMIT 1) AS was_price,
+                   (SELECT MAX(h.ts) FROM price_history h WHERE h.product_id = c.product_id) AS changed_at
+            FROM iphones_catalog c
+            WHERE c.product_id IN (SELECT product_id FROM price_history WHERE ts >= ?)
+        )
+        WHERE price > 0 AND was_price > price
+        ORDER BY (was_price - price) * 1.0 / was_price DESC, product_id
+        LIMIT ?
+    ''', (since, since, limit)).fetchall()
+    return [
+        {
+            'product_id': product_id,
+            'model': model,
+            'price': price,
+            'was_price': was_price,
+            'drop': was_price - price,
+            'drop_percent': round((was_price - price) * 100 / was_price, 1),
+            'changed_at': changed_at,
+        }
+        for product_id, model, price, was_price, changed_at in rows
+    ]
@@ -0,0 +1,87 @@
+# search.py
+"""Полнотекстовый поиск по каталогу (SQLite FTS5).
+
+Текст товара и поисковый запрос приводятся к одному виду: нижний
+регистр, число отделено от единиц ("256Gb" -> "256 gb"), русские
+названия заменены латинскими ("айфон" -> "iphone", "гб" -> "gb"),
+поэтому "айфон 17 про 256 гб" находит "iPhone 17 Pro 256Gb".
+"""
+import re
+
+# Русское написание -> как слово выглядит в каталоге
+SEARCH_SYNONYMS = {
+    'айфон': 'iphone', 'айфоны': 'iphone', 'айфона': 'iphone', 'iphones': 'iphone',
+    'про': 'pro', 'макс': 'max', 'плюс': 'plus', 'мини': 'mini', 'эйр': 'air',
+    'гб': 'gb', 'гиг': 'gb', 'тб': 'tb',
+    'сим': 'sim', 'есим': 'esim', 'нано': 'nano',
+    'черный': 'black', 'чёрный': 'black', 'белый': 'white', 'синий': 'blue',
+    'голубой': 'blue', 'серебристый': 'silver', 'серебро': 'silver', 'золотой': 'gold',
+    'розовый': 'pink', 'зеленый': 'green', 'зелёный': 'green', 'оранжевый': 'orange',
+    'фиолетовый': 'purple', 'желтый': 'yellow', 'жёлтый': 'yellow', 'красный': 'red',
+}
+
+# Веса колонок для bm25(): совпадение в модели важнее совпадения в цвете
+RANK_WEIGHTS = (10.0, 2.0, 2.0, 1.0, 1.0)
+
+_WORD = re.compile(r'\w+')
+_NUMBER_UNIT = re.compile(r'(?<=\d)(?=[^\W\d])|(?<=[^\W\d])(?=\d)')
+
+
+def normalize(text):
+    """Слова текста в поисковом виде"""
+    if not text:
+        return []
+    text = _NUMBER_UNIT.sub(' ', text.casefold().replace('ё', 'е'))
+    return [SEARCH_SYNONYMS.get(word, word) for word in _WORD.findall(text)]
+
+
+def search_document(model, colors, memory, sim, category):
+    """Колонки строки catalog_search для одного товара"""
+    return tuple(' '.join(normalize(value)) for value in (model, colors, memory, sim, category))
+
+
+def fts_query(search):
+    """Запрос MATCH: все слова обязательны, каждое ищется по префиксу"""
+    words = normalize(search)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+_DOCUMENT_ROWS = '''
+    SELECT ic.id, ic.model, ic.current_color, ic.current_memory, ic.current_sim, ic.category,
+           (SELECT GROUP_CONCAT(color_name, ' ') FROM iphone_catalog_colors
+            WHERE product_id = ic.product_id),
+           (SELECT GROUP_CONCAT(memory_size, ' ') FROM iphone_catalog_memory
+            WHERE product_id = ic.product_id)
+    FROM iphones_catalog ic
+'''
+
+
+def rebuild_search_index(cursor):
+    """Полная пересборка catalog_search (rowid = iphones_catalog.id)"""
+    rows = cursor.execute(_DOCUMENT_ROWS).fetchall()
+    cursor.execute('DELETE FROM catalog_search')
+    return _insert_documents(cursor, rows)
+
+
+def update_search_index(cursor, product_ids_sql):
+    """Пересборка строк catalog_search только для товаров из подзапроса product_ids_sql"""
+    rows = cursor.execute(f'{_DOCUMENT_ROWS} WHERE ic.product_id IN ({product_ids_sql})').fetchall()
+    cursor.execute(f'''
+        DELETE FROM catalog_search WHERE rowid IN
+            (SELECT id FROM iphones_catalog WHERE product_id IN ({product_ids_sql}))
+    ''')
+    return _insert_documents(cursor, rows)
+
+
+def _insert_documents(cursor, rows):
+    cursor.executemany(
+        'INSERT INTO catalog_search (rowid, model, colors, memory, sim, category) VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (row_id,) + search_document(model, f'{current_color or ""} {colors or ""}',
+                                        f'{current_memory or ""} {memory or ""}', sim, category)
+            for row_id, model, current_color, current_memory, sim, category, colors, memory in rows
+        ]
+    )
+    return len(rows)
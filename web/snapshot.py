@@ -0,0 +1,168 @@
+# snapshot.py
+from bisect import bisect_left, bisect_right
+from types import MappingProxyType
+
+from api_json import dumps
+from facets import FacetIndex
+from search import normalize
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога в памяти.
+
+    Строится один раз на версию каталога (см. db.get_catalog_version)
+    из уже отформатированных товаров и отвечает на запросы списка,
+    категорий, рекомендуемых товаров и товара по ID без обращения к БД.
+    """
+
+    def __init__(self, products, version):
+        self.version = version
+        self.products = tuple(products)
+        self.by_id = MappingProxyType({p['product_id']: p for p in self.products})
+        # Готовый JSON товаров для API (байты UTF-8)
+        self.product_json = MappingProxyType({p['product_id']: dumps(p) for p in self.products})
+
+        # Слова товара в поисковом виде (те же колонки, что и в catalog_search)
+        self._search_words = {
+            p['product_id']: tuple(set(normalize(' '.join(filter(None, (
+                p['model'], p['current_color'], p['all_colors'], p['current_memory'],
+                p['all_memory'], p['current_sim'], p['category'],
+            )))))) for p in self.products
+        }
+
+        counts = {}
+        for product in self.products:
+            counts[product['category']] = counts.get(product['category'], 0) + 1
+        self.categories = tuple(
+            {'name': name, 'count': count}
+            for name, count in sorted(counts.items(), key=lambda item: -item[1])
+        )
+
+        # Товары по возрастанию (колонка, product_id) и ключи для бинарного поиска курсора
+        self._ascending = {}
+        for column in ('price', 'model', 'display_order'):
+            ordered = sorted(self.products, key=lambda p: (p[column], p['product_id']))
+            self._ascending[column] = (ordered, [(p[column], p['product_id']) for p in ordered])
+
+        # Заранее отсортированные представления для всех вариантов сортировки
+        self._sorted = {
+            'price_asc': self._ascending['price'][0],
+            'price_desc': self._ascending['price'][0][::-1],
+            'name': self._ascending['model'][0],
+            'display_order': self._ascending['display_order'][0],
+        }
+        self._by_category = {}
+        for product in self._sorted['price_desc']:
+            self._by_category.setdefault(product['category'], []).append(product)
+        self.featured = tuple(p for p in self._sorted['price_desc'] if p['is_featured'] == 1)
+        self.facets = FacetIndex(self._sorted['price_desc'])
+        facet_positions = {p['product_id']: i for i, p in enumerate(self.facets.products)}
+        self._facet_orders = {
+            sort_by: [facet_positions[p['product_id']] for p in products]
+            for sort_by, products in self._sorted.items() if sort_by != 'price_desc'
+        }
+
+    def get_all_products(self, category=None, sort_by='price_desc', search=None):
+        """Товары с фильтрацией, как в iPhoneCatalog.get_all_products"""
+        products = self._sorted.get(sort_by, self._sorted['display_order'])
+        words = normalize(search)
+        if (category and category != 'all') or words:
+            return [p for p in products if self._matches(p, category, words)]
+        return list(products)
+
+    def get_products_page(self, category, search, column, descending, after, limit):
+        """Не больше limit товаров, идущих в сортировке сразу после курсора after"""
+        ordered, keys = self._ascending[column]
+        if descending:
+            start = bisect_left(keys, tuple(after)) - 1 if after else len(ordered) - 1
+            positions = range(start, -1, -1)
+        else:
+            start = bisect_right(keys, tuple(after)) if after else 0
+            positions = range(start, len(ordered))
+
+        words = normalize(search)
+        page = []
+        for position in positions:
+            product = ordered[position]
+            if self._matches(product, category, words):
+                page.append(product)
+                if len(page) >= limit:
+                    break
+        return page
+
+    def _matches(self, product, category, words):
+        if category and category != 'all' and product['category'] != category:
+            return False
+        # Как в FTS5-запросе: каждое слово запроса - префикс какого-то слова товара
+        if words:
+            product_words = self._search_words[product['product_id']]
+            return all(any(w.startswith(word) for w in product_words) for word in words)
+        return True
+
+    def get_faceted_products(self, filters, search=None, sort_by='price_desc', limit=None):
+        """Товары по фасетным фильтрам и счетчики всех фасетов"""
+        words = normalize(search)
+        base = self.facets.bits_for(lambda p: self._matches(p, None, words)) if words else None
+        bits, counts = self.facets.filter(filters, base)
+
+        # Позиции в индексе идут в порядке price_desc, для остальных сортировок - своя перестановка
+        if sort_by == 'price_desc':
+            order = None
+        else:
+            order = self._facet_orders.get(sort_by, self._facet_orders['display_order'])
+
+        return {
+            'total': self.facets.count(bits),
+            'products': self.facets.products_for(bits, order, limit),
+            'facets': counts,
+        }
+
+    def to_json(self, products):
+        """JSON товаров: готовый для товаров этого снимка, остальные сериализуются"""
+        by_id, product_json = self.by_id, self.product_json
+        return [
+            product_json[p['product_id']] if by_id.get(p['product_id']) is p else dumps(p)
+            for p in products
+        ]
+
+    def get_categories(self):
+        return [dict(category) for category in self.categories]
+
+    def count_products(self, category=None, search=None):
+        words = normalize(search)
+        if words:
+            return sum(1 for p in self.products if self._matches(p, category, words))
+        if category and category != 'all':
+            return len(self._by_category.get(category, ()))
+        return len(self.products)
+
+    def get_similar_products(self, product, limit=4):
+        similar = []
+        for candidate in self._by_category.get(product['category'], ()):
+            if len(similar) >= limit:
+                break
+            if candidate['category'] == product['category'] and candidate['product_id'] != product['product_id']:
+                similar.append(candidate)
+        return similar
+
+    def get_featured_products(self, limit=6):
+        return list(self.featured[:limit])
+
+    def get_product_by_id(self, product_id):
+        product = self.by_id.get(product_id)
+        if product is None:
+            return None
+
+        # Страница товара не подставляет текущий цвет/память вместо пустых списков
+        product = dict(product)
+        product['colors_list'] = product['all_colors'].split(',') if product['all_colors'] else []
+        product['memory_list'] = product['all_memory'].split(',') if product['all_memory'] else []
+        return product
+
+    def get_products_by_ids(self, product_ids):
+        products = {}
+        for product_id in product_ids:
+            product = self.get_product_by_id(product_id)
+            if product is not None:
+                products[product_id] = product
+        return products
@@ -0,0 +1,118 @@
+# subscriptions.py
+"""Подписки пользователей бота на товар или модель и события каталога.
+
+Подписка - (kind, target, chat_id): kind 'product' - target это
+product_id, kind 'model' - название модели как в каталоге. При
+сохранении выгрузки iPhoneDatabase записывает в catalog_events
+подешевевшие и снова появившиеся товары, бот (notifier.py) рассылает
+их подписчикам и удаляет события, сообщения о которых доставлены.
+"""
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import parse_qsl
+
+SUBSCRIPTION_KINDS = ('product', 'model')
+# Сколько подписок может быть у одного чата
+MAX_SUBSCRIPTIONS_PER_CHAT = 50
+
+
+def subscribe(conn, chat_id, kind, target):
+    """Подписка чата; False, если kind неизвестен или подписок уже слишком много"""
+    if kind not in SUBSCRIPTION_KINDS or not target:
+        return False
+    count = conn.execute('SELECT COUNT(*) FROM subscriptions WHERE chat_id = ?', (chat_id,)).fetchone()[0]
+    if count >= MAX_SUBSCRIPTIONS_PER_CHAT:
+        return False
+    with conn:
+        conn.execute('''
+            INSERT OR IGNORE INTO subscriptions (kind, target, chat_id, created_at) VALUES (?, ?, ?, ?)
+        ''', (kind, target, chat_id, int(time.time())))
+    return True
+
+
+def unsubscribe(conn, chat_id, kind=None, target=None):
+    """Отписка от одной цели или (без kind) от всего; возвращает число удаленных подписок"""
+    with conn:
+        if kind is None:
+            return conn.execute('DELETE FROM subscriptions WHERE chat_id = ?', (chat_id,)).rowcount
+        return conn.execute(
+            'DELETE FROM subscriptions WHERE kind = ? AND target = ? AND chat_id = ?', (kind, target, chat_id)
+        ).rowcount
+
+
+def list_subscriptions(conn, chat_id):
+    """[(kind, target)] подписок чата"""
+    return conn.execute(
+        'SELECT kind, target FROM subscriptions WHERE chat_id = ? ORDER BY created_at', (chat_id,)
+    ).fetchall()
+
+
+def record_catalog_events(cursor, rows_sql, ts):
+    """События для строк (product_id, model, was_price, price, is_new) из подзапроса rows_sql.
+
+    'in_stock' - товар появился в каталоге (впервые или после удаления),
+    'price_drop' - цена стала ниже прежней. Вызывается в транзакции
+    записи до обновления цен в iphones_catalog.
+    """
+    return cursor.execute(f'''
+        INSERT INTO catalog_events (ts, kind, product_id, model, was_price, price)
+        SELECT ?, CASE WHEN r.is_new THEN 'in_stock' ELSE 'price_drop' END,
+               r.product_id, r.model, r.was_price, r.price
+        FROM ({rows_sql}) r
+        WHERE r.is_new OR (r.price > 0 AND r.price < r.was_price)
+    ''', (ts,)).rowcount
+
+
+def queue_notifications(conn, last_event_id):
+    """Временная таблица notify_queue (chat_id, event_id, kind, product_id, model, was_price, price).
+
+    В ней неразосланные события до last_event_id для всех подписчиков и
+    недоставленные в прошлый раз сообщения (notification_retries). Строки
+    идут по чатам, поэтому все события одного чата можно собрать в одно
+    сообщение; чат, подписанный и на товар, и на его модель, получает
+    событие один раз. Таблица заполняется одним запросом, и рассылка
+    читает ее, не держа открытым чтение основной базы. Возвращает число строк.
+    """
+    conn.execute('DROP TABLE IF EXISTS temp.notify_queue')
+    with conn:
+        conn.execute('''
+            CREATE TEMP TABLE notify_queue AS
+            SELECT s.chat_id, e.id AS event_id, e.kind, e.product_id, e.model, e.was_price, e.price
+            FROM catalog_events e
+            JOIN subscriptions s ON s.kind = 'product' AND s.target = e.product_id
+            WHERE e.id <= ? AND e.notified_at IS NULL
+            UNION
+            SELECT s.chat_id, e.id, e.kind, e.product_id, e.model, e.was_price, e.price
+            FROM catalog_events e
+            JOIN subscriptions s ON s.kind = 'model' AND s.target = e.model
+            WHERE e.id <= ? AND e.notified_at IS NULL
+            UNION
+            SELECT r.chat_id, e.id, e.kind, e.product_id, e.model, e.was_price, e.price
+            FROM notification_retries r
+            JOIN catalog_events e ON e.id = r.event_id
+            ORDER BY 1, 2
+        ''', (last_event_id, last_event_id))
+        conn.execute('CREATE INDEX temp.idx_notify_queue_chat ON notify_queue (chat_id)')
+    return conn.execute('SELECT COUNT(*) FROM temp.notify_queue').fetchone()[0]
+
+
+def telegram_user(init_data, bot_token, max_age=86400):
+    """Пользователь из initData Telegram Web App (None, если подпись неверна или устарела)"""
+    if not init_data or not bot_token:
+        return None
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received = fields.pop('hash', '')
+    check = '\n'.join(f'{key}={value}' for key, value in sorted(fields.items()))
+    secret = hmac.new(b'WebAppData', bot_token.encode('utf-8'), hashlib.sha256).digest()
+    expected = hmac.new(secret, check.encode('utf-8'), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, received):
+        return None
+    try:
+        if max_age and time.time() - int(fields.get('auth_date', 0)) > max_age:
+            return None
+        user = json.loads(fields.get('user', 'null'))
+    except ValueError:
+        return None
+    return user if isinstance(user, dict) and 'id' in user else None
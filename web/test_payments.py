@@ -0,0 +1,90 @@
+# test_payments.py
+"""Гонка вебхука charge:created и потока, создающего платеж.
+
+Запуск: python -m pytest test_payments.py
+"""
+import json
+import sqlite3
+
+import pytest
+
+from db import connection
+from migrations import migrate
+from payments import ChargeQueue, create_order
+from webhooks import append_event, apply_events
+
+CHARGE_CODE = 'ABCD1234'
+HOSTED_URL = 'https://commerce.coinbase.com/charges/ABCD1234'
+
+
+def charge_event(event_id, event_type, order_id):
+    return {'id': event_id, 'type': event_type,
+            'data': {'code': CHARGE_CODE, 'metadata': {'order_id': str(order_id)}}}
+
+
+def receive_webhook(db_path, event):
+    with connection(db_path) as conn:
+        append_event(conn, event, json.dumps(event))
+        apply_events(conn)
+
+
+class StubClient:
+    """Coinbase, у которого платеж создается всегда; before_return - вызов перед ответом"""
+
+    def __init__(self, before_return=None):
+        self.before_return = before_return
+
+    def create_charge(self, charge_info, idempotency_key):
+        if self.before_return:
+            self.before_return()
+        return CHARGE_CODE, HOSTED_URL
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'catalog.db')
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def order_id(db_path):
+    with connection(db_path) as conn:
+        return create_order(conn, [('iphone-15', 1, 1000)],
+                            lambda order_id: {'name': 'iPhone 15', 'metadata': {'order_id': order_id}})
+
+
+def order(db_path, order_id):
+    with connection(db_path) as conn:
+        return dict(conn.execute(
+            'SELECT status, charge_code, hosted_url FROM orders WHERE id = ?', (order_id,)
+        ).fetchone())
+
+
+def test_webhook_before_process(db_path, order_id):
+    receive_webhook(db_path, charge_event('evt-1', 'charge:created', order_id))
+    assert order(db_path, order_id)['status'] == 'pending'
+
+    ChargeQueue(StubClient(), db_path).process(order_id)
+
+    assert order(db_path, order_id) == {'status': 'pending', 'charge_code': CHARGE_CODE, 'hosted_url': HOSTED_URL}
+
+
+def test_webhook_while_creating_charge(db_path, order_id):
+    client = StubClient(lambda: receive_webhook(db_path, charge_event('evt-1', 'charge:created', order_id)))
+
+    ChargeQueue(client, db_path).process(order_id)
+
+    assert order(db_path, order_id) == {'status': 'pending', 'charge_code': CHARGE_CODE, 'hosted_url': HOSTED_URL}
+
+
+def test_process_keeps_later_status(db_path, order_id):
+    receive_webhook(db_path, charge_event('evt-1', 'charge:created', order_id))
+    receive_webhook(db_path, charge_event('evt-2', 'charge:confirmed', order_id))
+
+    ChargeQueue(StubClient(), db_path).process(order_id)
+
+    # Код платежа записан, статус не откатился к 'pending'
+    assert order(db_path, order_id) == {'status': 'paid', 'charge_code': CHARGE_CODE, 'hosted_url': HOSTED_URL}
@@ -0,0 +1,203 @@
+# webhooks.py
+"""Прием вебхуков Coinbase Commerce и перевод заказов по статусам.
+
+Проверенное событие целиком дописывается в журнал webhook_events одной
+вставкой (INSERT OR IGNORE по id события: повторная доставка того же
+события ничего не меняет), и запрос сразу получает 200. Статусы заказов
+меняет WebhookApplier: пачками по WEBHOOK_BATCH событий в порядке
+получения, в одной транзакции на пачку.
+
+Статус заказа только растет по ORDER_STATUS_RANK: событие, пришедшее
+позже более "старшего" (например, charge:pending после charge:confirmed),
+заказ не меняет, поэтому порядок доставки и повторы не важны.
+"""
+import logging
+import os
+import threading
+import time
+
+from db import DB_PATH, connection
+
+# Событий в одной транзакции применения и пауза между проверками журнала, секунд
+WEBHOOK_BATCH = int(os.environ.get('WEBHOOK_BATCH', 500))
+WEBHOOK_APPLY_INTERVAL = float(os.environ.get('WEBHOOK_APPLY_INTERVAL', 1.0))
+# Сколько секунд после первого нового события копить следующие, прежде чем применять пачку
+WEBHOOK_APPLY_DELAY = float(os.environ.get('WEBHOOK_APPLY_DELAY', 0.1))
+# Сколько дней хранить примененные события (Coinbase повторяет доставку до 3 дней)
+WEBHOOK_KEEP_DAYS = int(os.environ.get('WEBHOOK_KEEP_DAYS', 30))
+
+# Статус заказа после события Coinbase Commerce
+EVENT_STATUSES = {
+    'charge:created': 'pending',
+    'charge:pending': 'processing',
+    'charge:failed': 'failed',
+    'charge:delayed': 'delayed',
+    'charge:confirmed': 'paid',
+    'charge:resolved': 'paid',
+}
+
+# Порядок статусов: заказ переходит только в статус с большим рангом.
+# failed - счет истек без оплаты; delayed - оплата пришла после истечения
+# и ждет решения (charge:resolved), поэтому она старше failed.
+ORDER_STATUS_RANK = {
+    'new': 0,
+    'pending': 1,
+    'processing': 2,
+    'failed': 3,
+    'delayed': 4,
+    'paid': 5,
+}
+
+logger = logging.getLogger('webhooks')
+
+
+def _order_id(value):
+    """ID заказа из metadata.order_id; None, если это не целое число (заказ найдется по коду платежа)"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def append_event(conn, event, payload):
+    """Запись проверенного события в журнал; False, если событие с таким id уже было.
+
+    Вставка идет с synchronous=FULL: после ответа 200 Coinbase событие
+    больше не пришлет, поэтому оно должно пережить и сбой питания.
+    """
+    data = event.get('data')
+    if not isinstance(data, dict):
+        # Событие все равно записывается (иначе Coinbase будет повторять его), но заказ у него не найдется
+        logger.warning("Событие %s без объекта data, заказ не определить", event.get('id'))
+        data = {}
+    metadata = data.get('metadata')
+    order_id = _order_id(metadata.get('order_id') if isinstance(metadata, dict) else None)
+    conn.execute('PRAGMA synchronous=FULL')
+    try:
+        with conn:
+            inserted = conn.execute('''
+                INSERT OR IGNORE INTO webhook_events (event_id, type, order_id, charge_code, payload, received_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (event['id'], event['type'], order_id, data.get('code'),
+                  payload, int(time.time()))).rowcount
+    finally:
+        conn.execute('PRAGMA synchronous=NORMAL')
+    return inserted == 1
+
+
+def next_status(current, event_type):
+    """Статус заказа после события (current, если событие его не повышает)"""
+    status = EVENT_STATUSES.get(event_type)
+    if status is None or ORDER_STATUS_RANK.get(status, -1) <= ORDER_STATUS_RANK.get(current, -1):
+        return current
+    return status
+
+
+def apply_events(conn, limit=WEBHOOK_BATCH):
+    """Применение до limit непримененных событий одной транзакцией; возвращает счетчики.
+
+    BEGIN IMMEDIATE: несколько процессов приложения не применят одну пачку дважды.
+    """
+    stats = {'events': 0, 'orders': 0, 'unknown': 0}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        events = conn.execute('''
+            SELECT id, type, order_id, charge_code FROM webhook_events
+            WHERE applied_at IS NULL ORDER BY id LIMIT ?
+        ''', (limit,)).fetchall()
+        if not events:
+            conn.commit()
+            return stats
+
+        # Событие без order_id в metadata ищет заказ по коду платежа
+        codes = {code for _, _, order_id, code in events if order_id is None and code}
+        by_code = dict(conn.execute(
+            f"SELECT charge_code, id FROM orders WHERE charge_code IN ({','.join('?' * len(codes))})", tuple(codes)
+        ).fetchall()) if codes else {}
+
+        order_ids = {order_id if order_id is not None else by_code.get(code) for _, _, order_id, code in events}
+        order_ids.discard(None)
+        current = dict(conn.execute(
+            f"SELECT id, status FROM orders WHERE id IN ({','.join('?' * len(order_ids))})", tuple(order_ids)
+        ).fetchall()) if order_ids else {}
+
+        statuses = dict(current)
+        for _, event_type, order_id, code in events:
+            order_id = order_id if order_id is not None else by_code.get(code)
+            if order_id not in statuses:
+                stats['unknown'] += 1
+                continue
+            statuses[order_id] = next_status(statuses[order_id], event_type)
+
+        changed = [(status, order_id) for order_id, status in statuses.items() if status != current[order_id]]
+        conn.executemany('UPDATE orders SET status = ? WHERE id = ?', changed)
+        conn.execute('UPDATE webhook_events SET applied_at = ? WHERE id BETWEEN ? AND ? AND applied_at IS NULL',
+                     (int(time.time()), events[0][0], events[-1][0]))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    stats['events'] = len(events)
+    stats['orders'] = len(changed)
+    return stats
+
+
+def prune_events(conn, days=WEBHOOK_KEEP_DAYS):
+    """Удаление событий, примененных больше days дней назад"""
+    with conn:
+        return conn.execute(
+            'DELETE FROM webhook_events WHERE applied_at < ?', (int(time.time()) - days * 86400,)
+        ).rowcount
+
+
+class WebhookApplier:
+    """Фоновый поток, применяющий журнал вебхуков пачками.
+
+    wake() будит его после записи события (с задержкой delay, чтобы
+    собрать пачку); без событий он
+    проверяет журнал раз в interval секунд (события, записанные другими
+    процессами приложения, тоже применяются).
+    """
+
+    def __init__(self, db_path=DB_PATH, batch=WEBHOOK_BATCH, interval=WEBHOOK_APPLY_INTERVAL,
+                 delay=WEBHOOK_APPLY_DELAY):
+        self.db_path = db_path
+        self.batch = batch
+        self.interval = interval
+        self.delay = delay
+        self.stats = {'events': 0, 'orders': 0, 'unknown': 0, 'batches': 0}
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='webhook-applier', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def drain(self):
+        """Применение всех событий журнала в текущем потоке"""
+        with connection(self.db_path) as conn:
+            while True:
+                stats = apply_events(conn, self.batch)
+                if not stats['events']:
+                    break
+                self.stats['batches'] += 1
+                for key in ('events', 'orders', 'unknown'):
+                    self.stats[key] += stats[key]
+            if time.monotonic() - self._pruned_at > 3600:
+                self._pruned_at = time.monotonic()
+                prune_events(conn)
+
+    def _run(self):
+        while True:
+            if self._wake.wait(self.interval):
+                time.sleep(self.delay)
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception:
+                logger.exception("Ошибка применения вебхуков")
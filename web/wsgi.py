@@ -1 +1,31 @@
-from app import app
+# wsgi.py
+"""WSGI-точка входа: gunicorn -c gunicorn.conf.py wsgi:app
+
+При импорте загружает снимок каталога, шаблоны и хэши статики, чтобы с
+preload_app мастер gunicorn сделал это один раз до fork, а воркеры
+получили готовое (страницы памяти общие, пока их не изменят).
+"""
+import gc
+import os
+
+import db
+from app import app, catalog, static_hash
+
+
+def preload():
+    """Снимок каталога, скомпилированные шаблоны и хэши статики в памяти процесса; возвращает версию каталога"""
+    version = catalog.snapshot(recheck=True).version if catalog.use_snapshot else catalog.version()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    for filename in os.listdir(app.static_folder):
+        static_hash(filename)
+    # Соединения SQLite нельзя переносить через fork: воркеры откроют свои
+    db.configure(db.DB_POOL_SIZE)
+    # Загруженное больше не просматривается сборщиком мусора, и его страницы не копируются в воркерах
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+    return version
+
+
+preload()